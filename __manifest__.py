@@ -15,7 +15,7 @@ Long description of module's purpose
     # Check https://github.com/odoo/odoo/blob/15.0/odoo/addons/base/data/ir_module_category_data.xml
     # for the full list
     'category': 'Uncategorized',
-    'version': '0.1',
+    'version': '0.2',
 
     # any module necessary for this one to work correctly
     'depends': ['base','mail','website',],
@@ -25,22 +25,48 @@ Long description of module's purpose
         'security/security.xml',
          'security/ir.model.access.csv',
         'data/secquence.xml',
+        'data/mail_template.xml',
+        'data/ir_cron.xml',
         'views/views.xml',
         'views/templates.xml',
         'views/student.xml',
+        'views/student_duplicate.xml',
         'views/university.xml',
         'views/application.xml',
+        'views/stage_report.xml',
+        'views/sla.xml',
+        'views/intake_demand.xml',
+        'views/success_stats.xml',
         'views/document.xml',
+        'views/checklist.xml',
         'views/payment.xml',
+        'views/payment_plan.xml',
         'views/consaltant.xml',
         'views/crouse.xml',
+        'views/catalog.xml',
+        'views/inquiry.xml',
         'views/invoice.xml',
+        'views/invoicing_run.xml',
         'views/invoice_report.xml',
+        'views/receivable_aging.xml',
+        'views/report_export.xml',
+        'views/retention.xml',
+        'views/outbox.xml',
         'views/dashboard.xml',
         'views/portal.xml',
         'views/sidebar.xml',
+        'wizard/bank_statement_import_views.xml',
+        'wizard/student_merge_views.xml',
+        'wizard/payment_plan_apply_views.xml',
+        'wizard/success_recommend_views.xml',
     ],
 
+    'assets': {
+        'web.assets_frontend': [
+            'student__visa__consultancy__management/static/src/js/student_detail.js',
+        ],
+    },
+
     # only loaded in demonstration mode
     'demo': [
         'demo/demo.xml',
@@ -1,24 +1,44 @@
 # -*- coding: utf-8 -*-
 
-from odoo import http, fields, _
-from odoo.http import request
+from odoo import http, fields, Command, _
+from odoo.http import request, Response
 from odoo.exceptions import AccessError, MissingError
+from odoo.tools import consteq
 from odoo.addons.portal.controllers.portal import CustomerPortal, pager as portal_pager
+import functools
 import json
 
 
+def replica_read(method):
+    """Serve a read-only route from the read replica when one is configured.
+
+    The route reads through self._read_env(), the page is rendered before the
+    replica cursor is closed.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with request.env['visa.replica']._replica_env() as env:
+            request.visa_read_env = env
+            try:
+                response = method(self, *args, **kwargs)
+                if isinstance(response, Response) and response.is_qweb:
+                    response.flatten()
+                return response
+            finally:
+                request.visa_read_env = None
+    return wrapper
+
+
 class VisaPortalController(CustomerPortal):
 
+    def _read_env(self):
+        """Environment for reads, bound to the replica inside replica_read routes"""
+        return getattr(request, 'visa_read_env', None) or request.env
+
     def _prepare_home_portal_values(self, counters):
         values = super()._prepare_home_portal_values(counters)
-        if 'student_count' in counters:
-            values['student_count'] = request.env['visa.student'].search_count([])
-        if 'application_count' in counters:
-            values['application_count'] = request.env['visa.application'].search_count([])
-        if 'document_count' in counters:
-            values['document_count'] = request.env['visa.document'].search_count([])
-        if 'payment_count' in counters:
-            values['payment_count'] = request.env['visa.payment'].search_count([])
+        # cached per user, recounted only when the counted models changed
+        values.update(request.env['visa.portal.counter']._get_counts(counters))
         return values
 
     # ==================== DASHBOARD ====================
@@ -50,9 +70,10 @@ class VisaPortalController(CustomerPortal):
 
     # ==================== STUDENTS ====================
     @http.route(['/my/visa/students', '/my/visa/students/page/<int:page>'], type='http', auth='user', website=True)
+    @replica_read
     def portal_my_students(self, page=1, search='', sortby=None, filterby=None, **kwargs):
         """List all students with search and filter"""
-        Student = request.env['visa.student']
+        Student = self._read_env()['visa.student']
 
         domain = []
         if search:
@@ -80,6 +101,8 @@ class VisaPortalController(CustomerPortal):
         values = {
             'page_name': 'students',
             'students': students,
+            'fragments': self._read_env()['visa.portal.fragment']._render_fragments(
+                'student__visa__consultancy__management.portal_student_card', students),
             'pager': pager,
             'searchbar_sortings': searchbar_sortings,
             'sortby': sortby,
@@ -88,21 +111,65 @@ class VisaPortalController(CustomerPortal):
         return request.render('student__visa__consultancy__management.portal_my_students', values)
 
     @http.route(['/my/visa/student/<int:student_id>'], type='http', auth='user', website=True)
+    @replica_read
     def portal_student_detail(self, student_id, **kwargs):
         """View single student details"""
         try:
-            student = request.env['visa.student'].browse(student_id)
-            if not student.exists():
+            student = self._read_env()['visa.student'].browse(student_id)
+            if not student.exists() or not student.active:
                 return request.redirect('/my/visa/students')
 
             values = {
                 'page_name': 'student_detail',
                 'student': student,
+                'summary': student._get_portal_summary(),
             }
             return request.render('student__visa__consultancy__management.portal_student_detail', values)
         except (AccessError, MissingError):
             return request.redirect('/my/visa/students')
 
+    @http.route(['/my/visa/student/<int:student_id>/summary'], type='json', auth='user')
+    @replica_read
+    def portal_student_summary(self, student_id, **kwargs):
+        """Student 360 summary: profile, counters, latest applications, document status and payment ledger"""
+        student = self._read_env()['visa.student'].browse(student_id).exists()
+        if not student:
+            raise MissingError(_('This student does not exist.'))
+        return student._get_portal_summary()
+
+    @http.route(['/my/visa/student/<int:student_id>/documents'], type='http', auth='user', website=True)
+    @replica_read
+    def portal_student_documents(self, student_id, **kwargs):
+        """Documents section of the student page, loaded when the section is opened"""
+        student = self._read_env()['visa.student'].browse(student_id).exists()
+        if not student:
+            return request.not_found()
+        documents = self._read_env()['visa.document'].search([('student_id', '=', student.id)],
+                                                             order='create_date desc, id desc')
+        return request.render('student__visa__consultancy__management.portal_student_documents_section', {
+            'student': student,
+            'documents': documents,
+            'fragments': self._read_env()['visa.portal.fragment']._render_fragments(
+                'student__visa__consultancy__management.portal_document_row', documents),
+        })
+
+    @http.route(['/my/visa/student/<int:student_id>/chatter'], type='http', auth='user', website=True)
+    @replica_read
+    def portal_student_chatter(self, student_id, limit=30, **kwargs):
+        """Latest messages of the student, loaded when the section is opened"""
+        student = self._read_env()['visa.student'].browse(student_id).exists()
+        if not student:
+            return request.not_found()
+        messages = self._read_env()['mail.message'].search([
+            ('model', '=', 'visa.student'),
+            ('res_id', '=', student.id),
+            ('message_type', 'in', ['comment', 'email', 'notification']),
+        ], order='date desc, id desc', limit=min(int(limit), 200) if str(limit).isdigit() else 30)
+        return request.render('student__visa__consultancy__management.portal_student_chatter_section', {
+            'student': student,
+            'messages': messages,
+        })
+
     @http.route(['/my/visa/student/create'], type='http', auth='user', website=True)
     def portal_student_create(self, **kwargs):
         """Create new student form"""
@@ -134,6 +201,7 @@ class VisaPortalController(CustomerPortal):
     @http.route(['/my/visa/student/save'], type='http', auth='user', website=True, methods=['POST'], csrf=True)
     def portal_student_save(self, **post):
         """Save student (create or update)"""
+        request.env['visa.replica']._mark_write()
         student_id = post.get('student_id')
 
         vals = {
@@ -161,10 +229,14 @@ class VisaPortalController(CustomerPortal):
     @http.route(['/my/visa/student/delete/<int:student_id>'], type='http', auth='user', website=True, csrf=True)
     def portal_student_delete(self, student_id, **kwargs):
         """Delete student"""
+        request.env['visa.replica']._mark_write()
         try:
             student = request.env['visa.student'].browse(student_id)
             if student.exists():
-                student.unlink()
+                student.check_access_rights('unlink')
+                student.check_access_rule('unlink')
+                # documents, payments, attachments and messages are deleted in the background
+                request.env['visa.retention.run']._request_purge(student)
         except (AccessError, MissingError):
             pass
         return request.redirect('/my/visa/students')
@@ -172,14 +244,12 @@ class VisaPortalController(CustomerPortal):
     # ==================== APPLICATIONS ====================
     @http.route(['/my/visa/applications', '/my/visa/applications/page/<int:page>'], type='http', auth='user',
                 website=True)
+    @replica_read
     def portal_my_applications(self, page=1, search='', sortby=None, filterby=None, **kwargs):
         """List all applications"""
-        Application = request.env['visa.application']
+        Application = self._read_env()['visa.application']
 
         domain = []
-        if search:
-            domain += [('name', 'ilike', search)]
-
         if filterby and filterby != 'all':
             domain += [('state', '=', filterby)]
 
@@ -202,7 +272,12 @@ class VisaPortalController(CustomerPortal):
 
         order = searchbar_sortings[sortby]['order']
 
-        application_count = Application.search_count(domain)
+        if search:
+            # full-text search over student, university, course, intake and notes, best matches first
+            applications, application_count = Application._search_ranked(
+                search, domain, limit=20, offset=(max(int(page), 1) - 1) * 20)
+        else:
+            application_count = Application.search_count(domain)
         pager = portal_pager(
             url="/my/visa/applications",
             url_args={'sortby': sortby, 'filterby': filterby, 'search': search},
@@ -211,11 +286,14 @@ class VisaPortalController(CustomerPortal):
             step=20
         )
 
-        applications = Application.search(domain, order=order, limit=20, offset=pager['offset'])
+        if not search:
+            applications = Application.search(domain, order=order, limit=20, offset=pager['offset'])
 
         values = {
             'page_name': 'applications',
             'applications': applications,
+            'fragments': self._read_env()['visa.portal.fragment']._render_fragments(
+                'student__visa__consultancy__management.portal_application_row', applications),
             'pager': pager,
             'searchbar_sortings': searchbar_sortings,
             'searchbar_filters': searchbar_filters,
@@ -226,10 +304,11 @@ class VisaPortalController(CustomerPortal):
         return request.render('student__visa__consultancy__management.portal_my_applications', values)
 
     @http.route(['/my/visa/application/<int:application_id>'], type='http', auth='user', website=True)
+    @replica_read
     def portal_application_detail(self, application_id, **kwargs):
         """View application details"""
         try:
-            application = request.env['visa.application'].browse(application_id)
+            application = self._read_env()['visa.application'].browse(application_id)
             if not application.exists():
                 return request.redirect('/my/visa/applications')
 
@@ -276,6 +355,7 @@ class VisaPortalController(CustomerPortal):
     @http.route(['/my/visa/application/save'], type='http', auth='user', website=True, methods=['POST'], csrf=True)
     def portal_application_save(self, **post):
         """Save application"""
+        request.env['visa.replica']._mark_write()
         application_id = post.get('application_id')
 
         vals = {
@@ -303,6 +383,7 @@ class VisaPortalController(CustomerPortal):
     @http.route(['/my/visa/application/delete/<int:application_id>'], type='http', auth='user', website=True, csrf=True)
     def portal_application_delete(self, application_id, **kwargs):
         """Delete application"""
+        request.env['visa.replica']._mark_write()
         try:
             application = request.env['visa.application'].browse(application_id)
             if application.exists():
@@ -313,9 +394,10 @@ class VisaPortalController(CustomerPortal):
 
     # ==================== DOCUMENTS ====================
     @http.route(['/my/visa/documents', '/my/visa/documents/page/<int:page>'], type='http', auth='user', website=True)
+    @replica_read
     def portal_my_documents(self, page=1, search='', filterby=None, **kwargs):
         """List all documents"""
-        Document = request.env['visa.document']
+        Document = self._read_env()['visa.document']
 
         domain = []
         if search:
@@ -357,10 +439,11 @@ class VisaPortalController(CustomerPortal):
         return request.render('student__visa__consultancy__management.portal_my_documents', values)
 
     @http.route(['/my/visa/document/<int:document_id>'], type='http', auth='user', website=True)
+    @replica_read
     def portal_document_detail(self, document_id, **kwargs):
         """View document details"""
         try:
-            document = request.env['visa.document'].browse(document_id)
+            document = self._read_env()['visa.document'].browse(document_id)
             if not document.exists():
                 return request.redirect('/my/visa/documents')
 
@@ -372,9 +455,66 @@ class VisaPortalController(CustomerPortal):
         except (AccessError, MissingError):
             return request.redirect('/my/visa/documents')
 
+    @http.route(['/my/visa/document/upload'], type='http', auth='user', website=True, methods=['GET'])
+    def portal_document_upload_form(self, student_id=None, application_id=None, **kwargs):
+        """Multi-file upload form"""
+        values = {
+            'page_name': 'document_upload',
+            'students': request.env['visa.student'].search([]),
+            'applications': request.env['visa.application'].search([]),
+            'document_types': request.env['visa.document']._fields['document_type'].selection,
+            'student_id': int(student_id) if str(student_id or '').isdigit() else False,
+            'application_id': int(application_id) if str(application_id or '').isdigit() else False,
+        }
+        return request.render('student__visa__consultancy__management.portal_document_upload', values)
+
+    @http.route(['/my/visa/document/upload'], type='http', auth='user', website=True, methods=['POST'], csrf=True)
+    def portal_document_upload(self, **post):
+        """Create one document per uploaded file.
+
+        Werkzeug spools the multipart body to temporary files, each file is then
+        copied to the filestore in chunks. Thumbnails and page counts are left
+        to the background processing cron so the request returns quickly.
+        """
+        request.env['visa.replica']._mark_write()
+        uploads = [f for f in request.httprequest.files.getlist('attachments') if f.filename]
+        student_id, application_id = post.get('student_id') or '', post.get('application_id') or ''
+        if not uploads or not student_id.isdigit() or (application_id and not application_id.isdigit()):
+            return request.redirect('/my/visa/document/upload')
+
+        student = request.env['visa.student'].browse(int(student_id)).exists()
+        application = request.env['visa.application'].browse(int(application_id or 0)).exists()
+        if not student or (application_id and application.student_id != student):
+            return request.redirect('/my/visa/document/upload')
+        document_type = post.get('document_type') or 'other'
+        if document_type not in dict(request.env['visa.document']._fields['document_type'].selection):
+            document_type = 'other'
+
+        documents = request.env['visa.document'].create([{
+            'name': upload.filename,
+            'file_name': upload.filename,
+            'student_id': student.id,
+            'application_id': application.id,
+            'document_type': document_type,
+            'state': 'received',
+            'submission_date': fields.Date.today(),
+            'attachment_ids': [Command.create({
+                'name': upload.filename,
+                'mimetype': upload.mimetype or 'application/octet-stream',
+                'res_model': 'visa.document',
+            })],
+            'processing_state': 'queued',
+        } for upload in uploads])
+        # content and owner set in one pass, the files are streamed to the filestore
+        documents.attachment_ids._visa_set_streams([upload.stream for upload in uploads], res_ids=documents.ids)
+        request.env.ref('student__visa__consultancy__management.ir_cron_visa_document_processing').sudo()._trigger()
+
+        return request.redirect(f'/my/visa/student/{student.id}')
+
     @http.route(['/my/visa/document/delete/<int:document_id>'], type='http', auth='user', website=True, csrf=True)
     def portal_document_delete(self, document_id, **kwargs):
         """Delete document"""
+        request.env['visa.replica']._mark_write()
         try:
             document = request.env['visa.document'].browse(document_id)
             if document.exists():
@@ -385,9 +525,10 @@ class VisaPortalController(CustomerPortal):
 
     # ==================== PAYMENTS ====================
     @http.route(['/my/visa/payments', '/my/visa/payments/page/<int:page>'], type='http', auth='user', website=True)
+    @replica_read
     def portal_my_payments(self, page=1, search='', filterby=None, **kwargs):
         """List all payments"""
-        Payment = request.env['visa.payment']
+        Payment = self._read_env()['visa.payment']
 
         domain = []
         if search:
@@ -428,10 +569,11 @@ class VisaPortalController(CustomerPortal):
         return request.render('student__visa__consultancy__management.portal_my_payments', values)
 
     @http.route(['/my/visa/payment/<int:payment_id>'], type='http', auth='user', website=True)
+    @replica_read
     def portal_payment_detail(self, payment_id, **kwargs):
         """View payment details"""
         try:
-            payment = request.env['visa.payment'].browse(payment_id)
+            payment = self._read_env()['visa.payment'].browse(payment_id)
             if not payment.exists():
                 return request.redirect('/my/visa/payments')
 
@@ -446,10 +588,159 @@ class VisaPortalController(CustomerPortal):
     @http.route(['/my/visa/payment/delete/<int:payment_id>'], type='http', auth='user', website=True, csrf=True)
     def portal_payment_delete(self, payment_id, **kwargs):
         """Delete payment"""
+        request.env['visa.replica']._mark_write()
         try:
             payment = request.env['visa.payment'].browse(payment_id)
             if payment.exists():
                 payment.unlink()
         except (AccessError, MissingError):
             pass
-        return request.redirect('/my/visa/payments')
\ No newline at end of file
+        return request.redirect('/my/visa/payments')
+    # ==================== RECEIVABLES ====================
+    @http.route(['/my/visa/receivables'], type='http', auth='user', website=True)
+    @replica_read
+    def portal_receivables(self, **kwargs):
+        """Aged receivables per student and currency, with the 90 day trend of the snapshots"""
+        env = self._read_env()
+        bucket_fields = ['amount_current', 'amount_1_30', 'amount_31_60', 'amount_61_90', 'amount_90_plus']
+        rows = env['visa.receivable.aging'].read_group(
+            [], ['amount:sum', 'days_overdue:max'] + ['%s:sum' % name for name in bucket_fields],
+            ['student_id', 'currency_id'], orderby='days_overdue desc', lazy=False)
+        totals = {}
+        for row in rows:
+            row['currency'] = env['res.currency'].browse(row['currency_id'] and row['currency_id'][0])
+            total = totals.setdefault(row['currency'], dict.fromkeys(bucket_fields + ['amount'], 0.0))
+            for name in total:
+                total[name] += row[name]
+        trend = env['visa.receivable.aging.snapshot'].read_group(
+            [('date', '>=', fields.Date.subtract(fields.Date.today(), days=90))],
+            ['amount_total:sum', 'amount_90_plus:sum'], ['date:day', 'currency_id'],
+            orderby='date', lazy=False)
+        values = {
+            'page_name': 'receivables',
+            'rows': rows,
+            'totals': totals,
+            'trend': trend,
+        }
+        return request.render('student__visa__consultancy__management.portal_receivables', values)
+
+    # ==================== WORK QUEUE ====================
+    @http.route(['/my/visa/queue'], type='http', auth='user', website=True)
+    @replica_read
+    def portal_work_queue(self, after=None, **kwargs):
+        """Documents, overdue payments, applications and activities waiting for the current user"""
+        result = self._read_env()['visa.work.queue']._get_items(limit=20, after=after)
+        values = {
+            'page_name': 'work_queue',
+            'items': result['items'],
+            'next_cursor': result['next_cursor'],
+            'after': after,
+        }
+        return request.render('student__visa__consultancy__management.portal_work_queue', values)
+
+    @http.route(['/my/visa/queue/items'], type='json', auth='user')
+    @replica_read
+    def portal_work_queue_items(self, after=None, limit=20, **kwargs):
+        """One page of the work queue, pass next_cursor back as after for the next one"""
+        limit = int(limit) if str(limit).isdigit() else 20
+        return self._read_env()['visa.work.queue']._get_items(limit=min(max(limit, 1), 100), after=after)
+
+
+class VisaCatalogController(http.Controller):
+    _catalog_per_page = 20
+
+    @http.route(['/visa/catalog', '/visa/catalog/page/<int:page>'], type='http', auth='public', website=True,
+                sitemap=True)
+    def visa_catalog(self, page=1, search='', **kwargs):
+        """Public university and course catalog with facet counts"""
+        args = request.httprequest.args
+        filters = {facet: args.getlist(facet) for facet in ('country', 'level', 'intake', 'fee_band', 'partner')}
+        filters['search'] = search
+        Catalog = request.env['visa.catalog'].sudo()
+        result = Catalog._search_catalog(filters, limit=self._catalog_per_page,
+                                         offset=(page - 1) * self._catalog_per_page)
+        url_args = {facet: values for facet, values in filters.items() if values}
+        pager = request.website.pager(url='/visa/catalog', total=result['count'], page=page,
+                                      step=self._catalog_per_page, url_args=url_args)
+        Course = request.env['visa.course']
+        values = {
+            'result': result,
+            'selected': dict(result['key']),
+            'search': search,
+            'pager': pager,
+            'countries': request.env['res.country'].sudo().browse(
+                [value for value, _count in result['facets']['country']]),
+            'labels': {
+                'level': dict(Course._fields['level']._description_selection(request.env)),
+                'intake': dict(Course._fields['intake']._description_selection(request.env)),
+                'fee_band': dict(Course._fields['fee_band']._description_selection(request.env)),
+            },
+        }
+        return request.render('student__visa__consultancy__management.website_visa_catalog', values)
+
+
+class VisaInquiryController(http.Controller):
+
+    def _inquiry_form_values(self, **kwargs):
+        values = {
+            'countries': request.env['res.country'].sudo().search([]),
+            'qualifications': request.env['visa.student']._fields['highest_qualification'].selection,
+            'inquiry': {},
+            'error': False,
+        }
+        values.update(kwargs)
+        return values
+
+    @http.route(['/visa/inquiry'], type='http', auth='public', website=True, sitemap=True)
+    def visa_inquiry(self, **kwargs):
+        """Public inquiry form for prospective students"""
+        return request.render('student__visa__consultancy__management.website_visa_inquiry',
+                              self._inquiry_form_values())
+
+    @http.route(['/visa/inquiry/submit'], type='http', auth='public', website=True, methods=['POST'], csrf=True)
+    def visa_inquiry_submit(self, **post):
+        """Stage the inquiry, the student is created by the ingestion cron"""
+        Inquiry = request.env['visa.inquiry']
+        values, error = Inquiry._normalize_values(post)
+        if not error and not Inquiry._stage(values, request.httprequest.remote_addr):
+            error = _('Too many inquiries were sent from your network, please try again later.')
+        if error:
+            return request.render('student__visa__consultancy__management.website_visa_inquiry',
+                                  self._inquiry_form_values(inquiry=post, error=error))
+        return request.render('student__visa__consultancy__management.website_visa_inquiry_thanks', {})
+
+    @http.route(['/visa/inquiry/json'], type='json', auth='public', methods=['POST'])
+    def visa_inquiry_json(self, **post):
+        """Same as the form for external landing pages: {'status': 'queued'} or {'error': message}"""
+        Inquiry = request.env['visa.inquiry']
+        values, error = Inquiry._normalize_values(post)
+        if error:
+            return {'error': error}
+        if not Inquiry._stage(values, request.httprequest.remote_addr):
+            return {'error': _('Too many inquiries, please try again later.'), 'rate_limited': True}
+        return {'status': 'queued'}
+
+
+class VisaOutboxController(http.Controller):
+
+    @http.route(['/visa/outbox/receive'], type='http', auth='public', methods=['POST'], csrf=False)
+    def visa_outbox_receive(self, **kwargs):
+        """Stub receiver for HTTP sinks, enabled by the visa.outbox_receiver_token parameter.
+
+        Stores the posted events, ignoring the ones already received, and
+        answers {"received": n, "new": m}.
+        """
+        token = request.env['ir.config_parameter'].sudo().get_param('visa.outbox_receiver_token')
+        authorization = request.httprequest.headers.get('Authorization', '')
+        if not token or not consteq(authorization, 'Bearer %s' % token):
+            return Response(json.dumps({'error': 'unauthorized'}), status=401, content_type='application/json')
+        try:
+            messages = json.loads(request.httprequest.get_data() or b'{}').get('events') or []
+        except (ValueError, AttributeError):
+            messages = None
+        if not isinstance(messages, list) or not all(
+                isinstance(message, dict) and isinstance(message.get('id'), str) and message['id']
+                for message in messages):
+            return Response(json.dumps({'error': 'invalid payload'}), status=400, content_type='application/json')
+        new = request.env['visa.outbox.receipt'].sudo()._receive(request.httprequest.remote_addr, messages)
+        return Response(json.dumps({'received': len(messages), 'new': new}), content_type='application/json')
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+
+def migrate(cr, version):
+    """Backfill the stage entry date of the existing applications.
+
+    Taken from the last transition into their current state when one was
+    logged, from their last update otherwise.
+    """
+    if not version:
+        return
+    cr.execute("""
+        UPDATE visa_application a
+           SET stage_entered_at = COALESCE(
+                   (SELECT MAX(t.date) FROM visa_application_transition t
+                     WHERE t.application_id = a.id AND t.to_state = a.state),
+                   a.write_date, a.create_date)
+         WHERE a.stage_entered_at IS NULL
+    """)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from . import models
+from . import change_stamp
 from . import  student
 from . import  university
 from . import applicatioon
@@ -8,4 +9,24 @@ from . import  documennt
 from . import payment
 from . import consultant
 from . import invoice
-from . import dashboard
\ No newline at end of file
+from . import dashboard
+from . import ir_attachment
+from . import checklist
+from . import currency_converter
+from . import student_duplicate
+from . import application_transition
+from . import sla
+from . import archive
+from . import report_export
+from . import replica
+from . import intake_demand
+from . import invoicing_run
+from . import receivable_aging
+from . import catalog
+from . import work_queue
+from . import retention
+from . import inquiry
+from . import portal_fragment
+from . import payment_plan
+from . import success_stats
+from . import outbox
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools
+
+
+def _application_states(self):
+    return self.env['visa.application']._fields['state'].selection
+
+
+class VisaApplicationTransition(models.Model):
+    _name = 'visa.application.transition'
+    _description = 'Application State Transition'
+    _order = 'date desc, id desc'
+    _log_access = False
+
+    application_id = fields.Many2one('visa.application', string='Application', required=True, ondelete='cascade')
+    from_state = fields.Selection(selection=_application_states, string='From')
+    to_state = fields.Selection(selection=_application_states, string='To', required=True)
+    date = fields.Datetime(string='Date', required=True, default=fields.Datetime.now, index=True)
+    user_id = fields.Many2one('res.users', string='User', default=lambda self: self.env.uid)
+
+    # Copied from the application for grouping without joins
+    university_id = fields.Many2one('visa.university', string='University', index=True)
+    country_id = fields.Many2one('res.country', string='Country', index=True)
+    consultant_id = fields.Many2one('visa.consultant', string='Consultant', index=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_application_transition_application_date_idx
+            ON visa_application_transition (application_id, date, id)
+        """)
+
+    @api.model
+    def _log_transitions(self, applications, old_states):
+        """Record the state change of each application whose state differs from old_states"""
+        now = fields.Datetime.now()
+        vals_list = [{
+            'application_id': app.id,
+            'from_state': old_states.get(app.id) or False,
+            'to_state': app.state,
+            'date': now,
+            'user_id': self.env.uid,
+            'university_id': app.university_id.id,
+            'country_id': app.university_id.country_id.id,
+            'consultant_id': app.consultant_id.id,
+        } for app in applications if app.state and app.state != old_states.get(app.id)]
+        return self.sudo().create(vals_list)
+
+
+class VisaApplicationStageDuration(models.Model):
+    _name = 'visa.application.stage.duration'
+    _description = 'Application Time in Stage'
+    _auto = False
+    _order = 'date_start desc'
+
+    application_id = fields.Many2one('visa.application', string='Application', readonly=True)
+    state = fields.Selection(selection=_application_states, string='Stage', readonly=True)
+    university_id = fields.Many2one('visa.university', string='University', readonly=True)
+    country_id = fields.Many2one('res.country', string='Country', readonly=True)
+    consultant_id = fields.Many2one('visa.consultant', string='Consultant', readonly=True)
+    date_start = fields.Datetime(string='Entered', readonly=True)
+    date_end = fields.Datetime(string='Left', readonly=True)
+    duration_days = fields.Float(string='Days in Stage', group_operator='avg', readonly=True)
+    is_current = fields.Boolean(string='Current Stage', readonly=True)
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE OR REPLACE VIEW visa_application_stage_duration AS (
+                SELECT t.id,
+                       t.application_id,
+                       t.to_state AS state,
+                       t.university_id,
+                       t.country_id,
+                       t.consultant_id,
+                       t.date AS date_start,
+                       LEAD(t.date) OVER w AS date_end,
+                       EXTRACT(EPOCH FROM COALESCE(LEAD(t.date) OVER w, (now() AT TIME ZONE 'UTC')) - t.date)
+                           / 86400.0 AS duration_days,
+                       LEAD(t.date) OVER w IS NULL AS is_current
+                  FROM visa_application_transition t
+                WINDOW w AS (PARTITION BY t.application_id ORDER BY t.date, t.id)
+            )
+        """)
+
+
+class VisaApplicationStageStatistics(models.Model):
+    _name = 'visa.application.stage.statistics'
+    _description = 'Application Stage Statistics'
+    _auto = False
+    _order = 'dimension, university_id, country_id, consultant_id, state'
+
+    dimension = fields.Selection([
+        ('all', 'Overall'),
+        ('university', 'University'),
+        ('country', 'Country'),
+        ('consultant', 'Consultant')
+    ], string='Grouped By', readonly=True)
+    state = fields.Selection(selection=_application_states, string='Stage', readonly=True)
+    university_id = fields.Many2one('visa.university', string='University', readonly=True)
+    country_id = fields.Many2one('res.country', string='Country', readonly=True)
+    consultant_id = fields.Many2one('visa.consultant', string='Consultant', readonly=True)
+    reached_count = fields.Integer(string='Applications Reached', readonly=True)
+    conversion_rate = fields.Float(string='Conversion (%)', group_operator='avg', readonly=True)
+    completed_count = fields.Integer(string='Completed Stays', readonly=True)
+    median_days = fields.Float(string='Median Days', group_operator='avg', readonly=True)
+    p90_days = fields.Float(string='90th Percentile Days', group_operator='avg', readonly=True)
+    avg_days = fields.Float(string='Average Days', group_operator='avg', readonly=True)
+    is_bottleneck = fields.Boolean(string='Bottleneck', readonly=True)
+
+    def init(self):
+        """Percentiles, funnel conversion and bottleneck per stage, for every grouping, in one pass.
+
+        Funnel conversion is relative to the applications that reached draft in
+        the same group, the bottleneck is the stage with the highest median.
+        """
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE OR REPLACE VIEW visa_application_stage_statistics AS (
+                WITH grouped AS (
+                    SELECT CASE
+                               WHEN GROUPING(d.university_id) = 0 THEN 'university'
+                               WHEN GROUPING(d.country_id) = 0 THEN 'country'
+                               WHEN GROUPING(d.consultant_id) = 0 THEN 'consultant'
+                               ELSE 'all'
+                           END AS dimension,
+                           d.state,
+                           d.university_id,
+                           d.country_id,
+                           d.consultant_id,
+                           COUNT(DISTINCT d.application_id) AS reached_count,
+                           COUNT(*) FILTER (WHERE NOT d.is_current) AS completed_count,
+                           percentile_cont(0.5) WITHIN GROUP (ORDER BY d.duration_days)
+                               FILTER (WHERE NOT d.is_current) AS median_days,
+                           percentile_cont(0.9) WITHIN GROUP (ORDER BY d.duration_days)
+                               FILTER (WHERE NOT d.is_current) AS p90_days,
+                           AVG(d.duration_days) FILTER (WHERE NOT d.is_current) AS avg_days
+                      FROM visa_application_stage_duration d
+                  GROUP BY GROUPING SETS (
+                        (d.state),
+                        (d.state, d.university_id),
+                        (d.state, d.country_id),
+                        (d.state, d.consultant_id)
+                  )
+                )
+                SELECT ROW_NUMBER() OVER (ORDER BY dimension, university_id, country_id, consultant_id, state) AS id,
+                       g.*,
+                       100.0 * g.reached_count / NULLIF(MAX(g.reached_count) FILTER (WHERE g.state = 'draft')
+                           OVER (PARTITION BY dimension, university_id, country_id, consultant_id), 0)
+                           AS conversion_rate,
+                       g.state NOT IN ('visa_approved', 'rejected', 'cancelled') AND g.median_days IS NOT NULL
+                           AND RANK() OVER (PARTITION BY dimension, university_id, country_id, consultant_id
+                                            ORDER BY CASE WHEN g.state IN ('visa_approved', 'rejected', 'cancelled')
+                                                          THEN NULL ELSE g.median_days END DESC NULLS LAST) = 1
+                           AS is_bottleneck
+                  FROM grouped g
+            )
+        """)
@@ -1,15 +1,38 @@
 # -*- coding: utf-8 -*-
 
+import re
+from datetime import date, datetime, timedelta
+
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from odoo.osv.query import Query
+
+INTAKE_MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september',
+                 'october', 'november', 'december']
+CLOSED_STATES = ('visa_approved', 'rejected', 'cancelled')
+# Intake years are free text, only these are read as a year (1900 to 2999)
+INTAKE_YEAR_PATTERN = r'^(19|2[0-9])[0-9]{2}$'
+
+
+def intake_year_value(intake_year):
+    """The intake year as an int, None when the text is not a plausible year"""
+    intake_year = (intake_year or '').strip()
+    return int(intake_year) if re.match(INTAKE_YEAR_PATTERN, intake_year) else None
+
+
+def fulltext_query(text):
+    """tsquery matching every word of text as a prefix, '' when text has no word"""
+    words = re.findall(r'\w+', (text or '').lower())
+    return ' & '.join('%s:*' % word for word in words)
 
 
 class VisaApplication(models.Model):
     _name = 'visa.application'
     _description = 'Visa Application'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'visa.change.stamp.mixin']
     _rec_name = 'name'
     _order = 'create_date desc'
+    _change_stamp_fields = ('active', 'consultant_id')
 
     name = fields.Char(string='Application Number', required=True, copy=False, readonly=True, default='New')
     student_id = fields.Many2one('visa.student', string='Student', required=True, tracking=True)
@@ -56,6 +79,18 @@ class VisaApplication(models.Model):
         ('cancelled', 'Cancelled')
     ], string='Status', default='draft', tracking=True)
 
+    # SLA
+    # set on create rather than by a default, which would stamp existing rows with the upgrade date
+    stage_entered_at = fields.Datetime(string='In Stage Since', copy=False)
+    deadline_at = fields.Datetime(string='Stage Deadline', compute='_compute_sla_deadline', store=True, index=True)
+    sla_warning_at = fields.Datetime(string='At Risk From', compute='_compute_sla_deadline', store=True, index=True)
+    sla_status = fields.Selection([
+        ('none', 'No SLA'),
+        ('on_track', 'On Track'),
+        ('at_risk', 'At Risk'),
+        ('breached', 'Breached')
+    ], string='SLA Status', compute='_compute_sla_deadline', store=True, index=True, tracking=True)
+
     # Consultant
     consultant_id = fields.Many2one('visa.consultant', string='Assigned Consultant', tracking=True)
 
@@ -65,10 +100,12 @@ class VisaApplication(models.Model):
     total_fee = fields.Monetary(string='Total Fee', compute='_compute_total_fee', store=True,
                                 currency_field='currency_id')
     currency_id = fields.Many2one('res.currency', string='Currency', default=lambda self: self.env.company.currency_id)
+    payment_plan_id = fields.Many2one('visa.payment.plan', string='Payment Plan', readonly=True, copy=False)
 
     # Relations
     document_ids = fields.One2many('visa.document', 'application_id', string='Documents')
     payment_ids = fields.One2many('visa.payment', 'application_id', string='Payments')
+    transition_ids = fields.One2many('visa.application.transition', 'application_id', string='State History')
 
     # Outcome
     outcome = fields.Selection([
@@ -89,34 +126,342 @@ class VisaApplication(models.Model):
     # Notes
     notes = fields.Text(string='Notes')
 
+    # Archived once closed for longer than the retention period
+    active = fields.Boolean(string='Active', default=True)
+
     # Computed Fields
     document_count = fields.Integer(string='Documents', compute='_compute_document_count')
+    document_completeness = fields.Float(string='Document Completeness (%)', compute='_compute_document_completeness',
+                                         store=True, index=True)
     payment_count = fields.Integer(string='Payments', compute='_compute_payment_count')
 
+    # Searches the search_vector column, which is maintained by triggers
+    fulltext = fields.Char(string='Anything', compute='_compute_fulltext', search='_search_fulltext')
+
+    def init(self):
+        # The SLA cron reads open applications in deadline order from this index
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_application_sla_queue_idx
+            ON visa_application (deadline_at) WHERE sla_status IN ('on_track', 'at_risk')
+        """)
+        # Portal lists and dashboard counts only look at the working set
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_application_active_create_date_idx
+            ON visa_application (create_date DESC) WHERE active
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_application_active_state_idx
+            ON visa_application (state) WHERE active
+        """)
+        self._init_search_vector()
+
+    def _init_search_vector(self):
+        """Full-text document of each application, kept current by triggers.
+
+        The document covers the application number, student name and email,
+        university, course, intake and notes. Renaming a student, university
+        or course rewrites the documents of its applications.
+        """
+        cr = self.env.cr
+        cr.execute("ALTER TABLE visa_application ADD COLUMN IF NOT EXISTS search_vector tsvector")
+        cr.execute("""
+            CREATE OR REPLACE FUNCTION visa_application_search_document(app visa_application) RETURNS tsvector AS $$
+                SELECT setweight(to_tsvector('simple', coalesce(app.name, '') || ' ' || coalesce(s.name, '')), 'A')
+                    || setweight(to_tsvector('simple', coalesce(u.name, '') || ' ' || coalesce(c.name, '')), 'B')
+                    || setweight(to_tsvector('simple', coalesce(s.email, '') || ' ' || coalesce(app.intake, '')
+                                                       || ' ' || coalesce(app.intake_year, '')), 'C')
+                    || setweight(to_tsvector('simple', coalesce(app.notes, '')), 'D')
+                  FROM (SELECT 1) AS one
+             LEFT JOIN visa_student s ON s.id = app.student_id
+             LEFT JOIN visa_university u ON u.id = app.university_id
+             LEFT JOIN visa_course c ON c.id = app.course_id
+            $$ LANGUAGE sql STABLE
+        """)
+        cr.execute("""
+            CREATE OR REPLACE FUNCTION visa_application_search_vector_trigger() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := visa_application_search_document(NEW);
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cr.execute("""
+            CREATE OR REPLACE FUNCTION visa_application_search_related_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_TABLE_NAME = 'visa_student' THEN
+                    UPDATE visa_application a SET search_vector = visa_application_search_document(a)
+                     WHERE a.student_id = NEW.id;
+                ELSIF TG_TABLE_NAME = 'visa_university' THEN
+                    UPDATE visa_application a SET search_vector = visa_application_search_document(a)
+                     WHERE a.university_id = NEW.id;
+                ELSE
+                    UPDATE visa_application a SET search_vector = visa_application_search_document(a)
+                     WHERE a.course_id = NEW.id;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cr.execute("""
+            DROP TRIGGER IF EXISTS visa_application_search_vector ON visa_application;
+            CREATE TRIGGER visa_application_search_vector
+                BEFORE INSERT OR UPDATE OF name, student_id, university_id, course_id, intake, intake_year, notes
+                ON visa_application
+                FOR EACH ROW EXECUTE PROCEDURE visa_application_search_vector_trigger();
+
+            DROP TRIGGER IF EXISTS visa_application_search_student ON visa_student;
+            CREATE TRIGGER visa_application_search_student
+                AFTER UPDATE OF name, email ON visa_student
+                FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name OR OLD.email IS DISTINCT FROM NEW.email)
+                EXECUTE PROCEDURE visa_application_search_related_trigger();
+
+            DROP TRIGGER IF EXISTS visa_application_search_university ON visa_university;
+            CREATE TRIGGER visa_application_search_university
+                AFTER UPDATE OF name ON visa_university
+                FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+                EXECUTE PROCEDURE visa_application_search_related_trigger();
+
+            DROP TRIGGER IF EXISTS visa_application_search_course ON visa_course;
+            CREATE TRIGGER visa_application_search_course
+                AFTER UPDATE OF name ON visa_course
+                FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+                EXECUTE PROCEDURE visa_application_search_related_trigger();
+        """)
+        cr.execute("""
+            UPDATE visa_application a SET search_vector = visa_application_search_document(a)
+             WHERE a.search_vector IS NULL
+        """)
+        cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_application_search_vector_idx
+            ON visa_application USING gin (search_vector)
+        """)
+
+    def _compute_fulltext(self):
+        self.fulltext = False
+
+    def _search_fulltext(self, operator, value):
+        if operator not in ('ilike', 'like', '=') or not isinstance(value, str):
+            raise UserError(_('Unsupported search on the full-text field.'))
+        query = fulltext_query(value)
+        if not query:
+            return []
+        return [('id', 'inselect', (
+            "SELECT id FROM visa_application WHERE search_vector @@ to_tsquery('simple', %s)", [query]))]
+
     @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code('visa.application') or 'New'
-        return super(VisaApplication, self).create(vals)
+    def _search(self, args, offset=0, limit=None, order=None, count=False, access_rights_uid=None):
+        """Searches on the full-text field without an explicit order list the best matches first"""
+        query = super(VisaApplication, self)._search(args, offset=offset, limit=limit, order=order, count=count,
+                                                     access_rights_uid=access_rights_uid)
+        texts = [leaf[2] for leaf in args
+                 if isinstance(leaf, (list, tuple)) and len(leaf) == 3 and leaf[0] == 'fulltext'
+                 and leaf[1] in ('ilike', 'like', '=') and isinstance(leaf[2], str)]
+        tsquery = fulltext_query(' '.join(texts)) if texts and not order and not count else ''
+        if tsquery and isinstance(query, Query):
+            rank = self.env.cr.mogrify(
+                "ts_rank_cd(visa_application.search_vector, to_tsquery('simple', %s))", [tsquery]).decode()
+            query.order = '%s DESC, %s' % (rank, query.order) if query.order else '%s DESC' % rank
+        return query
+
+    @api.model
+    def _search_ranked(self, text, domain=None, limit=None, offset=0):
+        """Applications matching domain and every word of text, best matches first.
+
+        Returns (applications, total count). Names weigh more than the
+        university and course, which weigh more than email, intake and notes.
+        """
+        tsquery = fulltext_query(text)
+        if not tsquery:
+            domain = list(domain or [])
+            return self.search(domain, limit=limit, offset=offset), self.search_count(domain)
+        query = self._where_calc(list(domain or []))
+        self._apply_ir_rules(query, 'read')
+        query.add_where("visa_application.search_vector @@ to_tsquery('simple', %s)", [tsquery])
+        from_clause, where_clause, params = query.get_sql()
+        self.env.cr.execute(f"SELECT COUNT(*) FROM {from_clause} WHERE {where_clause}", params)
+        count = self.env.cr.fetchone()[0]
+        self.env.cr.execute(f"""
+            SELECT visa_application.id
+              FROM {from_clause}
+             WHERE {where_clause}
+          ORDER BY ts_rank_cd(visa_application.search_vector, to_tsquery('simple', %s)) DESC,
+                   visa_application.create_date DESC
+             LIMIT %s OFFSET %s
+        """, params + [tsquery, limit, offset])
+        return self.browse([row[0] for row in self.env.cr.fetchall()]), count
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        now = fields.Datetime.now()
+        for vals in vals_list:
+            if vals.get('name', 'New') == 'New':
+                vals['name'] = self.env['ir.sequence'].next_by_code('visa.application') or 'New'
+            vals.setdefault('stage_entered_at', now)
+        records = super(VisaApplication, self).create(vals_list)
+        records._generate_checklist_documents()
+        transitions = self.env['visa.application.transition']._log_transitions(records, {})
+        self.env['visa.outbox.event']._enqueue_transitions(transitions)
+        Demand = self.env['visa.intake.demand'].sudo()
+        Demand._apply_deltas({}, Demand._get_counted_keys(records))
+        Stats = self.env['visa.success.stats'].sudo()
+        Stats._apply_deltas({}, Stats._get_outcome_keys(records))
+        return records
+
+    def write(self, vals):
+        # the stage clock only restarts for the applications that actually change stage
+        entering = self.filtered(lambda r: r.state != vals['state']) if 'state' in vals else self.browse()
+        if entering and entering == self:
+            vals = dict(vals, stage_entered_at=fields.Datetime.now())
+        elif entering:
+            super(VisaApplication, entering).write({'stage_entered_at': fields.Datetime.now()})
+        old_states = {rec.id: rec.state for rec in self} if 'state' in vals else None
+        Demand = self.env['visa.intake.demand'].sudo()
+        demand_fields = {'state', 'university_id', 'course_id', 'intake', 'intake_year'}
+        old_demand = Demand._get_counted_keys(self) if demand_fields & set(vals) else None
+        Stats = self.env['visa.success.stats'].sudo()
+        stats_fields = {'state', 'university_id', 'course_id', 'student_id'}
+        old_stats = Stats._get_outcome_keys(self) if stats_fields & set(vals) else None
+        res = super(VisaApplication, self).write(vals)
+        if 'university_id' in vals or 'course_id' in vals:
+            self._generate_checklist_documents(replace=True)
+        if old_states is not None:
+            transitions = self.env['visa.application.transition']._log_transitions(self, old_states)
+            self.env['visa.outbox.event']._enqueue_transitions(transitions)
+        if old_demand is not None:
+            Demand._apply_deltas(old_demand, Demand._get_counted_keys(self))
+        if old_stats is not None:
+            Stats._apply_deltas(old_stats, Stats._get_outcome_keys(self))
+        return res
+
+    def unlink(self):
+        Demand = self.env['visa.intake.demand'].sudo()
+        old_demand = Demand._get_counted_keys(self)
+        Stats = self.env['visa.success.stats'].sudo()
+        old_stats = Stats._get_outcome_keys(self)
+        res = super(VisaApplication, self).unlink()
+        Demand._apply_deltas(old_demand, {})
+        Stats._apply_deltas(old_stats, {})
+        return res
 
     @api.depends('service_fee', 'university_fee')
     def _compute_total_fee(self):
         for rec in self:
             rec.total_fee = rec.service_fee + rec.university_fee
 
+    def _get_intake_start(self):
+        """First day of the intake month, False when the intake year is not a year"""
+        self.ensure_one()
+        year = intake_year_value(self.intake_year)
+        if not self.intake or not year:
+            return False
+        return date(year, INTAKE_MONTHS.index(self.intake) + 1, 1)
+
+    @api.depends('state', 'stage_entered_at', 'intake', 'intake_year')
+    def _compute_sla_deadline(self):
+        """Deadline of the current stage, never later than the start of the intake.
+
+        The status follows the new deadline at the time of the recompute, the
+        SLA cron moves it forward when the warning or deadline time is reached.
+        """
+        policies = {p.state: p for p in self.env['visa.sla.policy'].search([])}
+        now = fields.Datetime.now()
+        for rec in self:
+            policy = policies.get(rec.state)
+            deadline = False
+            if policy and rec.state not in CLOSED_STATES:
+                deadline = (rec.stage_entered_at or fields.Datetime.now()) + timedelta(days=policy.days)
+                intake_start = rec._get_intake_start()
+                if intake_start:
+                    deadline = min(deadline, datetime.combine(intake_start, datetime.min.time()))
+            warning = deadline and deadline - timedelta(days=policy.warning_days)
+            rec.deadline_at = deadline
+            rec.sla_warning_at = warning
+            if not deadline:
+                rec.sla_status = 'none'
+            elif deadline <= now:
+                rec.sla_status = 'breached'
+            elif warning <= now:
+                rec.sla_status = 'at_risk'
+            else:
+                rec.sla_status = 'on_track'
+
     @api.depends('document_ids')
     def _compute_document_count(self):
         for rec in self:
             rec.document_count = len(rec.document_ids)
 
+    @api.depends('document_ids.state', 'document_ids.is_mandatory')
+    def _compute_document_completeness(self):
+        for rec in self:
+            mandatory = rec.document_ids.filtered('is_mandatory')
+            if mandatory:
+                verified = mandatory.filtered(lambda d: d.state == 'verified')
+                rec.document_completeness = len(verified) / len(mandatory) * 100
+            else:
+                rec.document_completeness = 0.0
+
     @api.depends('payment_ids')
     def _compute_payment_count(self):
         for rec in self:
             rec.payment_count = len(rec.payment_ids)
 
+    def _generate_checklist_documents(self, replace=False):
+        """Create the missing checklist documents of the applications in one batch.
+
+        With replace, documents generated from the template of the previous
+        university or course that are still pending without attachment, and not
+        on the matching template, are removed. Applications without a matching
+        template keep their documents.
+        """
+        if not self:
+            return
+        Template = self.env['visa.checklist.template']
+        template_map = Template._get_template_map()
+        if not template_map:
+            return
+        templates = {
+            rec.id: Template._match(template_map, rec.university_id.country_id.id, rec.course_id.level or False)
+            for rec in self
+        }
+        Document = self.env['visa.document']
+        if replace:
+            stale = Document.search([
+                ('application_id', 'in', [rec_id for rec_id, template in templates.items() if template.line_ids]),
+                ('checklist_line_id', '!=', False),
+                ('state', '=', 'pending'),
+                ('attachment_ids', '=', False),
+            ])
+            stale.filtered(
+                lambda d: d.document_type not in templates[d.application_id.id].line_ids.mapped('document_type')
+            ).unlink()
+        existing = {
+            (doc['application_id'][0], doc['document_type'])
+            for doc in Document.search_read(
+                [('application_id', 'in', self.ids)], ['application_id', 'document_type'])
+        }
+        vals_list = []
+        for rec in self:
+            for line in templates[rec.id].line_ids:
+                if (rec.id, line.document_type) in existing:
+                    continue
+                vals_list.append({
+                    'name': line.name,
+                    'document_type': line.document_type,
+                    'is_mandatory': line.is_mandatory,
+                    'student_id': rec.student_id.id,
+                    'application_id': rec.id,
+                    'checklist_line_id': line.id,
+                })
+        if vals_list:
+            Document.with_context(mail_create_nolog=True).create(vals_list)
+
     def action_submit(self):
         if not self.document_ids:
             raise UserError(_('Please add documents before submitting the application!'))
+        missing = self.document_ids.filtered(lambda d: d.is_mandatory and d.state not in ('received', 'verified'))
+        if missing:
+            raise UserError(_('The following mandatory documents have not been received yet:\n%s')
+                            % '\n'.join(missing.mapped('name')))
         self.write({
             'state': 'document_verification',
             'submission_date': fields.Date.today()
@@ -189,4 +534,37 @@ class VisaApplication(models.Model):
             'domain': {
                 'course_id': [('university_id', '=', self.university_id.id)]
             }
-        }
\ No newline at end of file
+        }
+
+    @api.model
+    def _cron_update_sla_status(self):
+        """Move applications to at risk / breached when their warning or deadline time passes.
+
+        Both searches are range scans on the indexed sla_warning_at and
+        deadline_at, so a run only reads the applications whose status changes.
+        """
+        now = fields.Datetime.now()
+        breached = self.search([('sla_status', 'in', ('on_track', 'at_risk')), ('deadline_at', '<=', now)],
+                               order='deadline_at')
+        at_risk = self.search([('sla_status', '=', 'on_track'), ('sla_warning_at', '<=', now),
+                               ('id', 'not in', breached.ids)], order='deadline_at')
+        breached.write({'sla_status': 'breached'})
+        at_risk.write({'sla_status': 'at_risk'})
+        (breached | at_risk)._schedule_sla_activities()
+
+    def _schedule_sla_activities(self):
+        """One to-do per application whose SLA status changed, created in a single batch"""
+        if not self:
+            return
+        activity_type = self.env.ref('mail.mail_activity_data_todo')
+        model_id = self.env['ir.model']._get_id(self._name)
+        state_labels = dict(self._fields['state'].selection)
+        self.env['mail.activity'].sudo().create([{
+            'res_model_id': model_id,
+            'res_id': rec.id,
+            'activity_type_id': activity_type.id,
+            'summary': (_('SLA breached: %s') if rec.sla_status == 'breached' else _('SLA at risk: %s'))
+                       % state_labels.get(rec.state),
+            'date_deadline': fields.Date.to_date(rec.deadline_at),
+            'user_id': rec.consultant_id.user_id.id or self.env.ref('base.user_admin').id,
+        } for rec in self])
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from datetime import timedelta
+
+from odoo import models, fields, api
+
+from .applicatioon import CLOSED_STATES
+
+_logger = logging.getLogger(__name__)
+
+# Payments and invoices in these states are not owed anymore and can be archived
+SETTLED_STATES = ('paid', 'cancelled')
+
+
+class VisaArchive(models.AbstractModel):
+    _name = 'visa.archive'
+    _description = 'Closed Application Archival'
+
+    @api.model
+    def _get_archivable_domain(self):
+        """Active applications closed for longer than visa.archive_retention_days.
+
+        Applications with an open payment or invoice stay active, so the money
+        still owed stays in collections.
+        """
+        retention_days = int(self.env['ir.config_parameter'].sudo().get_param('visa.archive_retention_days', 365))
+        cutoff = fields.Datetime.now() - timedelta(days=retention_days)
+        return [
+            ('state', 'in', CLOSED_STATES),
+            ('id', 'not inselect', ("""
+                SELECT p.application_id FROM visa_payment p
+                 WHERE p.application_id IS NOT NULL AND p.state NOT IN %s
+                 UNION
+                SELECT COALESCE(i.application_id, p.application_id) FROM visa_invoice i
+                  LEFT JOIN visa_payment p ON p.id = i.payment_id
+                 WHERE COALESCE(i.application_id, p.application_id) IS NOT NULL AND i.state NOT IN %s
+            """, [SETTLED_STATES, SETTLED_STATES])),
+            '|', ('stage_entered_at', '<', cutoff),
+            '&', ('stage_entered_at', '=', False), ('write_date', '<', cutoff),
+        ]
+
+    @api.model
+    def _archive_applications(self, applications):
+        """Archive the applications with their documents, settled payments and settled invoices"""
+        documents = self.env['visa.document'].search([('application_id', 'in', applications.ids)])
+        payments = self.env['visa.payment'].search([('application_id', 'in', applications.ids)])
+        invoices = self.env['visa.invoice'].search([
+            '|', ('application_id', 'in', applications.ids), ('payment_id', 'in', payments.ids),
+            ('state', 'in', SETTLED_STATES),
+        ])
+        payments = payments.filtered(lambda p: p.state in SETTLED_STATES)
+        invoices.write({'active': False})
+        payments.write({'active': False})
+        documents.write({'active': False})
+        applications.write({'active': False})
+        return len(applications) + len(documents) + len(payments) + len(invoices)
+
+    @api.model
+    def _cron_archive_closed_applications(self, batch_size=500, max_batches=20):
+        """Archive closed applications in committed batches.
+
+        Each batch is picked again from the remaining active applications, so an
+        interrupted run simply resumes where it stopped on the next call.
+        """
+        domain = self._get_archivable_domain()
+        Application = self.env['visa.application']
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for _iteration in range(max_batches):
+            applications = Application.search(domain, order='id', limit=batch_size)
+            if not applications:
+                return
+            count = self._archive_applications(applications)
+            _logger.info('Archived %s closed applications (%s records)', len(applications), count)
+            if auto_commit:
+                self.env.cr.commit()
+        self.env.ref('student__visa__consultancy__management.ir_cron_visa_archive')._trigger()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api, tools
+
+# Facet name -> visa_course column
+CATALOG_FACETS = {
+    'country': 'country_id',
+    'level': 'level',
+    'intake': 'intake',
+    'fee_band': 'fee_band',
+    'partner': 'is_partner',
+}
+
+
+class VisaCatalog(models.AbstractModel):
+    _name = 'visa.catalog'
+    _description = 'University and Course Catalog'
+
+    @api.model
+    def _normalize_filters(self, filters):
+        """Hashable form of the filters: sorted value tuples per facet plus the search text.
+
+        Equal selections give the same key whatever their order, so common
+        combinations share one cache entry.
+        """
+        key = []
+        for facet in CATALOG_FACETS:
+            values = filters.get(facet) or ()
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            if facet == 'country':
+                values = [int(value) for value in values if str(value).isdigit()]
+            elif facet == 'partner':
+                values = [value in (True, '1', 'true', 'True') for value in values]
+            key.append((facet, tuple(sorted(set(values)))))
+        key.append(('search', (filters.get('search') or '').strip()))
+        return tuple(key)
+
+    @api.model
+    def _get_domain(self, key, skip=None):
+        filters = dict(key)
+        domain = [('university_id.active', '=', True)]
+        for facet, column in CATALOG_FACETS.items():
+            if facet != skip and filters[facet]:
+                domain.append((column, 'in', list(filters[facet])))
+        if filters['search']:
+            domain += ['|', ('name', 'ilike', filters['search']), ('university_id.name', 'ilike', filters['search'])]
+        return domain
+
+    @api.model
+    @tools.ormcache('key', 'stamps')
+    def _get_facet_counts(self, key, stamps):
+        """Course counts of every facet value in one grouped query.
+
+        Each facet is counted with all the other facets applied but not its own,
+        so choosing a country still shows how many courses the other countries
+        have. Cached per filter combination and university and course change
+        stamps, a catalog change gives new stamps and so a recount.
+        """
+        self.env['visa.course'].flush()
+        self.env['visa.university'].flush(['name', 'active'])
+        filters = dict(key)
+        params = {}
+        search_clause = ''
+        if filters['search']:
+            params['search'] = '%%%s%%' % filters['search']
+            search_clause = 'AND (c.name ILIKE %(search)s OR u.name ILIKE %(search)s)'
+        matches = []
+        for facet, column in CATALOG_FACETS.items():
+            if filters[facet]:
+                params[facet] = list(filters[facet])
+                matches.append('c.%s = ANY(%%(%s)s) AS match_%s' % (column, facet, facet))
+            else:
+                matches.append('TRUE AS match_%s' % facet)
+        counts = []
+        for facet in CATALOG_FACETS:
+            others = ' AND '.join('match_%s' % other for other in CATALOG_FACETS if other != facet)
+            counts.append('COUNT(*) FILTER (WHERE %s) AS count_%s' % (others, facet))
+        self.env.cr.execute("""
+            WITH courses AS (
+                SELECT c.country_id, c.level, c.intake, c.fee_band, c.is_partner, {matches}
+                  FROM visa_course c
+                  JOIN visa_university u ON u.id = c.university_id
+                 WHERE c.active AND u.active {search_clause}
+            )
+            SELECT country_id, level, intake, fee_band, is_partner,
+                   GROUPING(country_id) = 0, GROUPING(level) = 0, GROUPING(intake) = 0,
+                   GROUPING(fee_band) = 0, GROUPING(is_partner) = 0, {counts}
+              FROM courses
+          GROUP BY GROUPING SETS ((country_id), (level), (intake), (fee_band), (is_partner))
+        """.format(matches=', '.join(matches), counts=', '.join(counts), search_clause=search_clause), params)
+        facets = {facet: [] for facet in CATALOG_FACETS}
+        for row in self.env.cr.fetchall():
+            values, grouped, row_counts = row[:5], row[5:10], row[10:]
+            for index, facet in enumerate(CATALOG_FACETS):
+                if grouped[index] and values[index] is not None and row_counts[index]:
+                    facets[facet].append((values[index], row_counts[index]))
+        return {facet: tuple(sorted(counts, key=lambda item: -item[1])) for facet, counts in facets.items()}
+
+    @api.model
+    def _get_stamps(self):
+        stamps = self.env['visa.portal.counter']._get_stamps()
+        return stamps['visa.university'], stamps['visa.course']
+
+    @api.model
+    def _search_catalog(self, filters, limit=20, offset=0):
+        """Matching courses, their universities and the facet counts of a catalog search.
+
+        Only active courses of active universities are listed, the caller
+        decides whether to run this as sudo for public visitors.
+        """
+        key = self._normalize_filters(filters)
+        Course = self.env['visa.course']
+        domain = self._get_domain(key)
+        courses = Course.search(domain, limit=limit, offset=offset, order='is_partner desc, name, id')
+        return {
+            'key': key,
+            'courses': courses,
+            'universities': courses.university_id,
+            'count': Course.search_count(domain),
+            'facets': self._get_facet_counts(key, self._get_stamps()),
+        }
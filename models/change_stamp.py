@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from odoo import models, api, tools
+
+# Counter shown on the portal home: (model, models whose changes can alter it)
+PORTAL_COUNTERS = {
+    'student_count': ('visa.student', ('visa.student', 'visa.consultant')),
+    'application_count': ('visa.application', ('visa.application', 'visa.consultant')),
+    'document_count': ('visa.document', ('visa.document',)),
+    'payment_count': ('visa.payment', ('visa.payment',)),
+}
+STAMPED_MODELS = ('visa.student', 'visa.application', 'visa.document', 'visa.payment', 'visa.consultant',
+                  'visa.university', 'visa.course', 'visa.outbox.sink')
+DEFAULT_STAMP_TTL = 5
+
+# {dbname: (expiry, {model: stamp})}, the last stamps read by this process
+_stamp_snapshots = {}
+
+
+def stamp_sequence(model_name):
+    return 'visa_change_stamp_%s_seq' % model_name.replace('.', '_')
+
+
+class VisaChangeStampMixin(models.AbstractModel):
+    """Bump a per-model change stamp when records that can change counters are
+    created, deleted or written on one of the _change_stamp_fields.
+
+    The stamp is a PostgreSQL sequence bumped after commit, so bumping never
+    locks and readers never see a stamp before the data it stands for.
+    """
+    _name = 'visa.change.stamp.mixin'
+    _description = 'Change Stamp Mixin'
+    _change_stamp_fields = ('active',)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(VisaChangeStampMixin, self).create(vals_list)
+        self._bump_change_stamp()
+        return records
+
+    def write(self, vals):
+        res = super(VisaChangeStampMixin, self).write(vals)
+        if set(self._change_stamp_fields) & set(vals):
+            self._bump_change_stamp()
+        return res
+
+    def unlink(self):
+        res = super(VisaChangeStampMixin, self).unlink()
+        self._bump_change_stamp()
+        return res
+
+    @api.model
+    def _bump_change_stamp(self):
+        data = self.env.cr.postcommit.data
+        bumped = data.get('visa.change.stamp')
+        if bumped is None:
+            bumped = data['visa.change.stamp'] = set()
+            registry = self.env.registry
+
+            @self.env.cr.postcommit.add
+            def bump():
+                names = sorted(bumped)
+                with registry.cursor() as cr:
+                    cr.execute('SELECT %s' % ', '.join("nextval('%s')" % stamp_sequence(name) for name in names))
+                    stamps = cr.fetchone()
+                # this process sees its own writes right away
+                snapshot = _stamp_snapshots.get(registry.db_name)
+                if snapshot:
+                    snapshot[1].update(zip(names, stamps))
+        bumped.add(self._name)
+
+
+class VisaPortalCounter(models.AbstractModel):
+    _name = 'visa.portal.counter'
+    _description = 'Cached Portal Counters'
+
+    def init(self):
+        for model_name in STAMPED_MODELS:
+            self.env.cr.execute('CREATE SEQUENCE IF NOT EXISTS %s' % stamp_sequence(model_name))
+
+    @api.model
+    def _get_stamps(self):
+        """Current change stamps, read from the database at most once per TTL per process"""
+        dbname = self.env.cr.dbname
+        snapshot = _stamp_snapshots.get(dbname)
+        now = time.monotonic()
+        if snapshot and snapshot[0] > now:
+            return snapshot[1]
+        ttl = int(self.env['ir.config_parameter'].sudo().get_param('visa.portal_counter_ttl', DEFAULT_STAMP_TTL))
+        self.env.cr.execute('SELECT %s' % ', '.join(
+            '(SELECT last_value FROM %s)' % stamp_sequence(name) for name in STAMPED_MODELS))
+        stamps = dict(zip(STAMPED_MODELS, self.env.cr.fetchone()))
+        _stamp_snapshots[dbname] = (now + ttl, stamps)
+        return stamps
+
+    @api.model
+    def _get_counts(self, counters):
+        """Portal home counters of the current user.
+
+        Counts are cached per user and stamps of the models they depend on,
+        a change to one of those models gives new stamps and so a recount.
+        Group changes clear the ormcache of every worker.
+        """
+        stamps = self._get_stamps()
+        values = {}
+        for counter in counters:
+            if counter not in PORTAL_COUNTERS:
+                continue
+            model_name, depends = PORTAL_COUNTERS[counter]
+            values[counter] = self._count(model_name, tuple(stamps[name] for name in depends),
+                                          tuple(self.env.context.get('allowed_company_ids') or ()))
+        return values
+
+    @api.model
+    @tools.ormcache('self.env.uid', 'model_name', 'stamps', 'company_ids')
+    def _count(self, model_name, stamps, company_ids):
+        return self.env[model_name].search_count([])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+
+
+class VisaChecklistTemplate(models.Model):
+    _name = 'visa.checklist.template'
+    _description = 'Document Checklist Template'
+    _rec_name = 'name'
+
+    name = fields.Char(string='Template Name', required=True)
+    country_id = fields.Many2one('res.country', string='University Country',
+                                 help='Leave empty to use the template for every country.')
+    level = fields.Selection([
+        ('diploma', 'Diploma'),
+        ('bachelor', 'Bachelor'),
+        ('master', 'Master'),
+        ('phd', 'PhD')
+    ], string='Course Level', help='Leave empty to use the template for every level.')
+    line_ids = fields.One2many('visa.checklist.template.line', 'template_id', string='Documents', copy=True)
+    active = fields.Boolean(string='Active', default=True)
+
+    _sql_constraints = [
+        ('country_level_unique', 'unique(country_id, level)',
+         'A checklist template already exists for this country and level!')
+    ]
+
+    def init(self):
+        # unique(country_id, level) lets generic templates through, NULL never equals NULL
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS visa_checklist_template_country_level_uniq
+            ON visa_checklist_template (COALESCE(country_id, 0), COALESCE(level, ''))
+        """)
+
+    @api.model
+    def _get_template_map(self):
+        """Return the active templates keyed by (country id, level)"""
+        return {(t.country_id.id, t.level or False): t for t in self.search([])}
+
+    @api.model
+    def _match(self, template_map, country_id, level):
+        """Most specific template for a country and level, falling back to generic ones"""
+        for key in ((country_id, level), (country_id, False), (False, level), (False, False)):
+            if key in template_map:
+                return template_map[key]
+        return self.browse()
+
+
+class VisaChecklistTemplateLine(models.Model):
+    _name = 'visa.checklist.template.line'
+    _description = 'Document Checklist Template Line'
+    _order = 'sequence, id'
+
+    template_id = fields.Many2one('visa.checklist.template', string='Template', required=True, ondelete='cascade')
+    sequence = fields.Integer(string='Sequence', default=10)
+    name = fields.Char(string='Document Name', required=True)
+    document_type = fields.Selection(selection=lambda self: self.env['visa.document']._fields['document_type'].selection,
+                                     string='Document Type', required=True)
+    is_mandatory = fields.Boolean(string='Mandatory', default=True)
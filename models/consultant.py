@@ -6,8 +6,9 @@ from odoo import models, fields, api, _
 class VisaConsultant(models.Model):
     _name = 'visa.consultant'
     _description = 'Visa Consultant'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'visa.change.stamp.mixin']
     _rec_name = 'name'
+    _change_stamp_fields = ('active', 'user_id')
 
     name = fields.Char(string='Consultant Name', required=True, tracking=True)
     user_id = fields.Many2one('res.users', string='Related User', tracking=True)
@@ -46,14 +47,16 @@ class VisaConsultant(models.Model):
     def _compute_metrics(self):
         for rec in self:
             rec.total_students = len(rec.student_ids)
-            rec.total_applications = len(rec.application_ids)
+            rec.total_applications = len(rec.with_context(active_test=False).application_ids)
 
     @api.depends('application_ids.state')
     def _compute_success_rate(self):
         for rec in self:
-            total = len(rec.application_ids)
+            # archived applications are history too
+            applications = rec.with_context(active_test=False).application_ids
+            total = len(applications)
             if total > 0:
-                approved = len(rec.application_ids.filtered(lambda a: a.state == 'visa_approved'))
+                approved = len(applications.filtered(lambda a: a.state == 'visa_approved'))
                 rec.success_rate = (approved / total) * 100
             else:
                 rec.success_rate = 0.0
@@ -36,56 +36,58 @@ class VisaDashboard(models.Model):
 
     @api.depends()
     def _compute_statistics(self):
+        # read-only aggregations, served by the read replica when one is configured
+        with self.env['visa.replica']._replica_env() as env:
+            values = self._get_statistics(env)
         for record in self:
-            # Total counts
-            record.total_students = self.env['visa.student'].search_count([])
-            record.total_applications = self.env['visa.application'].search_count([])
+            record.update(values)
 
-            # Revenue calculation
-            paid_payments = self.env['visa.payment'].search([('state', '=', 'paid')])
-            record.total_revenue = sum(paid_payments.mapped('amount'))
+    @api.model
+    def _get_statistics(self, env):
+        Student = env['visa.student']
+        # archived applications and payments still count in the historical figures
+        Application = env['visa.application'].with_context(active_test=False)
 
-            # Pending documents
-            record.pending_documents = self.env['visa.document'].search_count([
-                ('state', 'in', ['pending', 'received'])
-            ])
+        # Revenue calculation, converted to company currency at payment date rates
+        converter = env['visa.currency.converter'].with_context(active_test=False)
+        today = fields.Date.today()
+        first_day = today.replace(day=1)
 
-            # Overdue payments
-            today = fields.Date.today()
-            record.overdue_payments = self.env['visa.payment'].search_count([
-                ('due_date', '<', today),
-                ('state', '!=', 'paid')
-            ])
+        # Success rate
+        total_completed = Application.search_count([('state', 'in', ['visa_approved', 'rejected'])])
+        approved = Application.search_count([('state', '=', 'visa_approved')])
 
+        return {
+            # Total counts
+            'total_students': Student.search_count([]),
+            'total_applications': Application.search_count([]),
+            'total_revenue': converter._sum_in_company_currency('visa.payment', [('state', '=', 'paid')]),
+            # Pending documents
+            'pending_documents': env['visa.document'].search_count([('state', 'in', ['pending', 'received'])]),
+            # Overdue payments
+            'overdue_payments': env['visa.payment'].search_count([('due_date', '<', today), ('state', '!=', 'paid')]),
             # This month statistics
-            first_day = today.replace(day=1)
-            record.students_this_month = self.env['visa.student'].search_count([
-                ('create_date', '>=', first_day)
-            ])
-            record.applications_this_month = self.env['visa.application'].search_count([
-                ('create_date', '>=', first_day)
-            ])
-
-            month_payments = self.env['visa.payment'].search([
+            'students_this_month': Student.search_count([('create_date', '>=', first_day)]),
+            'applications_this_month': Application.search_count([('create_date', '>=', first_day)]),
+            'revenue_this_month': converter._sum_in_company_currency('visa.payment', [
                 ('payment_date', '>=', first_day),
                 ('state', '=', 'paid')
-            ])
-            record.revenue_this_month = sum(month_payments.mapped('amount'))
-
-            # Success rate
-            total_completed = self.env['visa.application'].search_count([
-                ('state', 'in', ['visa_approved', 'rejected'])
-            ])
-            approved = self.env['visa.application'].search_count([('state', '=', 'visa_approved')])
-            record.success_rate = (approved / total_completed * 100) if total_completed > 0 else 0
+            ]),
+            'success_rate': (approved / total_completed * 100) if total_completed > 0 else 0,
+        }
 
     @api.depends()
     def _compute_application_status(self):
+        with self.env['visa.replica']._replica_env() as env:
+            Application = env['visa.application'].with_context(active_test=False)
+            counts = {g['state']: g['__count'] for g in Application.read_group(
+                [('state', 'in', ['draft', 'in_progress', 'visa_approved', 'rejected'])], ['state'], ['state'],
+                lazy=False)}
         for record in self:
-            record.draft_applications = self.env['visa.application'].search_count([('state', '=', 'draft')])
-            record.in_progress_applications = self.env['visa.application'].search_count([('state', '=', 'in_progress')])
-            record.approved_applications = self.env['visa.application'].search_count([('state', '=', 'visa_approved')])
-            record.rejected_applications = self.env['visa.application'].search_count([('state', '=', 'rejected')])
+            record.draft_applications = counts.get('draft', 0)
+            record.in_progress_applications = counts.get('in_progress', 0)
+            record.approved_applications = counts.get('visa_approved', 0)
+            record.rejected_applications = counts.get('rejected', 0)
 
     def action_view_students(self):
         return {
@@ -1,17 +1,27 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import threading
+
 from odoo import models, fields, api, _
+from odoo.tools import image_process
+from odoo.tools.pdf import PdfFileReader
+
+_logger = logging.getLogger(__name__)
 
 
 class VisaDocument(models.Model):
     _name = 'visa.document'
     _description = 'Document Management'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'visa.change.stamp.mixin']
     _rec_name = 'name'
 
     name = fields.Char(string='Document Name', required=True)
     student_id = fields.Many2one('visa.student', string='Student', required=True, ondelete='cascade')
     application_id = fields.Many2one('visa.application', string='Application', ondelete='cascade')
+    checklist_line_id = fields.Many2one('visa.checklist.template.line', string='Checklist Item', readonly=True,
+                                        ondelete='set null', index=True,
+                                        help='Checklist template item this document was generated from.')
 
     # Document Details
     document_type = fields.Selection([
@@ -38,6 +48,14 @@ class VisaDocument(models.Model):
     # File Upload
     attachment_ids = fields.Many2many('ir.attachment', string='Attachments')
     file_name = fields.Char(string='File Name')
+    thumbnail = fields.Image(string='Thumbnail', max_width=256, max_height=256, attachment=True)
+    page_count = fields.Integer(string='Pages')
+    processing_state = fields.Selection([
+        ('none', 'Not Required'),
+        ('queued', 'Queued'),
+        ('done', 'Processed'),
+        ('failed', 'Failed')
+    ], string='Processing', default='none', index=True, copy=False)
 
     # Status
     state = fields.Selection([
@@ -61,6 +79,13 @@ class VisaDocument(models.Model):
     is_expired = fields.Boolean(string='Expired', compute='_compute_is_expired', store=True)
 
     notes = fields.Text(string='Notes')
+    active = fields.Boolean(string='Active', default=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_document_active_state_idx
+            ON visa_document (state, create_date DESC) WHERE active
+        """)
 
     @api.depends('expiry_date')
     def _compute_is_expired(self):
@@ -85,4 +110,37 @@ class VisaDocument(models.Model):
         self.state = 'rejected'
 
     def action_reset(self):
-        self.state = 'pending'
\ No newline at end of file
+        self.state = 'pending'
+
+    def _process_attachment(self):
+        """Generate the thumbnail and page count from the first attachment"""
+        self.ensure_one()
+        attachment = self.attachment_ids[:1]
+        vals = {'processing_state': 'done'}
+        if attachment.mimetype == 'application/pdf':
+            with attachment._visa_open() as stream:
+                vals['page_count'] = PdfFileReader(stream, strict=False).getNumPages()
+        elif attachment.mimetype and attachment.mimetype.startswith('image/'):
+            vals['thumbnail'] = image_process(attachment.raw, size=(256, 256))
+            vals['page_count'] = 1
+        self.write(vals)
+
+    @api.model
+    def _cron_process_uploads(self, batch_size=50, max_batches=20):
+        """Background worker for portal uploads, processes queued documents batch by batch"""
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for _iteration in range(max_batches):
+            documents = self.search([('processing_state', '=', 'queued')], limit=batch_size)
+            if not documents:
+                return
+            for document in documents:
+                try:
+                    with self.env.cr.savepoint():
+                        document._process_attachment()
+                except Exception:
+                    _logger.exception('Could not process document %s', document.id)
+                    document.processing_state = 'failed'
+            if auto_commit:
+                self.env.cr.commit()
+        # more uploads are waiting, run again right away
+        self.env.ref('student__visa__consultancy__management.ir_cron_visa_document_processing')._trigger()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import threading
+from datetime import timedelta
+
+from odoo import models, fields, api, _
+
+_logger = logging.getLogger(__name__)
+
+# Fields copied from the form to the staging table, and from there to the student
+INQUIRY_FIELDS = ['name', 'email', 'phone', 'passport_number', 'country_id', 'highest_qualification', 'message']
+
+
+class VisaInquiry(models.Model):
+    _name = 'visa.inquiry'
+    _description = 'Website Inquiry'
+    _order = 'id desc'
+    _log_access = False
+
+    name = fields.Char(string='Full Name', required=True, readonly=True)
+    email = fields.Char(string='Email', required=True, readonly=True)
+    phone = fields.Char(string='Phone', readonly=True)
+    passport_number = fields.Char(string='Passport Number', readonly=True)
+    country_id = fields.Many2one('res.country', string='Country', readonly=True)
+    highest_qualification = fields.Selection(
+        selection=lambda self: self.env['visa.student']._fields['highest_qualification'].selection,
+        string='Highest Qualification', readonly=True)
+    message = fields.Text(string='Message', readonly=True)
+    ip_address = fields.Char(string='IP Address', readonly=True)
+    submitted_at = fields.Datetime(string='Submitted', readonly=True, default=fields.Datetime.now)
+    state = fields.Selection([
+        ('new', 'To Process'),
+        ('done', 'Student Created'),
+        ('duplicate', 'Existing Student'),
+        ('failed', 'Failed')
+    ], string='Status', default='new', readonly=True, index=True)
+    student_id = fields.Many2one('visa.student', string='Student', readonly=True, ondelete='set null')
+    error = fields.Text(string='Error', readonly=True)
+
+    def init(self):
+        # rate limit lookups: recent submissions of an address
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_inquiry_ip_submitted_idx
+            ON visa_inquiry (ip_address, submitted_at)
+        """)
+
+    @api.model
+    def _get_rate_limit(self):
+        """(submissions, seconds) allowed per IP address"""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return int(get_param('visa.inquiry_rate_limit', 5)), int(get_param('visa.inquiry_rate_window', 600))
+
+    @api.model
+    def _stage(self, values, ip_address):
+        """Append a submission to the staging table, return False when the address is over its rate limit.
+
+        A single INSERT ... SELECT that checks the recent submissions of the
+        address: no ORM, no student, no duplicate lookup in the request. The
+        transaction-level advisory lock on the address serializes concurrent
+        submissions of one address, so the count is checked against the rows
+        of the ones committed before.
+        """
+        limit, window = self._get_rate_limit()
+        columns = [name for name in INQUIRY_FIELDS if values.get(name)]
+        self.env.cr.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ['visa_inquiry:%s' % ip_address])
+        self.env.cr.execute("""
+            INSERT INTO visa_inquiry ({columns}, ip_address, submitted_at, state)
+            SELECT {placeholders}, %s, now() AT TIME ZONE 'UTC', 'new'
+             WHERE (SELECT COUNT(*) FROM visa_inquiry
+                     WHERE ip_address = %s
+                       AND submitted_at > (now() AT TIME ZONE 'UTC') - %s * interval '1 second') < %s
+         RETURNING id
+        """.format(columns=', '.join(columns), placeholders=', '.join(['%s'] * len(columns))),
+            [values[name] for name in columns] + [ip_address, ip_address, window, limit])
+        row = self.env.cr.fetchone()
+        return row and row[0]
+
+    @api.model
+    def _normalize_values(self, post):
+        """Cleaned submission values, or an error message"""
+        values = {name: str(post.get(name) or '').strip()[:1000] for name in INQUIRY_FIELDS}
+        values['email'] = values['email'].lower()
+        values['passport_number'] = re.sub(r'\W', '', values['passport_number']).upper()
+        country_id = int(values['country_id']) if values['country_id'].isdigit() else None
+        values['country_id'] = country_id and self.env['res.country'].sudo().browse(country_id).exists().id or None
+        qualifications = dict(self.env['visa.student']._fields['highest_qualification'].selection)
+        if values['highest_qualification'] not in qualifications:
+            values['highest_qualification'] = None
+        if not values['name'] or not values['phone']:
+            return values, _('Please fill in your name and phone number.')
+        if not re.match(r'^[^@\s]+@[^@\s]+\.[^@\s]+$', values['email']):
+            return values, _('Please enter a valid email address.')
+        return values, None
+
+    def _prepare_student_vals(self):
+        self.ensure_one()
+        return {
+            'name': self.name,
+            'email': self.email,
+            'phone': self.phone,
+            'passport_number': self.passport_number or False,
+            'country_id': self.country_id.id,
+            'highest_qualification': self.highest_qualification,
+            'notes': self.message,
+            'state': 'inquiry',
+        }
+
+    def _get_dedupe_keys(self):
+        self.ensure_one()
+        keys = [('email', self.email)]
+        if self.passport_number:
+            keys.append(('passport', self.passport_number))
+        return keys
+
+    def _ingest(self):
+        """Create the students of a batch of inquiries.
+
+        Inquiries matching an existing student on email or passport, or an
+        earlier inquiry of the batch, are linked to that student instead.
+        Returns the students created.
+        """
+        Student = self.env['visa.student'].sudo().with_context(active_test=False, tracking_disable=True)
+        emails = {inquiry.email for inquiry in self}
+        passports = {inquiry.passport_number for inquiry in self if inquiry.passport_number}
+        self.env.cr.execute("""
+            SELECT id, lower(email), passport_number FROM visa_student
+             WHERE lower(email) IN %s OR passport_number IN %s
+        """, [tuple(emails), tuple(passports) or ('',)])
+        by_email, by_passport = {}, {}
+        for student_id, email, passport in self.env.cr.fetchall():
+            by_email.setdefault(email, student_id)
+            if passport:
+                by_passport.setdefault(passport, student_id)
+
+        to_create = self.browse()
+        first_of = {}
+        for inquiry in self:
+            student_id = by_email.get(inquiry.email) or by_passport.get(inquiry.passport_number)
+            if student_id:
+                inquiry.write({'state': 'duplicate', 'student_id': student_id})
+                continue
+            keys = inquiry._get_dedupe_keys()
+            if any(key in first_of for key in keys):
+                # linked once the first inquiry of the batch has its student
+                continue
+            first_of.update(dict.fromkeys(keys, inquiry))
+            to_create |= inquiry
+
+        self.flush()
+        try:
+            with self.env.cr.savepoint():
+                students = Student.create([inquiry._prepare_student_vals() for inquiry in to_create])
+        except Exception:
+            # one bad submission must not block the others: create them one by one
+            students = Student
+            for inquiry in to_create:
+                try:
+                    with self.env.cr.savepoint():
+                        students |= Student.create(inquiry._prepare_student_vals())
+                except Exception as e:
+                    inquiry.write({'state': 'failed', 'error': str(e)})
+                    to_create -= inquiry
+        for inquiry, student in zip(to_create, students):
+            inquiry.write({'state': 'done', 'student_id': student.id})
+        for inquiry in self.filtered(lambda i: i.state == 'new'):
+            first = next(first_of[key] for key in inquiry._get_dedupe_keys() if key in first_of)
+            inquiry.write({
+                'state': 'duplicate' if first.student_id else 'failed',
+                'student_id': first.student_id.id,
+                'error': False if first.student_id else first.error,
+            })
+        return students
+
+    @api.model
+    def _cron_ingest(self, batch_size=500, max_batches=20, keep_days=30):
+        """Turn staged inquiries into students, batch by batch.
+
+        Batches are locked with SKIP LOCKED so overlapping runs never pick the
+        same rows; processed inquiries are removed after keep_days.
+        """
+        self.env.cr.execute("""
+            DELETE FROM visa_inquiry WHERE state != 'new' AND submitted_at < %s
+        """, [fields.Datetime.now() - timedelta(days=keep_days)])
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for _iteration in range(max_batches):
+            self.env.cr.execute("""
+                SELECT id FROM visa_inquiry WHERE state = 'new' ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+            """, [batch_size])
+            inquiries = self.browse([row[0] for row in self.env.cr.fetchall()])
+            if not inquiries:
+                return
+            students = inquiries._ingest()
+            _logger.info('Ingested %s inquiries, %s new students', len(inquiries), len(students))
+            if auto_commit:
+                self.env.cr.commit()
+        self.env.ref('student__visa__consultancy__management.ir_cron_visa_inquiry_ingest')._trigger()
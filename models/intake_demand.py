@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, timedelta
+
+from odoo import models, fields, api, tools
+
+from .applicatioon import INTAKE_MONTHS, INTAKE_YEAR_PATTERN, intake_year_value
+
+# Applications that no longer take a seat
+RELEASED_STATES = ('rejected', 'cancelled')
+ACCEPTED_STATES = ('offer_accepted', 'visa_filed', 'visa_approved')
+# Below this share of the final volume the projection is too noisy to be used
+MIN_CURVE_FRACTION = 0.05
+NEAR_CAPACITY_RATE = 90.0
+
+
+def intake_start(intake, intake_year):
+    """First day of an intake, None when the year is not a year"""
+    year = intake_year_value(intake_year)
+    if not intake or not year:
+        return None
+    return date(year, INTAKE_MONTHS.index(intake) + 1, 1)
+
+
+class VisaIntakeDemand(models.Model):
+    _name = 'visa.intake.demand'
+    _description = 'Intake Demand Forecast'
+    _order = 'intake_start desc, university_id, course_id'
+
+    university_id = fields.Many2one('visa.university', string='University', required=True, readonly=True,
+                                    ondelete='cascade', index=True)
+    course_id = fields.Many2one('visa.course', string='Course', readonly=True, ondelete='cascade', index=True)
+    intake = fields.Selection(selection=lambda self: self.env['visa.application']._fields['intake'].selection,
+                              string='Intake', required=True, readonly=True)
+    intake_year = fields.Char(string='Intake Year', required=True, readonly=True)
+    intake_start = fields.Date(string='Intake Start', readonly=True, index=True)
+
+    # Maintained incrementally by visa.application create, write and unlink
+    application_count = fields.Integer(string='Applications', readonly=True, group_operator='sum')
+    accepted_count = fields.Integer(string='Accepted Offers', readonly=True, group_operator='sum')
+
+    forecast_count = fields.Integer(string='Forecast', readonly=True, group_operator='sum',
+                                    help='Projected number of applications when the intake starts.')
+    capacity = fields.Integer(related='course_id.capacity', string='Seats', store=True)
+    fill_rate = fields.Float(string='Forecast Fill (%)', compute='_compute_forecast_status', store=True,
+                             group_operator='avg')
+    forecast_status = fields.Selection([
+        ('no_limit', 'No Seat Limit'),
+        ('ok', 'Within Capacity'),
+        ('near', 'Near Capacity'),
+        ('over', 'Over Capacity')
+    ], string='Capacity Status', compute='_compute_forecast_status', store=True, index=True)
+
+    def init(self):
+        # course is optional, so the key uses COALESCE for the upsert to find the row
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS visa_intake_demand_key_idx
+            ON visa_intake_demand (university_id, COALESCE(course_id, 0), intake, intake_year)
+        """)
+        self.env.cr.execute("SELECT 1 FROM visa_intake_demand LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._rebuild_counts()
+
+    @api.depends('forecast_count', 'capacity')
+    def _compute_forecast_status(self):
+        for rec in self:
+            if not rec.capacity:
+                rec.fill_rate = 0.0
+                rec.forecast_status = 'no_limit'
+                continue
+            rec.fill_rate = 100.0 * rec.forecast_count / rec.capacity
+            if rec.forecast_count > rec.capacity:
+                rec.forecast_status = 'over'
+            elif rec.fill_rate >= NEAR_CAPACITY_RATE:
+                rec.forecast_status = 'near'
+            else:
+                rec.forecast_status = 'ok'
+
+    # ------------------------------------------------------------------
+    # Demand counts
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _get_counted_keys(self, applications):
+        """{application id: (key, application delta, accepted delta)} of the applications taking a seat"""
+        result = {}
+        for app in applications:
+            if app.state in RELEASED_STATES or not app.university_id:
+                continue
+            key = (app.university_id.id, app.course_id.id or None, app.intake, app.intake_year)
+            result[app.id] = (key, 1, 1 if app.state in ACCEPTED_STATES else 0)
+        return result
+
+    @api.model
+    def _apply_deltas(self, before, after):
+        """Apply the difference between two _get_counted_keys snapshots to the demand counts"""
+        deltas = {}
+        for sign, snapshot in ((-1, before), (1, after)):
+            for key, applications, accepted in snapshot.values():
+                counts = deltas.setdefault(key, [0, 0])
+                counts[0] += sign * applications
+                counts[1] += sign * accepted
+        rows = [key + (intake_start(key[2], key[3]), applications, accepted)
+                for key, (applications, accepted) in deltas.items() if applications or accepted]
+        if not rows:
+            return self.browse()
+        # capacity is a plain copy here, the stored related field keeps it current afterwards
+        self.env.cr.execute("""
+            INSERT INTO visa_intake_demand AS d
+                   (university_id, course_id, intake, intake_year, intake_start, application_count, accepted_count,
+                    forecast_count, capacity)
+            SELECT v.university_id, v.course_id, v.intake, v.intake_year, v.intake_start, v.applications,
+                   v.accepted, 0, c.capacity
+              FROM unnest(%s::int[], %s::int[], %s::varchar[], %s::varchar[], %s::date[], %s::int[], %s::int[])
+                   AS v (university_id, course_id, intake, intake_year, intake_start, applications, accepted)
+         LEFT JOIN visa_course c ON c.id = v.course_id
+            ON CONFLICT (university_id, COALESCE(course_id, 0), intake, intake_year) DO UPDATE
+               SET application_count = d.application_count + EXCLUDED.application_count,
+                   accepted_count = d.accepted_count + EXCLUDED.accepted_count
+            RETURNING id
+        """, [list(column) for column in zip(*rows)])
+        demands = self.browse([row[0] for row in self.env.cr.fetchall()])
+        demands.invalidate_cache(['application_count', 'accepted_count', 'capacity'])
+        self.env.add_to_compute(self._fields['forecast_status'], demands)
+        demands._update_forecast()
+        return demands
+
+    @api.model
+    def _rebuild_counts(self):
+        """Recount every intake from the applications, the incremental updates start from here"""
+        self.env.cr.execute("DELETE FROM visa_intake_demand")
+        self.env.cr.execute("""
+            INSERT INTO visa_intake_demand
+                   (university_id, course_id, intake, intake_year, intake_start, application_count, accepted_count,
+                    forecast_count, capacity)
+            SELECT a.university_id, a.course_id, a.intake, a.intake_year,
+                   CASE WHEN a.intake_year ~ %s
+                        THEN make_date(a.intake_year::int, array_position(%s, a.intake::text), 1) END,
+                   COUNT(*), COUNT(*) FILTER (WHERE a.state IN %s), 0, MAX(c.capacity)
+              FROM visa_application a
+         LEFT JOIN visa_course c ON c.id = a.course_id
+             WHERE a.state NOT IN %s AND a.university_id IS NOT NULL AND a.intake IS NOT NULL
+               AND a.intake_year IS NOT NULL
+          GROUP BY a.university_id, a.course_id, a.intake, a.intake_year
+        """, [INTAKE_YEAR_PATTERN, INTAKE_MONTHS, ACCEPTED_STATES, RELEASED_STATES])
+        self.invalidate_cache()
+        demands = self.search([])
+        self.env.add_to_compute(self._fields['forecast_status'], demands)
+        demands._update_forecast()
+
+    # ------------------------------------------------------------------
+    # Forecast
+    # ------------------------------------------------------------------
+
+    @api.model
+    @tools.ormcache('intake', 'intake_year', 'today')
+    def _get_curve_fractions(self, intake, intake_year, today):
+        """Share of the final volume already reached at this distance from the intake start.
+
+        Every past intake gives one point: the share of its applications that
+        were created at least as many days before its start as today is before
+        this intake. Points are averaged per university, with an all universities
+        fallback under the False key. Cached per intake and day.
+        """
+        start = intake_start(intake, intake_year)
+        days_before = (start - today).days
+        self.env.cr.execute("""
+            WITH apps AS (
+                SELECT a.university_id,
+                       make_date(a.intake_year::int, array_position(%(months)s, a.intake::text), 1) AS intake_start,
+                       COALESCE(MIN(t.date), a.create_date)::date AS created_on
+                  FROM visa_application a
+             LEFT JOIN visa_application_transition t ON t.application_id = a.id AND t.from_state IS NULL
+                 WHERE a.intake_year ~ %(year_pattern)s AND a.state NOT IN %(released)s
+              GROUP BY a.id
+            ), curves AS (
+                SELECT university_id, intake_start,
+                       COUNT(*) FILTER (WHERE created_on <= intake_start - %(days)s)::float / COUNT(*) AS fraction
+                  FROM apps
+                 WHERE intake_start <= %(today)s
+              GROUP BY university_id, intake_start
+            )
+            SELECT university_id, AVG(fraction)
+              FROM curves
+          GROUP BY GROUPING SETS ((university_id), ())
+            HAVING COUNT(*) >= 2
+        """, {'months': INTAKE_MONTHS, 'year_pattern': INTAKE_YEAR_PATTERN, 'released': RELEASED_STATES,
+              'days': days_before, 'today': today})
+        return {university_id or False: fraction for university_id, fraction in self.env.cr.fetchall()}
+
+    def _update_forecast(self):
+        """Project the final volume of open intakes from the historical curves"""
+        today = fields.Date.context_today(self)
+        for rec in self:
+            forecast = rec.application_count
+            if rec.intake_start and rec.intake_start > today:
+                fractions = self._get_curve_fractions(rec.intake, rec.intake_year, today)
+                fraction = fractions.get(rec.university_id.id) or fractions.get(False) or 0.0
+                if fraction >= MIN_CURVE_FRACTION:
+                    forecast = max(round(rec.application_count / fraction), rec.application_count)
+            if rec.forecast_count != forecast:
+                rec.forecast_count = forecast
+
+    @api.model
+    def _cron_update_forecast(self):
+        """Daily: the distance to each intake changed, and so did the point on the curves.
+
+        The curve cache is keyed on the day, so today's fractions are computed afresh.
+        """
+        self.search([('intake_start', '>', fields.Date.context_today(self) - timedelta(days=1))])._update_forecast()
@@ -15,6 +15,9 @@ class VisaInvoice(models.Model):
     student_id = fields.Many2one('visa.student', string='Student', required=True, tracking=True)
     application_id = fields.Many2one('visa.application', string='Application')
     payment_id = fields.Many2one('visa.payment', string='Payment')
+    # Payments billed on a consolidated invoice
+    payment_ids = fields.One2many('visa.payment', 'invoice_id', string='Payments')
+    invoicing_run_id = fields.Many2one('visa.invoicing.run', string='Invoicing Run', readonly=True, index=True)
 
     # Invoice Details
     invoice_date = fields.Date(string='Invoice Date', default=fields.Date.today, required=True, tracking=True)
@@ -44,12 +47,20 @@ class VisaInvoice(models.Model):
 
     # Notes
     notes = fields.Text(string='Terms and Conditions')
+    active = fields.Boolean(string='Active', default=True)
 
-    @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code('visa.invoice') or 'New'
-        return super(VisaInvoice, self).create(vals)
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_invoice_active_state_idx
+            ON visa_invoice (state, invoice_date DESC) WHERE active
+        """)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get('name', 'New') == 'New':
+                vals['name'] = self.env['ir.sequence'].next_by_code('visa.invoice') or 'New'
+        return super(VisaInvoice, self).create(vals_list)
 
     @api.depends('line_ids.subtotal', 'line_ids.tax_amount')
     def _compute_amounts(self):
@@ -66,10 +77,9 @@ class VisaInvoice(models.Model):
 
     def action_mark_paid(self):
         """Mark invoice as paid"""
-        self.state = 'paid'
-        # Update related payment if exists
-        if self.payment_id:
-            self.payment_id.action_paid()
+        self.write({'state': 'paid'})
+        # Settle the related payments, this does not call back into the invoices already paid
+        (self.payment_id | self.payment_ids)._settle()
 
     def action_cancel(self):
         """Cancel invoice"""
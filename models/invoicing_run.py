@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from collections import defaultdict
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api, Command, _
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+
+def _previous_month_start():
+    return fields.Date.today().replace(day=1) - relativedelta(months=1)
+
+
+class VisaInvoicingRun(models.Model):
+    _name = 'visa.invoicing.run'
+    _description = 'Consolidated Invoicing Run'
+    _order = 'period_start desc'
+
+    name = fields.Char(string='Name', required=True,
+                       default=lambda self: _('Invoicing %s') % _previous_month_start().strftime('%B %Y'))
+    period_start = fields.Date(string='From', required=True, default=lambda self: _previous_month_start())
+    period_end = fields.Date(string='To', required=True,
+                             default=lambda self: fields.Date.today().replace(day=1) - relativedelta(days=1))
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('queued', 'Running'),
+        ('done', 'Done')
+    ], string='Status', default='draft', readonly=True, copy=False)
+    invoice_ids = fields.One2many('visa.invoice', 'invoicing_run_id', string='Invoices', readonly=True)
+    invoice_count = fields.Integer(string='Invoices', compute='_compute_invoice_count')
+    payment_count = fields.Integer(string='Billed Payments', readonly=True, copy=False)
+
+    _sql_constraints = [
+        ('period_unique', 'unique(period_start, period_end)', 'An invoicing run already exists for this period!')
+    ]
+
+    @api.constrains('period_start', 'period_end')
+    def _check_period(self):
+        for run in self:
+            if run.period_end < run.period_start:
+                raise ValidationError(_('The end of the period must be after its start.'))
+
+    def _compute_invoice_count(self):
+        groups = self.env['visa.invoice'].read_group([('invoicing_run_id', 'in', self.ids)],
+                                                     ['invoicing_run_id'], ['invoicing_run_id'])
+        counts = {g['invoicing_run_id'][0]: g['invoicing_run_id_count'] for g in groups}
+        for run in self:
+            run.invoice_count = counts.get(run.id, 0)
+
+    def action_queue(self):
+        self.write({'state': 'queued'})
+        self.env.ref('student__visa__consultancy__management.ir_cron_visa_invoicing_run')._trigger()
+
+    def action_view_invoices(self):
+        self.ensure_one()
+        return {
+            'name': _('Invoices'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'visa.invoice',
+            'view_mode': 'tree,form',
+            'domain': [('invoicing_run_id', '=', self.id)],
+        }
+
+    def _get_payment_domain(self):
+        """Confirmed payments of the period not billed yet, of students on consolidated invoicing"""
+        self.ensure_one()
+        return [
+            ('student_id.consolidated_invoicing', '=', True),
+            ('invoice_id', '=', False),
+            ('state', 'in', ['pending', 'paid']),
+            ('payment_date', '>=', self.period_start),
+            ('payment_date', '<=', self.period_end),
+        ]
+
+    def _prepare_invoice_vals(self, payments):
+        """One invoice with all its lines for payments of a single student and currency"""
+        self.ensure_one()
+        applications = payments.application_id
+        due_dates = [d for d in payments.mapped('due_date') if d]
+        return {
+            'student_id': payments.student_id.id,
+            'application_id': applications.id if len(applications) == 1 else False,
+            'invoicing_run_id': self.id,
+            'invoice_date': self.period_end,
+            'due_date': max(due_dates) if due_dates else self.period_end,
+            'currency_id': payments.currency_id.id,
+            'state': 'paid' if all(p.state == 'paid' for p in payments) else 'draft',
+            'notes': _('Payments from %s to %s') % (self.period_start, self.period_end),
+            'line_ids': [Command.create(payment._prepare_invoice_line_vals(sequence=index, with_reference=True))
+                         for index, payment in enumerate(payments, 1)],
+            'payment_ids': [Command.set(payments.ids)],
+        }
+
+    def _invoice_students(self, student_ids):
+        """Bill the period of a batch of students, all invoices in a single create"""
+        self.ensure_one()
+        Payment = self.env['visa.payment']
+        payments = Payment.search(self._get_payment_domain() + [('student_id', 'in', student_ids)],
+                                  order='student_id, payment_date, id')
+        groups = defaultdict(lambda: Payment)
+        for payment in payments:
+            groups[(payment.student_id.id, payment.currency_id.id)] |= payment
+        invoices = self.env['visa.invoice'].create([self._prepare_invoice_vals(group) for group in groups.values()])
+        self.payment_count += len(payments)
+        return invoices
+
+    def _run(self, batch_size=200, max_batches=20):
+        """Bill the period in committed batches of students.
+
+        Billed payments get an invoice, so a run that was interrupted or hit
+        max_batches picks up the remaining students the next time.
+        Returns whether students are left.
+        """
+        self.ensure_one()
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        groups = self.env['visa.payment'].read_group(self._get_payment_domain(), ['student_id'], ['student_id'])
+        student_ids = [g['student_id'][0] for g in groups]
+        for start in range(0, min(len(student_ids), batch_size * max_batches), batch_size):
+            invoices = self._invoice_students(student_ids[start:start + batch_size])
+            _logger.info('Invoicing run %s: %s invoices created', self.id, len(invoices))
+            if auto_commit:
+                self.env.cr.commit()
+        if len(student_ids) > batch_size * max_batches:
+            return True
+        self.state = 'done'
+        return False
+
+    @api.model
+    def _cron_process_runs(self):
+        """Queue the run of the previous month once it is over, then process the queued runs"""
+        period_start = _previous_month_start()
+        if not self.search_count([('period_start', '=', period_start)]):
+            self.create({'period_start': period_start}).state = 'queued'
+        remaining = False
+        for run in self.search([('state', '=', 'queued')], order='period_start'):
+            remaining = run._run() or remaining
+        if remaining:
+            self.env.ref('student__visa__consultancy__management.ir_cron_visa_invoicing_run')._trigger()
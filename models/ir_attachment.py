@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import mimetypes
+import os
+import tempfile
+
+from odoo import models, api
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class IrAttachment(models.Model):
+    _inherit = 'ir.attachment'
+
+    def _visa_store_stream(self, stream):
+        """Copy a file-like object into the filestore chunk by chunk, so large
+        files are never held in memory as a whole. Returns (store_fname,
+        file_size, checksum)."""
+        sha = hashlib.sha1()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._filestore())
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            checksum = sha.hexdigest()
+            fname, full_path = self._get_path(b'', checksum)
+            if os.path.isfile(full_path):
+                os.unlink(tmp_path)
+            else:
+                os.replace(tmp_path, full_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        # the file is garbage collected if the transaction is rolled back
+        self._mark_for_gc(fname)
+        return fname, size, checksum
+
+    def _visa_set_streams(self, streams, res_ids=None):
+        """Point each attachment to the content of the matching stream, and to
+        the matching record of res_ids when given.
+
+        create and write drop store_fname, file_size and checksum, they are
+        only derived from datas there, so they are set in SQL.
+        """
+        if self._storage() != 'file':
+            for index, (attachment, stream) in enumerate(zip(self, streams)):
+                vals = {'raw': stream.read()}
+                if res_ids:
+                    vals['res_id'] = res_ids[index]
+                attachment.write(vals)
+            return self
+        for index, (attachment, stream) in enumerate(zip(self, streams)):
+            fname, size, checksum = self._visa_store_stream(stream)
+            self.env.cr.execute("""
+                UPDATE ir_attachment
+                   SET store_fname = %s, file_size = %s, checksum = %s, db_datas = NULL,
+                       res_id = COALESCE(%s, res_id)
+                 WHERE id = %s
+            """, [fname, size, checksum, res_ids[index] if res_ids else None, attachment.id])
+        self.invalidate_cache(['store_fname', 'file_size', 'checksum', 'db_datas', 'res_id'])
+        return self
+
+    @api.model
+    def _visa_create_streamed(self, vals_list, streams):
+        """Create attachments whose content is streamed from file-like objects"""
+        for vals in vals_list:
+            vals.setdefault('mimetype', mimetypes.guess_type(vals.get('name') or '')[0] or 'application/octet-stream')
+        return self.create(vals_list)._visa_set_streams(streams)
+
+    def _visa_open(self):
+        """Return a binary file object on the attachment content."""
+        self.ensure_one()
+        if self.store_fname:
+            return open(self._full_path(self.store_fname), 'rb')
+        return io.BytesIO(self.raw or b'')
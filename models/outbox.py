@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import threading
+from datetime import timedelta
+
+import requests
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+EVENT_TYPES = [
+    ('application.state', 'Application State Change'),
+    ('payment.settled', 'Payment Settled')
+]
+# Seconds before the first retry, doubled on each consecutive failure of the sink
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+# Status codes by which a receiver asks us to slow down rather than reporting a failure
+THROTTLE_STATUSES = (429, 503)
+
+
+class VisaOutboxSink(models.Model):
+    _name = 'visa.outbox.sink'
+    _description = 'Event Sink'
+    _inherit = ['visa.change.stamp.mixin']
+    _order = 'sequence, id'
+    # the routes read on every enqueue are cached on the sink change stamp
+    _change_stamp_fields = ('active', 'application_events', 'payment_events')
+
+    name = fields.Char(string='Name', required=True)
+    sequence = fields.Integer(string='Sequence', default=10)
+    active = fields.Boolean(string='Active', default=True)
+    sink_type = fields.Selection([
+        ('local', 'Local Receiver'),
+        ('http', 'HTTP')
+    ], string='Type', required=True, default='http')
+    url = fields.Char(string='URL', help='Events are posted as JSON to this address.')
+    token = fields.Char(string='Token', groups='base.group_system',
+                        help='Sent as a bearer token in the Authorization header.')
+    timeout = fields.Integer(string='Timeout (Seconds)', default=10)
+    application_events = fields.Boolean(string='Application State Changes', default=True)
+    payment_events = fields.Boolean(string='Payment Settlements', default=True)
+
+    batch_size = fields.Integer(string='Events per Batch', required=True, default=100)
+    max_batches = fields.Integer(string='Batches per Run', required=True, default=10,
+                                 help='The dispatcher moves on to the other sinks after this many batches.')
+    max_attempts = fields.Integer(string='Max Attempts', required=True, default=8,
+                                  help='Events failing this many times are set aside so the next ones can go.')
+
+    # Delivery state, written by the dispatcher
+    failure_count = fields.Integer(string='Consecutive Failures', readonly=True)
+    paused_until = fields.Datetime(string='Paused Until', readonly=True)
+    last_error = fields.Text(string='Last Error', readonly=True)
+    last_delivery = fields.Datetime(string='Last Delivery', readonly=True)
+    pending_count = fields.Integer(string='Pending Events', compute='_compute_event_counts')
+    failed_count = fields.Integer(string='Failed Events', compute='_compute_event_counts')
+
+    @api.constrains('sink_type', 'url')
+    def _check_url(self):
+        for rec in self:
+            if rec.sink_type == 'http' and not rec.url:
+                raise ValidationError(_('An HTTP sink needs a URL!'))
+
+    def _compute_event_counts(self):
+        counts = {
+            (group['sink_id'][0], group['state']): group['__count']
+            for group in self.env['visa.outbox.event'].read_group(
+                [('sink_id', 'in', self.ids), ('state', 'in', ('pending', 'failed'))],
+                ['sink_id', 'state'], ['sink_id', 'state'], lazy=False)
+        }
+        for rec in self:
+            rec.pending_count = counts.get((rec.id, 'pending'), 0)
+            rec.failed_count = counts.get((rec.id, 'failed'), 0)
+
+    @api.model
+    def _get_routes(self):
+        """{event type: sink ids}, read on every enqueue so cached until the sinks change"""
+        return self._get_routes_for_stamp(self.env['visa.portal.counter']._get_stamps()[self._name])
+
+    @api.model
+    @tools.ormcache('stamp')
+    def _get_routes_for_stamp(self, stamp):
+        sinks = self.sudo().search([])
+        return {
+            'application.state': tuple(sinks.filtered('application_events').ids),
+            'payment.settled': tuple(sinks.filtered('payment_events').ids),
+        }
+
+    def action_resume(self):
+        self.write({'paused_until': False, 'failure_count': 0})
+        self.env.ref('student__visa__consultancy__management.ir_cron_visa_outbox_dispatch')._trigger()
+
+    def action_view_events(self):
+        self.ensure_one()
+        return {
+            'name': _('Outbox Events'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'visa.outbox.event',
+            'view_mode': 'tree,form',
+            'domain': [('sink_id', '=', self.id)],
+        }
+
+    # ------------------------------------------------------------------
+    # Delivery
+    # ------------------------------------------------------------------
+
+    def _send(self, events):
+        """Deliver one batch, return (ok, retry after in seconds or None, error)"""
+        self.ensure_one()
+        payload = [event._get_message() for event in events]
+        if self.sink_type == 'local':
+            self.env['visa.outbox.receipt'].sudo()._receive(self.name, payload)
+            return True, None, None
+        headers = {}
+        if self.sudo().token:
+            headers['Authorization'] = 'Bearer %s' % self.sudo().token
+        try:
+            response = requests.post(self.url, json={'events': payload}, headers=headers, timeout=self.timeout or 10)
+        except requests.RequestException as e:
+            return False, None, str(e)
+        if response.ok:
+            return True, None, None
+        retry_after = None
+        if response.status_code in THROTTLE_STATUSES:
+            retry_after = response.headers.get('Retry-After', '')
+            retry_after = int(retry_after) if retry_after.isdigit() else RETRY_DELAY
+        return False, retry_after, '%s %s' % (response.status_code, response.text[:500])
+
+    def _dispatch(self):
+        """Deliver the pending events of the sink in id order, batch by batch.
+
+        The sink row is locked around each batch so two dispatchers never
+        deliver the same sink out of order. A failed batch pauses the sink with
+        an exponential backoff and stays at the head of the queue; a throttled
+        batch only pauses it for the time asked by the receiver. Returns True
+        when events are left for a next run.
+        """
+        self.ensure_one()
+        Event = self.env['visa.outbox.event']
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for _iteration in range(self.max_batches):
+            # taken again after each commit, which releases it
+            self.env.cr.execute("SELECT id FROM visa_outbox_sink WHERE id = %s FOR UPDATE SKIP LOCKED", [self.id])
+            if not self.env.cr.fetchone():
+                return False
+            self.env.cr.execute("""
+                SELECT id FROM visa_outbox_event WHERE sink_id = %s AND state = 'pending' ORDER BY id LIMIT %s
+            """, [self.id, self.batch_size])
+            events = Event.browse([row[0] for row in self.env.cr.fetchall()])
+            if not events:
+                return False
+            ok, retry_after, error = self._send(events)
+            now = fields.Datetime.now()
+            if ok:
+                events.write({'state': 'done', 'date_done': now})
+                self.write({'failure_count': 0, 'last_error': False, 'last_delivery': now})
+            elif retry_after is not None:
+                self.write({'paused_until': now + timedelta(seconds=retry_after), 'last_error': error})
+            else:
+                events._record_failure(error, self.max_attempts)
+                delay = min(RETRY_DELAY * 2 ** self.failure_count, MAX_RETRY_DELAY)
+                self.write({
+                    'failure_count': self.failure_count + 1,
+                    'paused_until': now + timedelta(seconds=delay),
+                    'last_error': error,
+                })
+                _logger.warning('Delivery to sink %s failed, retrying in %ss: %s', self.name, delay, error)
+            if auto_commit:
+                self.env.cr.commit()
+            if not ok:
+                return False
+        return True
+
+
+class VisaOutboxEvent(models.Model):
+    _name = 'visa.outbox.event'
+    _description = 'Outbox Event'
+    _order = 'id desc'
+    _log_access = False
+
+    sink_id = fields.Many2one('visa.outbox.sink', string='Sink', required=True, readonly=True, ondelete='cascade')
+    event_type = fields.Selection(EVENT_TYPES, string='Event', required=True, readonly=True)
+    dedupe_key = fields.Char(string='Dedupe Key', required=True, readonly=True,
+                             help='Identifies the event, receivers use it to ignore redelivered events.')
+    res_model = fields.Char(string='Model', readonly=True)
+    res_id = fields.Integer(string='Record ID', readonly=True)
+    payload = fields.Text(string='Payload', readonly=True)
+    date = fields.Datetime(string='Date', required=True, readonly=True, default=fields.Datetime.now)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Delivered'),
+        ('failed', 'Failed')
+    ], string='Status', required=True, default='pending', readonly=True)
+    attempts = fields.Integer(string='Attempts', readonly=True)
+    date_done = fields.Datetime(string='Delivered On', readonly=True, index=True)
+    error = fields.Text(string='Last Error', readonly=True)
+
+    _sql_constraints = [
+        ('dedupe_key_unique', 'unique(sink_id, dedupe_key)', 'This event was already queued for the sink!')
+    ]
+
+    def init(self):
+        # the dispatcher reads the pending events of one sink in id order
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_outbox_event_pending_idx
+            ON visa_outbox_event (sink_id, id) WHERE state = 'pending'
+        """)
+
+    @api.model
+    def _enqueue(self, event_type, events):
+        """Queue events for every sink subscribed to the type, in the current transaction.
+
+        events is a list of (dedupe key, record, payload dict). An event whose
+        key is already queued for a sink is not queued again.
+        """
+        sink_ids = self.env['visa.outbox.sink']._get_routes()[event_type]
+        if not sink_ids or not events:
+            return
+        now = fields.Datetime.now()
+        rows = [
+            (sink_id, event_type, dedupe_key, record._name, record.id, json.dumps(payload, default=str), now)
+            for dedupe_key, record, payload in events for sink_id in sink_ids
+        ]
+        self.env.cr.execute("""
+            INSERT INTO visa_outbox_event (sink_id, event_type, dedupe_key, res_model, res_id, payload, date, state,
+                                           attempts)
+            SELECT *, 'pending', 0
+              FROM unnest(%s::int[], %s::varchar[], %s::varchar[], %s::varchar[], %s::int[], %s::text[],
+                          %s::timestamp[])
+            ON CONFLICT (sink_id, dedupe_key) DO NOTHING
+        """, [list(column) for column in zip(*rows)])
+
+    @api.model
+    def _enqueue_transitions(self, transitions):
+        self._enqueue('application.state', [(
+            'visa.application.transition:%s' % transition.id,
+            transition.application_id,
+            {
+                'application_id': transition.application_id.id,
+                'application': transition.application_id.name,
+                'student_id': transition.application_id.student_id.id,
+                'university_id': transition.university_id.id,
+                'from_state': transition.from_state or None,
+                'to_state': transition.to_state,
+                'date': transition.date,
+            },
+        ) for transition in transitions])
+
+    @api.model
+    def _enqueue_settlements(self, payments):
+        self._enqueue('payment.settled', [(
+            'visa.payment:%s:paid' % payment.id,
+            payment,
+            {
+                'payment_id': payment.id,
+                'payment': payment.name,
+                'student_id': payment.student_id.id,
+                'application_id': payment.application_id.id or None,
+                'amount': payment.amount,
+                'currency': payment.currency_id.name,
+            },
+        ) for payment in payments])
+
+    def _get_message(self):
+        return {
+            'id': self.dedupe_key,
+            'type': self.event_type,
+            'date': fields.Datetime.to_string(self.date),
+            'data': json.loads(self.payload or '{}'),
+        }
+
+    def _record_failure(self, error, max_attempts):
+        for rec in self:
+            rec.write({
+                'attempts': rec.attempts + 1,
+                'error': error,
+                'state': 'failed' if rec.attempts + 1 >= max_attempts else 'pending',
+            })
+
+    def action_retry(self):
+        self.filtered(lambda e: e.state == 'failed').write({'state': 'pending', 'attempts': 0, 'error': False})
+        self.env.ref('student__visa__consultancy__management.ir_cron_visa_outbox_dispatch')._trigger()
+
+    @api.model
+    def _cron_dispatch(self, keep_days=7):
+        """Deliver the outbox to the sinks that are not paused, drop old delivered events"""
+        self.env.cr.execute("""
+            DELETE FROM visa_outbox_event WHERE state = 'done' AND date_done < %s
+        """, [fields.Datetime.now() - timedelta(days=keep_days)])
+        now = fields.Datetime.now()
+        sinks = self.env['visa.outbox.sink'].search(['|', ('paused_until', '=', False), ('paused_until', '<=', now)])
+        backlog = False
+        for sink in sinks:
+            backlog |= sink._dispatch()
+        if backlog:
+            self.env.ref('student__visa__consultancy__management.ir_cron_visa_outbox_dispatch')._trigger()
+
+
+class VisaOutboxReceipt(models.Model):
+    _name = 'visa.outbox.receipt'
+    _description = 'Received Event'
+    _order = 'id desc'
+    _log_access = False
+
+    dedupe_key = fields.Char(string='Event', required=True, readonly=True)
+    event_type = fields.Char(string='Type', readonly=True)
+    source = fields.Char(string='Source', readonly=True)
+    payload = fields.Text(string='Payload', readonly=True)
+    received_at = fields.Datetime(string='Received', readonly=True, default=fields.Datetime.now)
+
+    _sql_constraints = [
+        ('dedupe_key_unique', 'unique(dedupe_key)', 'This event was already received!')
+    ]
+
+    @api.model
+    def _receive(self, source, messages):
+        """Stub receiver: store the messages not received yet, return how many were new"""
+        rows = [(message['id'], str(message.get('type') or ''), source, json.dumps(message.get('data')),
+                 fields.Datetime.now())
+                for message in messages if isinstance(message.get('id'), str) and message['id']]
+        if not rows:
+            return 0
+        self.env.cr.execute("""
+            INSERT INTO visa_outbox_receipt (dedupe_key, event_type, source, payload, received_at)
+            SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[], %s::text[], %s::timestamp[])
+            ON CONFLICT (dedupe_key) DO NOTHING
+            RETURNING id
+        """, [list(column) for column in zip(*rows)])
+        return len(self.env.cr.fetchall())
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from odoo import models, fields, api, Command, _
 from odoo.exceptions import UserError
 
 
 class VisaPayment(models.Model):
     _name = 'visa.payment'
     _description = 'Payment Management'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'visa.change.stamp.mixin']
     _rec_name = 'name'
     _order = 'payment_date desc'
 
@@ -38,7 +42,7 @@ class VisaPayment(models.Model):
 
     # Dates
     payment_date = fields.Date(string='Payment Date', default=fields.Date.today, required=True)
-    due_date = fields.Date(string='Due Date')
+    due_date = fields.Date(string='Due Date', index=True)
 
     # Status
     state = fields.Selection([
@@ -46,7 +50,7 @@ class VisaPayment(models.Model):
         ('pending', 'Pending'),
         ('paid', 'Paid'),
         ('cancelled', 'Cancelled')
-    ], string='Status', default='draft', tracking=True)
+    ], string='Status', default='draft', tracking=True, index=True)
 
     # Bank Details (for bank transfer)
     bank_name = fields.Char(string='Bank Name')
@@ -57,13 +61,54 @@ class VisaPayment(models.Model):
     invoice_id = fields.Many2one('visa.invoice', string='Invoice', readonly=True)
     invoice_count = fields.Integer(string='Invoices', compute='_compute_invoice_count')
 
+    # Dunning
+    dunning_level = fields.Integer(string='Reminder Level', default=0, copy=False, readonly=True)
+    last_dunning_date = fields.Date(string='Last Reminder', copy=False, readonly=True)
+
+    # Payment Plan
+    payment_plan_id = fields.Many2one('visa.payment.plan', string='Payment Plan', readonly=True, index=True)
+    installment_number = fields.Integer(string='Installment', readonly=True)
+
     notes = fields.Text(string='Notes')
+    active = fields.Boolean(string='Active', default=True)
+
+    def init(self):
+        # Partial index serving the overdue / dunning queries
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_payment_overdue_idx
+            ON visa_payment (due_date, dunning_level) WHERE state = 'pending'
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_payment_active_state_idx
+            ON visa_payment (state, create_date DESC) WHERE active
+        """)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        to_name = [vals for vals in vals_list if vals.get('name', 'New') == 'New']
+        for vals, name in zip(to_name, self._reserve_names(len(to_name))):
+            vals['name'] = name
+        return super(VisaPayment, self).create(vals_list)
 
     @api.model
-    def create(self, vals):
-        if vals.get('name', 'New') == 'New':
-            vals['name'] = self.env['ir.sequence'].next_by_code('visa.payment') or 'New'
-        return super(VisaPayment, self).create(vals)
+    def _reserve_names(self, count):
+        """Reserve count PAY- references at once.
+
+        A standard sequence hands out the whole block with a single nextval over
+        generate_series; no-gap and date-range sequences fall back to one number
+        at a time.
+        """
+        if not count:
+            return []
+        sequence = self.env['ir.sequence'].sudo().search([
+            ('code', '=', 'visa.payment'), ('company_id', 'in', [self.env.company.id, False])
+        ], order='company_id', limit=1)
+        if not sequence:
+            return ['New'] * count
+        if sequence.implementation != 'standard' or sequence.use_date_range:
+            return [sequence._next() for _index in range(count)]
+        self.env.cr.execute("SELECT nextval(%s) FROM generate_series(1, %s)", ['ir_sequence_%03d' % sequence.id, count])
+        return [sequence.get_next_char(row[0]) for row in self.env.cr.fetchall()]
 
     @api.depends('invoice_id')
     def _compute_invoice_count(self):
@@ -71,18 +116,34 @@ class VisaPayment(models.Model):
             rec.invoice_count = 1 if rec.invoice_id else 0
 
     def action_confirm(self):
-        """Confirm payment and generate invoice"""
+        """Confirm payment and generate invoice, students on consolidated invoicing are
+        billed by the monthly invoicing run instead"""
         for payment in self:
-            if not payment.invoice_id:
+            if not payment.invoice_id and not payment.student_id.consolidated_invoicing:
                 payment._generate_invoice()
             payment.state = 'pending'
 
     def action_paid(self):
         """Mark payment as paid"""
-        self.state = 'paid'
-        # Mark invoice as paid
-        if self.invoice_id:
-            self.invoice_id.action_mark_paid()
+        self._settle()
+
+    def _settle(self):
+        """Mark the payments and their invoices as paid in a single set-wise pass.
+
+        This is the only place settling payments, invoices call it for their
+        payments instead of calling back and forth with action_paid.
+        """
+        payments = self.filtered(lambda p: p.state != 'paid')
+        if not payments:
+            return payments
+        payments.write({'state': 'paid'})
+        invoices = payments.invoice_id | self.env['visa.invoice'].search([('payment_id', 'in', payments.ids)])
+        # a consolidated invoice is paid once all of its payments are
+        invoices.filtered(
+            lambda i: i.state != 'paid' and all(p.state == 'paid' for p in i.payment_ids)
+        ).write({'state': 'paid'})
+        self.env['visa.outbox.event']._enqueue_settlements(payments)
+        return payments
 
     def action_cancel(self):
         self.state = 'cancelled'
@@ -93,40 +154,36 @@ class VisaPayment(models.Model):
     def _generate_invoice(self):
         """Automatically generate invoice for this payment"""
         self.ensure_one()
-
-        # Get payment type description
-        payment_type_dict = dict(self._fields['payment_type'].selection)
-        description = payment_type_dict.get(self.payment_type, 'Service')
-
-        # Create invoice
-        invoice_vals = {
+        invoice = self.env['visa.invoice'].create({
             'student_id': self.student_id.id,
             'application_id': self.application_id.id if self.application_id else False,
             'payment_id': self.id,
             'invoice_date': self.payment_date,
             'due_date': self.due_date,
+            'currency_id': self.currency_id.id,
             'state': 'draft',
             'notes': 'Payment for: ' + self.name,
-        }
-
-        invoice = self.env['visa.invoice'].create(invoice_vals)
+            # line and payment link in the same create, amounts are computed once
+            'line_ids': [Command.create(self._prepare_invoice_line_vals())],
+            'payment_ids': [Command.link(self.id)],
+        })
+        return invoice
 
-        # Create invoice line
-        line_vals = {
-            'invoice_id': invoice.id,
+    def _prepare_invoice_line_vals(self, sequence=10, with_reference=False):
+        """Values of the invoice line billing this payment"""
+        self.ensure_one()
+        payment_type_dict = dict(self._fields['payment_type'].selection)
+        description = payment_type_dict.get(self.payment_type, 'Service')
+        if with_reference:
+            description = '%s (%s)' % (description, self.name)
+        return {
+            'sequence': sequence,
             'description': description,
             'quantity': 1,
             'unit_price': self.amount,
             'tax_percentage': 0.0,  # You can add tax calculation if needed
         }
 
-        self.env['visa.invoice.line'].create(line_vals)
-
-        # Link invoice to payment
-        self.invoice_id = invoice.id
-
-        return invoice
-
     def action_view_invoice(self):
         """Open the related invoice"""
         self.ensure_one()
@@ -154,4 +211,107 @@ class VisaPayment(models.Model):
                 'type': 'success',
                 'sticky': False,
             }
-        }
\ No newline at end of file
+        }
+
+    @api.model
+    def _get_dunning_thresholds(self):
+        """Days overdue after which each reminder level is sent, e.g. "0,15,30" """
+        param = self.env['ir.config_parameter'].sudo().get_param('visa.dunning_level_days', '0,15,30')
+        return sorted(int(days) for days in param.split(',') if days.strip())
+
+    @api.model
+    def _get_dunning_domain(self, thresholds, today):
+        """Pending payments overdue past the threshold of their next reminder level"""
+        level_domains = [
+            ['&', ('dunning_level', '=', level), ('due_date', '<', today - timedelta(days=days))]
+            for level, days in enumerate(thresholds)
+        ]
+        domain = ['|'] * (len(level_domains) - 1)
+        for level_domain in level_domains:
+            domain += level_domain
+        return [('state', '=', 'pending')] + domain
+
+    @api.model
+    def _cron_send_dunning(self, batch_size=500):
+        """Send overdue payment reminders, grouped per student and escalated per level.
+
+        Students are handled in small committed batches, with all their due
+        payments, so the table is never locked for long and every student gets
+        a single reminder per run. Runs stop after the batch that reaches
+        visa.dunning_max_payments payments.
+        """
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        max_payments = int(get_param('visa.dunning_max_payments', 5000))
+        thresholds = self._get_dunning_thresholds()
+        if not thresholds:
+            return
+        today = fields.Date.today()
+        domain = self._get_dunning_domain(thresholds, today)
+        template = self.env.ref('student__visa__consultancy__management.mail_template_visa_payment_reminder')
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+
+        processed = 0
+        while processed < max_payments:
+            student_ids = self._get_dunning_students(domain, batch_size)
+            if not student_ids:
+                break
+            payments = self.search(domain + [('student_id', 'in', student_ids)], order='due_date, id')
+            processed += len(payments)
+            self._queue_dunning_mails(payments, thresholds, today, template)
+            if auto_commit:
+                self.env.cr.commit()
+
+    @api.model
+    def _get_dunning_students(self, domain, limit):
+        """Ids of the students with payments matching domain, longest overdue first"""
+        query = self._where_calc(domain)
+        self._apply_ir_rules(query, 'read')
+        from_clause, where_clause, params = query.get_sql()
+        self.env.cr.execute(f"""
+            SELECT "visa_payment".student_id
+              FROM {from_clause}
+             WHERE {where_clause or 'TRUE'} AND "visa_payment".student_id IS NOT NULL
+          GROUP BY "visa_payment".student_id
+          ORDER BY MIN("visa_payment".due_date), "visa_payment".student_id
+             LIMIT %s
+        """, params + [limit])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _queue_dunning_mails(self, payments, thresholds, today, template):
+        """Escalate the payments and queue one reminder per student"""
+        payments_by_level = defaultdict(lambda: self.browse())
+        student_level = defaultdict(int)
+        for payment in payments:
+            overdue_days = (today - payment.due_date).days
+            level = sum(1 for days in thresholds if overdue_days > days)
+            payments_by_level[level] |= payment
+            student_level[payment.student_id] = max(student_level[payment.student_id], level)
+
+        students_by_level = defaultdict(lambda: self.env['visa.student'])
+        for student, level in student_level.items():
+            if student.email:
+                students_by_level[level] |= student
+
+        mail_values = []
+        for level, students in students_by_level.items():
+            # render the whole group at once, the template is compiled a single time
+            render_context = {'dunning_level': level}
+            subjects = template._render_field('subject', students.ids, add_context=render_context)
+            bodies = template._render_field('body_html', students.ids, add_context=render_context)
+            senders = template._render_field('email_from', students.ids, add_context=render_context)
+            for student in students:
+                mail_values.append({
+                    'subject': subjects[student.id],
+                    'body_html': bodies[student.id],
+                    'email_from': senders[student.id] or self.env.company.email,
+                    'email_to': student.email,
+                    'model': 'visa.student',
+                    'res_id': student.id,
+                    'auto_delete': True,
+                })
+        if mail_values:
+            self.env['mail.mail'].sudo().create(mail_values)
+
+        for level, level_payments in payments_by_level.items():
+            level_payments.write({'dunning_level': level, 'last_dunning_date': today})
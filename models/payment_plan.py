@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import float_compare
+
+
+class VisaPaymentPlan(models.Model):
+    _name = 'visa.payment.plan'
+    _description = 'Payment Plan Template'
+    _order = 'name'
+
+    name = fields.Char(string='Name', required=True)
+    active = fields.Boolean(string='Active', default=True)
+    line_ids = fields.One2many('visa.payment.plan.line', 'plan_id', string='Installments', copy=True)
+    installment_count = fields.Integer(string='Installments', compute='_compute_installment_count')
+    notes = fields.Text(string='Notes')
+
+    @api.depends('line_ids')
+    def _compute_installment_count(self):
+        for plan in self:
+            plan.installment_count = len(plan.line_ids)
+
+    @api.constrains('line_ids')
+    def _check_percentages(self):
+        for plan in self:
+            if float_compare(sum(plan.line_ids.mapped('percentage')), 100.0, precision_digits=2):
+                raise ValidationError(_('The installments of %s must add up to 100%%.') % plan.name)
+
+    def _prepare_installment_vals(self, application, start_date, payment_method):
+        """Payment values of every installment of the plan for an application.
+
+        Amounts are rounded in the application currency, the last installment
+        takes the rounding difference so the plan adds up to the total fee.
+        """
+        self.ensure_one()
+        currency = application.currency_id or self.env.company.currency_id
+        vals_list, planned = [], 0.0
+        lines = self.line_ids.sorted('sequence')
+        for number, line in enumerate(lines, 1):
+            if number == len(lines):
+                amount = currency.round(application.total_fee - planned)
+            else:
+                amount = currency.round(application.total_fee * line.percentage / 100.0)
+            planned += amount
+            due_date = start_date + relativedelta(months=line.months_after)
+            vals_list.append({
+                'student_id': application.student_id.id,
+                'application_id': application.id,
+                'payment_type': line.payment_type,
+                'payment_method': payment_method,
+                'amount': amount,
+                'currency_id': currency.id,
+                'payment_date': due_date,
+                'due_date': due_date,
+                'state': 'pending',
+                'payment_plan_id': self.id,
+                'installment_number': number,
+                'notes': line.name or _('Installment %s of %s') % (number, len(lines)),
+            })
+        return vals_list
+
+    def _generate_installments(self, applications, start_date, payment_method):
+        """Create the installments of the plan for all the applications in one create"""
+        self.ensure_one()
+        if not self.line_ids:
+            raise UserError(_('The payment plan %s has no installment.') % self.name)
+        planned = self.env['visa.payment'].search([('application_id', 'in', applications.ids),
+                                                   ('payment_plan_id', '!=', False)]).application_id
+        if planned:
+            raise UserError(_('These applications already have a payment plan: %s') %
+                            ', '.join(planned.mapped('name')))
+        applications = applications.filtered(lambda a: a.total_fee > 0)
+        vals_list = [vals for application in applications
+                     for vals in self._prepare_installment_vals(application, start_date, payment_method)]
+        payments = self.env['visa.payment'].create(vals_list)
+        applications.write({'payment_plan_id': self.id})
+        return payments
+
+
+class VisaPaymentPlanLine(models.Model):
+    _name = 'visa.payment.plan.line'
+    _description = 'Payment Plan Installment'
+    _order = 'plan_id, sequence, id'
+
+    plan_id = fields.Many2one('visa.payment.plan', string='Plan', required=True, ondelete='cascade')
+    sequence = fields.Integer(string='Sequence', default=10)
+    name = fields.Char(string='Label')
+    percentage = fields.Float(string='Share (%)', required=True, digits=(5, 2))
+    months_after = fields.Integer(string='Due After (Months)', default=0,
+                                  help='Months between the start of the plan and the due date.')
+    payment_type = fields.Selection(selection=lambda self: self.env['visa.payment']._fields['payment_type'].selection,
+                                    string='Payment Type', required=True, default='service_fee')
+
+    _sql_constraints = [
+        ('percentage_positive', 'CHECK(percentage > 0)', 'The share of an installment must be positive!')
+    ]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+
+from odoo import models, api
+from odoo.tools.lru import LRU
+
+_logger = logging.getLogger(__name__)
+
+# Rendered rows, kept apart from the ormcache so that large fragments do not
+# push the registry's method results out of its LRU
+FRAGMENT_CACHE_SIZE = 4096
+_fragment_cache = LRU(FRAGMENT_CACHE_SIZE)
+
+# Row templates: the record variable, and the children whose changes show in the row
+FRAGMENT_TEMPLATES = {
+    'student__visa__consultancy__management.portal_student_card': {
+        'var': 'student',
+        'children': [('visa.application', 'student_id'), ('visa.document', 'student_id'),
+                     ('visa.payment', 'student_id')],
+        'related': [],
+    },
+    'student__visa__consultancy__management.portal_application_row': {
+        'var': 'app',
+        'children': [],
+        'related': ['student_id', 'university_id', 'course_id'],
+    },
+    'student__visa__consultancy__management.portal_document_row': {
+        'var': 'doc',
+        'children': [],
+        'related': [],
+    },
+}
+
+
+class VisaPortalFragment(models.AbstractModel):
+    _name = 'visa.portal.fragment'
+    _description = 'Portal Row Fragment Cache'
+
+    @api.model
+    def _get_stamps(self, template, records):
+        """Version of each row: write date of the record and of the related records it shows,
+        plus count and last write date of the children it counts.
+
+        One grouped query per child model for the whole page.
+        """
+        definition = FRAGMENT_TEMPLATES[template]
+        stamps = {}
+        for record in records:
+            stamps[record.id] = [record.write_date] + [record[name].write_date for name in definition['related']]
+        for model_name, inverse_name in definition['children']:
+            groups = self.env[model_name].with_context(active_test=False).read_group(
+                [(inverse_name, 'in', records.ids)], [inverse_name, 'write_date:max'], [inverse_name], lazy=False)
+            children = {g[inverse_name][0]: (g['__count'], g['write_date']) for g in groups}
+            for record in records:
+                stamps[record.id].append(children.get(record.id, (0, False)))
+        return {record_id: tuple(stamp) for record_id, stamp in stamps.items()}
+
+    @api.model
+    def _render_fragment(self, template, record, stamp):
+        # amounts are shown in the company currency and dates in the user's timezone
+        key = (self.env.cr.dbname, template, record.id, stamp, self.env.lang, self.env.company.id,
+               self.env.context.get('tz') or self.env.user.tz)
+        try:
+            return _fragment_cache[key]
+        except KeyError:
+            pass
+        fragment = self.env['ir.qweb']._render(template, {FRAGMENT_TEMPLATES[template]['var']: record})
+        _fragment_cache[key] = fragment
+        return fragment
+
+    @api.model
+    def _clear_fragments(self):
+        _fragment_cache.clear()
+
+    @api.model
+    def _render_fragments(self, template, records):
+        """Rendered row of each record, by id.
+
+        Rows are cached by id and stamp, per language, company and timezone: a
+        list page only renders the rows whose record or counted children changed
+        since the last time. The records are rendered as a batch, so the rows to
+        render share their prefetching.
+        """
+        stamps = self._get_stamps(template, records)
+        return {record.id: self._render_fragment(template, record, stamps[record.id]) for record in records}
+
+    @api.model
+    def _benchmark(self, template, records, page_size=20, rounds=5):
+        """Render time of each portal page of records, before and after the fragment cache.
+
+        For every page of page_size records: 'before' renders the rows one by one
+        as the templates used to, 'cold' fills an empty fragment cache and 'warm'
+        reads it back. Every round starts with an empty record cache, as a new
+        request would. Times are averages in milliseconds, see
+        scripts/benchmark_portal_fragments.py to run it from a shell.
+        """
+        QWeb = self.env['ir.qweb']
+        var = FRAGMENT_TEMPLATES[template]['var']
+
+        def measure(render, page, clear=False):
+            durations = []
+            for _round in range(rounds):
+                if clear:
+                    self._clear_fragments()
+                self.env.invalidate_all()
+                started = time.perf_counter()
+                render(page)
+                durations.append(time.perf_counter() - started)
+            return 1000.0 * sum(durations) / len(durations)
+
+        def render_before(page):
+            for record in page:
+                QWeb._render(template, {var: record})
+
+        results = []
+        for number, start in enumerate(range(0, len(records), page_size), 1):
+            page = records[start:start + page_size]
+            before = measure(render_before, page)
+            cold = measure(lambda p: self._render_fragments(template, p), page, clear=True)
+            warm = measure(lambda p: self._render_fragments(template, p), page)
+            results.append({'page': number, 'rows': len(page), 'before': before, 'cold': cold, 'warm': warm})
+            _logger.info('Page %s of %s (%s rows): %.1f ms before, %.1f ms cold cache, %.1f ms warm cache',
+                         number, template, len(page), before, cold, warm)
+        return results
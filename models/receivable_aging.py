@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools
+
+AGING_BUCKETS = [
+    ('current', 'Current'),
+    ('1_30', '1-30 Days'),
+    ('31_60', '31-60 Days'),
+    ('61_90', '61-90 Days'),
+    ('90_plus', '90+ Days')
+]
+
+
+class VisaReceivableAging(models.Model):
+    _name = 'visa.receivable.aging'
+    _description = 'Aged Receivables'
+    _auto = False
+    _order = 'days_overdue desc, id'
+
+    document_type = fields.Selection([
+        ('invoice', 'Invoice'),
+        ('payment', 'Payment')
+    ], string='Document', readonly=True)
+    res_id = fields.Integer(string='Document ID', readonly=True)
+    reference = fields.Char(string='Reference', readonly=True)
+    student_id = fields.Many2one('visa.student', string='Student', readonly=True)
+    consultant_id = fields.Many2one('visa.consultant', string='Consultant', readonly=True)
+    currency_id = fields.Many2one('res.currency', string='Currency', readonly=True)
+    due_date = fields.Date(string='Due Date', readonly=True)
+    days_overdue = fields.Integer(string='Days Overdue', group_operator='max', readonly=True)
+    bucket = fields.Selection(AGING_BUCKETS, string='Age', readonly=True)
+    amount = fields.Monetary(string='Open Amount', currency_field='currency_id', readonly=True)
+    amount_current = fields.Monetary(string='Current', currency_field='currency_id', readonly=True)
+    amount_1_30 = fields.Monetary(string='1-30', currency_field='currency_id', readonly=True)
+    amount_31_60 = fields.Monetary(string='31-60', currency_field='currency_id', readonly=True)
+    amount_61_90 = fields.Monetary(string='61-90', currency_field='currency_id', readonly=True)
+    amount_90_plus = fields.Monetary(string='90+', currency_field='currency_id', readonly=True)
+    student_balance = fields.Monetary(string='Student Balance', currency_field='currency_id',
+                                      group_operator='max', readonly=True)
+    student_oldest_days = fields.Integer(string='Student Oldest Item (Days)', group_operator='max', readonly=True)
+
+    def init(self):
+        """Open items aged in one pass.
+
+        Open invoices count for their amount not settled by paid payments yet,
+        pending payments count only while they are not billed by an invoice, so
+        nothing is counted twice. The student balance and oldest item come from
+        window functions over the same rows.
+        """
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE OR REPLACE VIEW visa_receivable_aging AS (
+                WITH items AS (
+                    SELECT 'invoice' AS document_type, i.id AS res_id, i.name AS reference, i.student_id,
+                           i.currency_id, COALESCE(i.due_date, i.invoice_date) AS due_date,
+                           i.total_amount - COALESCE(paid.amount, 0) AS amount
+                      FROM visa_invoice i
+                 LEFT JOIN LATERAL (
+                        SELECT SUM(p.amount) AS amount
+                          FROM visa_payment p
+                         WHERE p.invoice_id = i.id AND p.state = 'paid'
+                    ) paid ON TRUE
+                     WHERE i.state IN ('draft', 'sent') AND i.active
+                 UNION ALL
+                    SELECT 'payment', p.id, p.name, p.student_id, p.currency_id,
+                           COALESCE(p.due_date, p.payment_date), p.amount
+                      FROM visa_payment p
+                     WHERE p.state = 'pending' AND p.invoice_id IS NULL AND p.active
+                ), aged AS (
+                    SELECT items.*, s.consultant_id,
+                           GREATEST(CURRENT_DATE - items.due_date, 0) AS days_overdue
+                      FROM items
+                      JOIN visa_student s ON s.id = items.student_id
+                     WHERE items.amount > 0
+                )
+                SELECT CASE WHEN document_type = 'invoice' THEN res_id * 2 ELSE res_id * 2 + 1 END AS id,
+                       document_type, res_id, reference, student_id, consultant_id, currency_id, due_date,
+                       days_overdue,
+                       CASE WHEN days_overdue = 0 THEN 'current'
+                            WHEN days_overdue <= 30 THEN '1_30'
+                            WHEN days_overdue <= 60 THEN '31_60'
+                            WHEN days_overdue <= 90 THEN '61_90'
+                            ELSE '90_plus'
+                       END AS bucket,
+                       amount,
+                       CASE WHEN days_overdue = 0 THEN amount ELSE 0 END AS amount_current,
+                       CASE WHEN days_overdue BETWEEN 1 AND 30 THEN amount ELSE 0 END AS amount_1_30,
+                       CASE WHEN days_overdue BETWEEN 31 AND 60 THEN amount ELSE 0 END AS amount_31_60,
+                       CASE WHEN days_overdue BETWEEN 61 AND 90 THEN amount ELSE 0 END AS amount_61_90,
+                       CASE WHEN days_overdue > 90 THEN amount ELSE 0 END AS amount_90_plus,
+                       SUM(amount) OVER (PARTITION BY student_id, currency_id) AS student_balance,
+                       MAX(days_overdue) OVER (PARTITION BY student_id) AS student_oldest_days
+                  FROM aged
+            )
+        """)
+
+
+class VisaReceivableAgingSnapshot(models.Model):
+    _name = 'visa.receivable.aging.snapshot'
+    _description = 'Aged Receivables Snapshot'
+    _order = 'date desc, id'
+    _log_access = False
+
+    date = fields.Date(string='Date', required=True, readonly=True, index=True)
+    student_id = fields.Many2one('visa.student', string='Student', readonly=True, ondelete='cascade')
+    consultant_id = fields.Many2one('visa.consultant', string='Consultant', readonly=True)
+    currency_id = fields.Many2one('res.currency', string='Currency', readonly=True)
+    amount_current = fields.Monetary(string='Current', currency_field='currency_id', readonly=True)
+    amount_1_30 = fields.Monetary(string='1-30', currency_field='currency_id', readonly=True)
+    amount_31_60 = fields.Monetary(string='31-60', currency_field='currency_id', readonly=True)
+    amount_61_90 = fields.Monetary(string='61-90', currency_field='currency_id', readonly=True)
+    amount_90_plus = fields.Monetary(string='90+', currency_field='currency_id', readonly=True)
+    amount_total = fields.Monetary(string='Total', currency_field='currency_id', readonly=True)
+
+    @api.model
+    def _cron_take_snapshot(self):
+        """Store today's aging per student, consultant and currency.
+
+        The trend views read these few pre-aggregated rows per day instead of
+        aging every open item again. Taking the snapshot twice a day replaces it.
+        """
+        # the aging view reads invoices and payments
+        self.env['visa.invoice'].flush()
+        self.env['visa.payment'].flush()
+        self.env.cr.execute("DELETE FROM visa_receivable_aging_snapshot WHERE date = CURRENT_DATE")
+        self.env.cr.execute("""
+            INSERT INTO visa_receivable_aging_snapshot
+                   (date, student_id, consultant_id, currency_id, amount_current, amount_1_30, amount_31_60,
+                    amount_61_90, amount_90_plus, amount_total)
+            SELECT CURRENT_DATE, student_id, consultant_id, currency_id, SUM(amount_current), SUM(amount_1_30),
+                   SUM(amount_31_60), SUM(amount_61_90), SUM(amount_90_plus), SUM(amount)
+              FROM visa_receivable_aging
+          GROUP BY student_id, consultant_id, currency_id
+        """)
+        self.invalidate_cache()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import tempfile
+import threading
+
+import xlsxwriter
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+# Excel limit is 1,048,576 rows per sheet, the first row holds the header
+SHEET_MAX_ROWS = 1048575
+FETCH_SIZE = 5000
+
+
+class VisaReportExport(models.Model):
+    _name = 'visa.report.export'
+    _description = 'Excel Report Export'
+    _order = 'id desc'
+
+    name = fields.Char(string='Name', required=True, default=lambda self: _('Export %s') % fields.Date.today())
+    report_type = fields.Selection([
+        ('applications', 'Applications'),
+        ('payments', 'Payments')
+    ], string='Report', required=True, default='applications')
+    include_archived = fields.Boolean(string='Include Archived')
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('queued', 'Queued'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    ], string='Status', default='draft', readonly=True, copy=False)
+    user_id = fields.Many2one('res.users', string='Requested By', default=lambda self: self.env.user, readonly=True)
+    row_count = fields.Integer(string='Rows', readonly=True, copy=False)
+    date_done = fields.Datetime(string='Generated On', readonly=True, copy=False)
+    attachment_id = fields.Many2one('ir.attachment', string='Workbook', readonly=True, copy=False)
+    error = fields.Text(string='Error', readonly=True, copy=False)
+
+    def action_queue(self):
+        self.write({'state': 'queued', 'error': False})
+        self.env.ref('student__visa__consultancy__management.ir_cron_visa_report_export')._trigger()
+
+    def action_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            raise UserError(_('The workbook has not been generated yet.'))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%s?download=true' % self.attachment_id.id,
+            'target': 'self',
+        }
+
+    @api.model
+    def _cron_generate_exports(self):
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for export in self.search([('state', '=', 'queued')], order='id'):
+            try:
+                with self.env.cr.savepoint():
+                    export.with_user(export.user_id)._generate()
+            except Exception as e:
+                _logger.exception('Report export %s failed', export.id)
+                export.write({'state': 'failed', 'error': str(e)})
+            if auto_commit:
+                self.env.cr.commit()
+
+    # ------------------------------------------------------------------
+    # Report definitions
+    # ------------------------------------------------------------------
+
+    def _get_report_definition(self, env):
+        """Return (model name, headers, select query, row builder) of the report.
+
+        The query is filtered on the ids allowed by the domain and record rules,
+        high cardinality names (student, application) are joined in SQL while
+        the small referentials are resolved from lookup dicts loaded once.
+        """
+        if self.report_type == 'payments':
+            return ('visa.payment', self._payment_headers(), """
+                SELECT p.name, s.name, s.email, a.name, p.payment_type, p.payment_method, p.amount, p.currency_id,
+                       p.payment_date, p.due_date, p.state
+                  FROM visa_payment p
+                  JOIN scope ON scope.id = p.id
+                  JOIN visa_student s ON s.id = p.student_id
+             LEFT JOIN visa_application a ON a.id = p.application_id
+              ORDER BY p.id
+            """, self._payment_row_builder(env))
+        return ('visa.application', self._application_headers(), """
+            SELECT a.name, s.name, s.email, a.university_id, a.course_id, a.consultant_id, a.intake, a.intake_year,
+                   a.application_date, a.state, a.service_fee, a.university_fee, a.total_fee, a.currency_id,
+                   COALESCE(pay.paid, 0), COALESCE(pay.pending, 0), pay.last_state
+              FROM visa_application a
+              JOIN scope ON scope.id = a.id
+              JOIN visa_student s ON s.id = a.student_id
+         LEFT JOIN LATERAL (
+                SELECT SUM(amount) FILTER (WHERE state = 'paid') AS paid,
+                       SUM(amount) FILTER (WHERE state = 'pending') AS pending,
+                       (ARRAY_AGG(state ORDER BY payment_date DESC, id DESC))[1] AS last_state
+                  FROM visa_payment
+                 WHERE application_id = a.id
+           ) pay ON TRUE
+          ORDER BY a.id
+        """, self._application_row_builder(env))
+
+    def _application_headers(self):
+        return [_('Application'), _('Student'), _('Student Email'), _('University'), _('Course'), _('Consultant'),
+                _('Intake'), _('Intake Year'), _('Application Date'), _('Status'), _('Service Fee'),
+                _('University Fee'), _('Total Fee'), _('Currency'), _('Paid'), _('Pending'), _('Payment Status')]
+
+    def _payment_headers(self):
+        return [_('Payment'), _('Student'), _('Student Email'), _('Application'), _('Type'), _('Method'),
+                _('Amount'), _('Currency'), _('Payment Date'), _('Due Date'), _('Status')]
+
+    def _selection_labels(self, env, model_name, field_name):
+        return dict(env[model_name]._fields[field_name]._description_selection(env))
+
+    def _name_lookup(self, env, model_name):
+        """{id: display name} of a whole referential, archived records included"""
+        records = env[model_name].with_context(active_test=False).search_read([], ['display_name'])
+        return {r['id']: r['display_name'] for r in records}
+
+    def _application_row_builder(self, env):
+        universities = self._name_lookup(env, 'visa.university')
+        courses = self._name_lookup(env, 'visa.course')
+        consultants = self._name_lookup(env, 'visa.consultant')
+        currencies = self._name_lookup(env, 'res.currency')
+        intakes = self._selection_labels(env, 'visa.application', 'intake')
+        states = self._selection_labels(env, 'visa.application', 'state')
+        payment_states = self._selection_labels(env, 'visa.payment', 'state')
+
+        def build(row):
+            (name, student, email, university_id, course_id, consultant_id, intake, intake_year, application_date,
+             state, service_fee, university_fee, total_fee, currency_id, paid, pending, last_state) = row
+            return [name, student, email or '', universities.get(university_id, ''), courses.get(course_id, ''),
+                    consultants.get(consultant_id, ''), intakes.get(intake, ''), intake_year or '', application_date,
+                    states.get(state, ''), service_fee or 0.0, university_fee or 0.0, total_fee or 0.0,
+                    currencies.get(currency_id, ''), paid, pending, payment_states.get(last_state, '')]
+        return build
+
+    def _payment_row_builder(self, env):
+        currencies = self._name_lookup(env, 'res.currency')
+        types = self._selection_labels(env, 'visa.payment', 'payment_type')
+        methods = self._selection_labels(env, 'visa.payment', 'payment_method')
+        states = self._selection_labels(env, 'visa.payment', 'state')
+
+        def build(row):
+            (name, student, email, application, payment_type, payment_method, amount, currency_id, payment_date,
+             due_date, state) = row
+            return [name or '', student, email or '', application or '', types.get(payment_type, ''),
+                    methods.get(payment_method, ''), amount or 0.0, currencies.get(currency_id, ''), payment_date,
+                    due_date, states.get(state, '')]
+        return build
+
+    # ------------------------------------------------------------------
+    # Generation
+    # ------------------------------------------------------------------
+
+    def _generate(self):
+        """Build the workbook, reading from the replica when one is configured, and attach it"""
+        self.ensure_one()
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            with self.env['visa.replica']._replica_env() as env:
+                row_count = self._write_workbook(env, path)
+            Attachment = self.env['ir.attachment'].sudo()
+            filename = '%s.xlsx' % self.name
+            self.attachment_id.sudo().unlink()
+            with open(path, 'rb') as stream:
+                attachment = Attachment._visa_create_streamed([{
+                    'name': filename,
+                    'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    'res_model': self._name,
+                    'res_id': self.id,
+                }], [stream])
+        finally:
+            os.unlink(path)
+        self.write({
+            'state': 'done',
+            'row_count': row_count,
+            'date_done': fields.Datetime.now(),
+            'attachment_id': attachment.id,
+        })
+        _logger.info('Report export %s: %s rows written', self.id, row_count)
+
+    def _write_workbook(self, env, path):
+        """Stream the report rows read in env into a constant memory workbook at path.
+
+        Rows come from a server-side cursor fetching FETCH_SIZE rows at a time
+        and xlsxwriter flushes each row to disk once written, so the memory used
+        does not depend on the number of rows. Returns the number of rows.
+        """
+        model_name, headers, query, build_row = self._get_report_definition(env)
+        Model = env[model_name].with_context(active_test=not self.include_archived)
+        scope = Model._where_calc([])
+        Model._apply_ir_rules(scope, 'read')
+        from_clause, where_clause, params = scope.get_sql()
+
+        workbook = xlsxwriter.Workbook(path, {
+            'constant_memory': True,
+            'default_date_format': 'yyyy-mm-dd',
+            'tmpdir': tempfile.gettempdir(),
+        })
+        header_format = workbook.add_format({'bold': True})
+        sheet, sheet_row, row_count = None, SHEET_MAX_ROWS, 0
+        # the named cursor does not see pending ORM writes of this transaction
+        self.flush()
+        # named cursor: rows stay on the server until fetched
+        with env.cr._cnx.cursor('visa_report_export_%s' % self.id) as cursor:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute("WITH scope AS (SELECT %s.id FROM %s WHERE %s) %s" % (
+                Model._table, from_clause, where_clause or 'TRUE', query), params)
+            for row in cursor:
+                if sheet_row >= SHEET_MAX_ROWS:
+                    sheet_name = '%s %s' % (self.report_type.title(), len(workbook.worksheets()) + 1)
+                    sheet = workbook.add_worksheet(sheet_name)
+                    sheet.write_row(0, 0, headers, header_format)
+                    sheet.freeze_panes(1, 0)
+                    sheet_row = 0
+                sheet_row += 1
+                row_count += 1
+                sheet.write_row(sheet_row, 0, build_row(row))
+        if sheet is None:
+            sheet = workbook.add_worksheet(self.report_type.title())
+            sheet.write_row(0, 0, headers, header_format)
+        workbook.close()
+        return row_count
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from odoo import models, fields, api, _
+
+from .applicatioon import CLOSED_STATES
+
+_logger = logging.getLogger(__name__)
+
+# Purged in this order, each model before the ones it depends on
+PURGE_MODELS = ['visa.invoice', 'visa.payment', 'visa.document', 'visa.application', 'visa.student']
+
+
+class VisaRetentionPolicy(models.Model):
+    _name = 'visa.retention.policy'
+    _description = 'Student Data Retention Policy'
+    _order = 'name'
+
+    name = fields.Char(string='Name', required=True)
+    active = fields.Boolean(string='Active', default=True)
+    inactive_days = fields.Integer(string='Untouched For (Days)', required=True, default=1825,
+                                   help='Students not modified for this many days are purged.')
+    archived_only = fields.Boolean(string='Archived Students Only', default=True)
+    batch_size = fields.Integer(string='Students per Batch', required=True, default=100)
+    candidate_count = fields.Integer(string='Students to Purge', compute='_compute_candidate_count')
+    run_ids = fields.One2many('visa.retention.run', 'policy_id', string='Runs')
+
+    def _compute_candidate_count(self):
+        for policy in self:
+            policy.candidate_count = len(policy._get_candidate_ids())
+
+    def _get_candidate_ids(self, after_id=0, limit=None):
+        """Ids of the students the policy purges, in id order after after_id.
+
+        Students with an open application or a pending payment are kept
+        whatever their age.
+        """
+        self.ensure_one()
+        cutoff = fields.Datetime.now() - timedelta(days=self.inactive_days)
+        self.env['visa.student'].flush(['active'])
+        self.env['visa.application'].flush(['state', 'student_id'])
+        self.env['visa.payment'].flush(['state', 'student_id'])
+        self.env.cr.execute("""
+            SELECT s.id
+              FROM visa_student s
+             WHERE s.id > %s
+               AND s.write_date < %s
+               AND (NOT %s OR NOT s.active)
+               AND NOT EXISTS (SELECT 1 FROM visa_application a WHERE a.student_id = s.id AND a.state NOT IN %s)
+               AND NOT EXISTS (SELECT 1 FROM visa_payment p WHERE p.student_id = s.id AND p.state = 'pending')
+          ORDER BY s.id
+             LIMIT %s
+        """, [after_id, cutoff, self.archived_only, tuple(CLOSED_STATES), limit])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def action_run(self):
+        self.ensure_one()
+        run = self.env['visa.retention.run'].create({
+            'policy_id': self.id,
+            'student_total': self.candidate_count,
+        })
+        run.action_start()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'visa.retention.run',
+            'res_id': run.id,
+            'view_mode': 'form',
+        }
+
+
+class VisaRetentionRun(models.Model):
+    _name = 'visa.retention.run'
+    _description = 'Student Data Purge Run'
+    _order = 'id desc'
+
+    name = fields.Char(string='Name', required=True, default=lambda self: _('Purge of %s') % fields.Date.today())
+    policy_id = fields.Many2one('visa.retention.policy', string='Policy', ondelete='set null', readonly=True)
+    student_ids = fields.Many2many('visa.student', string='Students', readonly=True,
+                                   help='Students to purge regardless of any policy.')
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled')
+    ], string='Status', default='draft', readonly=True, copy=False)
+    batch_size = fields.Integer(string='Students per Batch', default=100)
+
+    # Progress
+    last_student_id = fields.Integer(string='Last Purged Student', readonly=True, copy=False,
+                                     help='Resumes from here, ids are purged in increasing order.')
+    student_total = fields.Integer(string='Students Selected', readonly=True)
+    student_count = fields.Integer(string='Students Purged', readonly=True, copy=False)
+    record_count = fields.Integer(string='Related Records Purged', readonly=True, copy=False)
+    attachment_count = fields.Integer(string='Attachments Purged', readonly=True, copy=False)
+    message_count = fields.Integer(string='Messages Purged', readonly=True, copy=False)
+    batch_count = fields.Integer(string='Batches', readonly=True, copy=False)
+    duration = fields.Float(string='Time Spent (s)', readonly=True, copy=False)
+    progress = fields.Float(string='Progress', compute='_compute_throughput')
+    throughput = fields.Float(string='Students per Minute', compute='_compute_throughput')
+    date_start = fields.Datetime(string='Started', readonly=True, copy=False)
+    date_done = fields.Datetime(string='Finished', readonly=True, copy=False)
+    error = fields.Text(string='Error', readonly=True, copy=False)
+
+    @api.depends('student_count', 'student_total', 'duration')
+    def _compute_throughput(self):
+        for run in self:
+            run.progress = 100.0 * run.student_count / run.student_total if run.student_total else 0.0
+            run.throughput = 60.0 * run.student_count / run.duration if run.duration else 0.0
+
+    def _get_requested_ids(self):
+        # the requested students are archived, they must not be filtered out
+        self.ensure_one()
+        return sorted(self.with_context(active_test=False).student_ids.ids)
+
+    def action_start(self):
+        for run in self:
+            if not run.student_total:
+                run.student_total = len(run._get_requested_ids() or
+                                        (run.policy_id and run.policy_id._get_candidate_ids()) or [])
+        self.write({'state': 'running', 'date_start': fields.Datetime.now(), 'error': False})
+        self.env.ref('student__visa__consultancy__management.ir_cron_visa_retention')._trigger()
+
+    def action_cancel(self):
+        self.write({'state': 'cancelled'})
+
+    @api.model
+    def _request_purge(self, students):
+        """Hide the students now and purge them with their data in the background"""
+        students = students.sudo()
+        students.write({'active': False})
+        run = self.sudo().create({
+            'name': _('Deletion of %s') % ', '.join(students.mapped('name')),
+            'student_ids': [(6, 0, students.ids)],
+            'student_total': len(students),
+        })
+        run.action_start()
+        return run
+
+    def _next_batch(self):
+        self.ensure_one()
+        size = self.batch_size or self.policy_id.batch_size or 100
+        requested_ids = self._get_requested_ids()
+        if requested_ids:
+            return [student_id for student_id in requested_ids if student_id > self.last_student_id][:size]
+        if not self.policy_id:
+            return []
+        return self.policy_id._get_candidate_ids(after_id=self.last_student_id, limit=size)
+
+    @api.model
+    def _get_dependent_ids(self, student_ids):
+        """Ids per model of the students and everything deleted with them"""
+        cr = self.env.cr
+        cr.execute("SELECT id FROM visa_application WHERE student_id IN %s", [tuple(student_ids)])
+        application_ids = [row[0] for row in cr.fetchall()]
+        cr.execute("""
+            SELECT id FROM visa_document WHERE student_id IN %s OR application_id = ANY(%s)
+        """, [tuple(student_ids), application_ids])
+        document_ids = [row[0] for row in cr.fetchall()]
+        cr.execute("SELECT id FROM visa_payment WHERE student_id IN %s", [tuple(student_ids)])
+        payment_ids = [row[0] for row in cr.fetchall()]
+        cr.execute("""
+            SELECT id FROM visa_invoice
+             WHERE student_id IN %s OR application_id = ANY(%s) OR payment_id = ANY(%s)
+        """, [tuple(student_ids), application_ids, payment_ids])
+        invoice_ids = [row[0] for row in cr.fetchall()]
+        return {
+            'visa.invoice': invoice_ids,
+            'visa.payment': payment_ids,
+            'visa.document': document_ids,
+            'visa.application': application_ids,
+            'visa.student': list(student_ids),
+        }
+
+    @api.model
+    def _purge_mail_data(self, records_by_model):
+        """Delete messages, followers and activities of the records with one statement per table.
+
+        Tracking values and notifications go with their message through the
+        database cascade. Returns the number of messages deleted.
+        """
+        cr = self.env.cr
+        self.env['mail.message'].flush()
+        messages = 0
+        for model_name, res_ids in records_by_model.items():
+            if not res_ids:
+                continue
+            cr.execute("DELETE FROM mail_message WHERE model = %s AND res_id = ANY(%s)", [model_name, res_ids])
+            messages += cr.rowcount
+            cr.execute("DELETE FROM mail_followers WHERE res_model = %s AND res_id = ANY(%s)", [model_name, res_ids])
+            cr.execute("DELETE FROM mail_activity WHERE res_model = %s AND res_id = ANY(%s)", [model_name, res_ids])
+        self.env['mail.message'].invalidate_cache()
+        self.env['mail.followers'].invalidate_cache()
+        self.env['mail.activity'].invalidate_cache()
+        return messages
+
+    @api.model
+    def _purge_attachments(self, records_by_model):
+        """Unlink the attachments of the records, and the files of the documents, in one call.
+
+        Going through the ORM keeps the filestore garbage collection of the
+        deleted files.
+        """
+        domain = []
+        for model_name, res_ids in records_by_model.items():
+            if res_ids:
+                domain = (['|'] if domain else []) + domain + [
+                    '&', ('res_model', '=', model_name), ('res_id', 'in', res_ids)]
+        document_ids = records_by_model.get('visa.document')
+        if document_ids:
+            field = self.env['visa.document']._fields['attachment_ids']
+            self.env.cr.execute("SELECT %s FROM %s WHERE %s = ANY(%%s)" % (
+                field.column2, field.relation, field.column1), [document_ids])
+            domain = (['|'] if domain else []) + domain + [('id', 'in', [row[0] for row in self.env.cr.fetchall()])]
+        if not domain:
+            return 0
+        attachments = self.env['ir.attachment'].sudo().search(domain)
+        count = len(attachments)
+        attachments.unlink()
+        return count
+
+    def _purge_batch(self, student_ids):
+        """Delete a batch of students with all their data and record the progress"""
+        self.ensure_one()
+        started = time.monotonic()
+        records_by_model = self._get_dependent_ids(student_ids)
+        messages = self._purge_mail_data(records_by_model)
+        attachments = self._purge_attachments(records_by_model)
+        for model_name in PURGE_MODELS:
+            records = self.env[model_name].sudo().with_context(active_test=False).browse(records_by_model[model_name])
+            records.exists().unlink()
+        related = sum(len(ids) for model_name, ids in records_by_model.items() if model_name != 'visa.student')
+        self.write({
+            'last_student_id': max(student_ids),
+            'student_count': self.student_count + len(student_ids),
+            'record_count': self.record_count + related,
+            'attachment_count': self.attachment_count + attachments,
+            'message_count': self.message_count + messages,
+            'batch_count': self.batch_count + 1,
+            'duration': self.duration + time.monotonic() - started,
+        })
+        _logger.info('Retention run %s: purged %s students (%s records, %s attachments, %s messages) in %.1fs',
+                     self.id, len(student_ids), related, attachments, messages,
+                     time.monotonic() - started)
+
+    def _run(self, max_batches=20):
+        """Purge the students of the run in committed batches.
+
+        A batch either goes through entirely or not at all, and the run keeps
+        the last purged id, so an interrupted run resumes with the next batch.
+        Returns whether students are left.
+        """
+        self.ensure_one()
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for _iteration in range(max_batches):
+            student_ids = self._next_batch()
+            if not student_ids:
+                self.write({'state': 'done', 'date_done': fields.Datetime.now()})
+                return False
+            try:
+                with self.env.cr.savepoint():
+                    self._purge_batch(student_ids)
+            except Exception as e:
+                _logger.exception('Retention run %s failed', self.id)
+                self.env.clear()
+                self.write({'state': 'failed', 'error': str(e)})
+                return False
+            if auto_commit:
+                self.env.cr.commit()
+        return True
+
+    @api.model
+    def _cron_process_runs(self):
+        remaining = False
+        for run in self.search([('state', '=', 'running')], order='id'):
+            remaining = run._run() or remaining
+        if remaining:
+            self.env.ref('student__visa__consultancy__management.ir_cron_visa_retention')._trigger()
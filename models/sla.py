@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+
+
+class VisaSlaPolicy(models.Model):
+    _name = 'visa.sla.policy'
+    _description = 'Application Stage SLA'
+    _order = 'state'
+    _rec_name = 'state'
+
+    state = fields.Selection(selection=lambda self: self.env['visa.application']._fields['state'].selection,
+                             string='Stage', required=True)
+    days = fields.Integer(string='Days Allowed', required=True, default=7)
+    warning_days = fields.Integer(string='Warn Days Before', default=2,
+                                  help='The application becomes at risk this many days before its deadline.')
+    active = fields.Boolean(string='Active', default=True)
+
+    _sql_constraints = [
+        ('state_unique', 'unique(state)', 'There is already an SLA for this stage!')
+    ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(VisaSlaPolicy, self).create(vals_list)
+        records._recompute_application_deadlines()
+        return records
+
+    def write(self, vals):
+        states = set(self.mapped('state'))
+        res = super(VisaSlaPolicy, self).write(vals)
+        self._recompute_application_deadlines(states)
+        return res
+
+    def unlink(self):
+        states = set(self.mapped('state'))
+        res = super(VisaSlaPolicy, self).unlink()
+        self.browse()._recompute_application_deadlines(states)
+        return res
+
+    def _recompute_application_deadlines(self, extra_states=()):
+        """Deadlines depend on the policies, refresh the open applications of the affected stages"""
+        states = set(self.mapped('state')) | set(extra_states)
+        if not states:
+            return
+        Application = self.env['visa.application']
+        applications = Application.with_context(active_test=False).search([('state', 'in', list(states))])
+        fnames = ['deadline_at', 'sla_warning_at', 'sla_status']
+        for fname in fnames:
+            self.env.add_to_compute(Application._fields[fname], applications)
+        Application.recompute(fnames, applications)
@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import re
+
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 
+from .student_duplicate import MAX_BLOCK_SIZE, normalize_email, normalize_phone, phonetic_key
+from .success_stats import PROFILE_FIELDS
+
 
 class VisaStudent(models.Model):
     _name = 'visa.student'
     _description = 'Student Information'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'visa.change.stamp.mixin']
     _rec_name = 'name'
+    _change_stamp_fields = ('active', 'consultant_id')
 
     name = fields.Char(string='Full Name', required=True, tracking=True)
     email = fields.Char(string='Email', required=True, tracking=True)
@@ -76,8 +82,18 @@ class VisaStudent(models.Model):
     # Computed Fields
     application_count = fields.Integer(string='Applications', compute='_compute_application_count')
     document_count = fields.Integer(string='Documents', compute='_compute_document_count')
-    total_paid = fields.Monetary(string='Total Paid', compute='_compute_total_paid', currency_field='currency_id')
+    duplicate_count = fields.Integer(string='Possible Duplicates', compute='_compute_duplicate_count')
+    total_paid = fields.Monetary(string='Total Paid', compute='_compute_total_paid',
+                                 currency_field='company_currency_id')
+    company_currency_id = fields.Many2one('res.currency', string='Company Currency',
+                                          compute='_compute_company_currency_id')
     currency_id = fields.Many2one('res.currency', string='Currency', default=lambda self: self.env.company.currency_id)
+    consolidated_invoicing = fields.Boolean(string='Monthly Invoice',
+                                            help='Bill all payments of a month on one invoice instead of one '
+                                                 'invoice per payment.')
+
+    # Archived students are hidden until the retention purge deletes them
+    active = fields.Boolean(string='Active', default=True)
 
     # Notes
     notes = fields.Text(string='Notes')
@@ -87,6 +103,27 @@ class VisaStudent(models.Model):
         ('passport_unique', 'unique(passport_number)', 'Passport number must be unique!')
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(VisaStudent, self).create(vals_list)
+        records._update_block_keys()
+        records._find_duplicates()
+        return records
+
+    def write(self, vals):
+        Stats = self.env['visa.success.stats'].sudo()
+        old_stats = None
+        if PROFILE_FIELDS & set(vals):
+            applications = self.with_context(active_test=False).application_ids
+            old_stats = Stats._get_outcome_keys(applications)
+        res = super(VisaStudent, self).write(vals)
+        if {'name', 'email', 'phone', 'mobile', 'date_of_birth', 'passport_number'} & set(vals):
+            self._update_block_keys()
+            self._find_duplicates()
+        if old_stats is not None:
+            Stats._apply_deltas(old_stats, Stats._get_outcome_keys(applications))
+        return res
+
     @api.depends('date_of_birth')
     def _compute_age(self):
         for rec in self:
@@ -107,11 +144,32 @@ class VisaStudent(models.Model):
         for rec in self:
             rec.document_count = len(rec.document_ids)
 
-    @api.depends('payment_ids.amount', 'payment_ids.state')
+    @api.depends_context('company')
+    def _compute_company_currency_id(self):
+        self.company_currency_id = self.env.company.currency_id
+
+    @api.depends('payment_ids.amount', 'payment_ids.state', 'payment_ids.currency_id', 'payment_ids.payment_date')
     def _compute_total_paid(self):
+        # convert all students' payments with a single rate table
+        paid_payments = self.with_context(active_test=False).payment_ids.filtered(lambda p: p.state == 'paid')
+        amounts = self.env['visa.currency.converter']._convert_rows(
+            (p.currency_id.id, p.payment_date, p.amount) for p in paid_payments)
+        totals = dict.fromkeys(self.ids, 0.0)
+        for payment, amount in zip(paid_payments, amounts):
+            totals[payment.student_id.id] = totals.get(payment.student_id.id, 0.0) + amount
+        for rec in self:
+            rec.total_paid = totals.get(rec.id, 0.0)
+
+    def _compute_duplicate_count(self):
+        groups = {}
+        Duplicate = self.env['visa.student.duplicate']
+        for field_name in ('student_id', 'duplicate_id'):
+            for group in Duplicate.read_group([(field_name, 'in', self.ids), ('state', '=', 'new')],
+                                              [field_name], [field_name]):
+                student_id = group[field_name][0]
+                groups[student_id] = groups.get(student_id, 0) + group['%s_count' % field_name]
         for rec in self:
-            paid_payments = rec.payment_ids.filtered(lambda p: p.state == 'paid')
-            rec.total_paid = sum(paid_payments.mapped('amount'))
+            rec.duplicate_count = groups.get(rec.id, 0)
 
     @api.constrains('email')
     def _check_email(self):
@@ -125,6 +183,68 @@ class VisaStudent(models.Model):
             if rec.passport_expiry_date and rec.passport_expiry_date < fields.Date.today():
                 raise ValidationError(_('Passport has expired!'))
 
+    def _get_overdue_payments(self):
+        """Pending payments past their due date, used by the reminder template"""
+        self.ensure_one()
+        today = fields.Date.today()
+        return self.payment_ids.filtered(lambda p: p.state == 'pending' and p.due_date and p.due_date < today)
+
+    def _get_portal_summary(self, application_limit=10, payment_limit=20):
+        """Student 360 summary for the portal.
+
+        Built with a fixed number of grouped and batched reads, whatever the
+        number of applications, documents and payments of the student.
+        """
+        self.ensure_one()
+        domain = [('student_id', '=', self.id)]
+        Application = self.env['visa.application']
+        Document = self.env['visa.document']
+        Payment = self.env['visa.payment']
+        # paid and due totals include archived payments
+        Converter = self.env['visa.currency.converter'].with_context(active_test=False)
+
+        def histogram(model, groups):
+            labels = dict(model._fields['state']._description_selection(self.env))
+            return [{'state': g['state'], 'label': labels.get(g['state'], ''), 'count': g['__count']}
+                    for g in groups]
+
+        application_groups = Application.read_group(domain, ['state'], ['state'], lazy=False)
+        document_groups = Document.read_group(domain, ['state'], ['state'], lazy=False)
+        payment_groups = Payment.read_group(domain, ['state'], ['state'], lazy=False)
+        application_states = dict(Application._fields['state']._description_selection(self.env))
+        applications = Application.search_read(domain, [
+            'name', 'state', 'university_id', 'course_id', 'intake', 'intake_year', 'deadline_at',
+            'document_completeness'
+        ], order='create_date desc, id desc', limit=application_limit)
+        for app in applications:
+            app['state_label'] = application_states.get(app['state'], '')
+        payments = Payment.search_read(domain, [
+            'name', 'payment_type', 'payment_date', 'due_date', 'amount', 'currency_id', 'state', 'application_id'
+        ], order='payment_date desc, id desc', limit=payment_limit)
+
+        company = self.env.company
+        return {
+            'profile': self.read(['name', 'email', 'phone', 'passport_number', 'date_of_birth', 'country_id',
+                                  'state'])[0],
+            'counters': {
+                'applications': sum(g['__count'] for g in application_groups),
+                'documents': sum(g['__count'] for g in document_groups),
+                'payments': sum(g['__count'] for g in payment_groups),
+            },
+            'applications': applications,
+            'application_states': histogram(Application, application_groups),
+            'document_states': histogram(Document, document_groups),
+            'ledger': {
+                'payments': payments,
+                'payment_states': histogram(Payment, payment_groups),
+                'total_paid': Converter._sum_in_company_currency(
+                    'visa.payment', domain + [('state', '=', 'paid')], company=company),
+                'total_due': Converter._sum_in_company_currency(
+                    'visa.payment', domain + [('state', '=', 'pending')], company=company),
+                'currency_id': company.currency_id.id,
+            },
+        }
+
     def action_set_registered(self):
         self.state = 'registered'
 
@@ -152,4 +272,80 @@ class VisaStudent(models.Model):
             'type': 'ir.actions.act_window',
             'domain': [('student_id', '=', self.id)],
             'context': {'default_student_id': self.id}
-        }
\ No newline at end of file
+        }
+
+    def _get_block_keys(self):
+        keys = []
+        for rec in self:
+            phonetic = phonetic_key(rec.name)
+            if rec.date_of_birth and phonetic:
+                keys.append((rec.id, 'dob_name', '%s|%s' % (rec.date_of_birth, phonetic)))
+            for phone in {normalize_phone(rec.phone), normalize_phone(rec.mobile)} - {''}:
+                keys.append((rec.id, 'phone', phone))
+            if normalize_email(rec.email):
+                keys.append((rec.id, 'email', normalize_email(rec.email)))
+            if rec.passport_number:
+                keys.append((rec.id, 'passport', re.sub(r'\W', '', rec.passport_number).upper()))
+        return keys
+
+    def _update_block_keys(self):
+        """Replace the blocking keys of the students"""
+        if not self:
+            return
+        self.env.cr.execute("DELETE FROM visa_student_block_key WHERE student_id IN %s", [tuple(self.ids)])
+        keys = self._get_block_keys()
+        if keys:
+            student_ids, key_types, values = zip(*keys)
+            self.env.cr.execute("""
+                INSERT INTO visa_student_block_key (student_id, key_type, key)
+                SELECT * FROM unnest(%s::int[], %s::varchar[], %s::varchar[])
+            """, [list(student_ids), list(key_types), list(values)])
+
+    def _find_duplicates(self):
+        """Look for duplicates of these students only, using the blocking key index.
+
+        Oversized blocks are skipped, as in the full scan.
+        """
+        if not self:
+            return self.env['visa.student.duplicate']
+        self.env.cr.execute("""
+            WITH blocks AS (
+                SELECT key_type, key
+                  FROM visa_student_block_key
+                 WHERE (key_type, key) IN (SELECT key_type, key FROM visa_student_block_key WHERE student_id IN %s)
+              GROUP BY key_type, key
+                HAVING COUNT(*) <= %s
+            )
+            SELECT DISTINCT LEAST(mine.student_id, other.student_id), GREATEST(mine.student_id, other.student_id)
+              FROM visa_student_block_key mine
+              JOIN blocks ON blocks.key_type = mine.key_type AND blocks.key = mine.key
+              JOIN visa_student_block_key other
+                ON other.key_type = mine.key_type AND other.key = mine.key AND other.student_id != mine.student_id
+             WHERE mine.student_id IN %s
+        """, [tuple(self.ids), MAX_BLOCK_SIZE, tuple(self.ids)])
+        return self.env['visa.student.duplicate']._record_pairs(self.env.cr.fetchall())
+
+    def action_view_duplicates(self):
+        self.ensure_one()
+        return {
+            'name': _('Possible Duplicates'),
+            'view_mode': 'tree,form',
+            'res_model': 'visa.student.duplicate',
+            'type': 'ir.actions.act_window',
+            'domain': ['|', ('student_id', '=', self.id), ('duplicate_id', '=', self.id)],
+        }
+
+    def action_recommend_universities(self):
+        self.ensure_one()
+        wizard = self.env['visa.success.recommend'].create({'student_id': self.id})
+        return wizard.action_recommend()
+
+    @api.model
+    def _rebuild_block_keys(self, batch_size=10000):
+        """Recompute the blocking keys of all students, used after installing or changing the key rules"""
+        self.env.cr.execute("SELECT id FROM visa_student ORDER BY id")
+        student_ids = [row[0] for row in self.env.cr.fetchall()]
+        for start in range(0, len(student_ids), batch_size):
+            batch = self.browse(student_ids[start:start + batch_size])
+            batch._update_block_keys()
+            batch.invalidate_cache()
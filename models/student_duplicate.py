@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+from odoo import models, fields, api, _
+
+# Blocks bigger than this are too generic (shared office phone, ...) to be compared pairwise
+MAX_BLOCK_SIZE = 50
+DUPLICATE_THRESHOLD = 0.6
+
+SOUNDEX_CODES = {}
+for _letters, _code in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6')):
+    SOUNDEX_CODES.update(dict.fromkeys(_letters, _code))
+
+
+def normalize_name(name):
+    """Lowercase ascii tokens of a name, accents and punctuation removed, sorted"""
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    return sorted(re.findall(r'[a-z0-9]+', name))
+
+
+def soundex(token):
+    """American soundex of a single token, e.g. muhammad and mohammed both give M530"""
+    if not token:
+        return ''
+    code = token[0].upper()
+    previous = SOUNDEX_CODES.get(token[0], '')
+    for char in token[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if char not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def phonetic_key(name):
+    return '-'.join(sorted(soundex(token) for token in normalize_name(name) if not token.isdigit()))
+
+
+def normalize_phone(phone):
+    """Digits only, international prefix dropped, last 10 digits kept"""
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    return digits[-10:] if len(digits) >= 7 else ''
+
+
+def normalize_email(email):
+    local, _sep, domain = (email or '').strip().lower().partition('@')
+    if not domain:
+        return ''
+    local = local.split('+', 1)[0].replace('.', '')
+    return '%s@%s' % (local, domain)
+
+
+class VisaStudentBlockKey(models.Model):
+    _name = 'visa.student.block.key'
+    _description = 'Student Duplicate Blocking Key'
+    _log_access = False
+
+    student_id = fields.Many2one('visa.student', string='Student', required=True, ondelete='cascade', index=True)
+    key_type = fields.Selection([
+        ('dob_name', 'Date of Birth and Name'),
+        ('phone', 'Phone'),
+        ('email', 'Email'),
+        ('passport', 'Passport')
+    ], string='Key Type', required=True)
+    key = fields.Char(string='Key', required=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS visa_student_block_key_key_idx
+            ON visa_student_block_key (key_type, key)
+        """)
+
+
+class VisaStudentDuplicate(models.Model):
+    _name = 'visa.student.duplicate'
+    _description = 'Possible Duplicate Student'
+    _order = 'score desc, id desc'
+
+    student_id = fields.Many2one('visa.student', string='Student', required=True, ondelete='cascade', index=True)
+    duplicate_id = fields.Many2one('visa.student', string='Possible Duplicate', required=True, ondelete='cascade',
+                                   index=True)
+    score = fields.Float(string='Score', digits=(3, 2))
+    reasons = fields.Char(string='Matching On')
+    state = fields.Selection([
+        ('new', 'To Review'),
+        ('merged', 'Merged'),
+        ('ignored', 'Not a Duplicate')
+    ], string='Status', default='new')
+
+    _sql_constraints = [
+        ('pair_unique', 'unique(student_id, duplicate_id)', 'This pair of students is already recorded!')
+    ]
+
+    def action_ignore(self):
+        self.write({'state': 'ignored'})
+
+    def action_merge(self):
+        self.ensure_one()
+        return {
+            'name': _('Merge Students'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'visa.student.merge',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': {
+                'default_student_ids': [(6, 0, (self.student_id | self.duplicate_id).ids)],
+                'default_master_id': self.student_id.id,
+            },
+        }
+
+    @api.model
+    def _score_pairs(self, pairs):
+        """Score candidate (student id, student id) pairs, return the ones above the threshold"""
+        student_ids = {student_id for pair in pairs for student_id in pair}
+        fields_list = ['name', 'email', 'phone', 'mobile', 'date_of_birth', 'passport_number']
+        students = {s['id']: s for s in self.env['visa.student'].search_read([('id', 'in', list(student_ids))],
+                                                                              fields_list)}
+        results = []
+        for left_id, right_id in pairs:
+            left, right = students.get(left_id), students.get(right_id)
+            if not left or not right:
+                continue
+            reasons = []
+            name_ratio = SequenceMatcher(None, ' '.join(normalize_name(left['name'])),
+                                         ' '.join(normalize_name(right['name']))).ratio()
+            score = 0.4 * name_ratio
+            if name_ratio > 0.8:
+                reasons.append(_('name'))
+            if left['date_of_birth'] and left['date_of_birth'] == right['date_of_birth']:
+                score += 0.2
+                reasons.append(_('date of birth'))
+            left_phones = {normalize_phone(left['phone']), normalize_phone(left['mobile'])} - {''}
+            right_phones = {normalize_phone(right['phone']), normalize_phone(right['mobile'])} - {''}
+            if left_phones & right_phones:
+                score += 0.2
+                reasons.append(_('phone'))
+            if normalize_email(left['email']) and normalize_email(left['email']) == normalize_email(right['email']):
+                score += 0.1
+                reasons.append(_('email'))
+            if left['passport_number'] and \
+                    re.sub(r'\W', '', left['passport_number']).upper() == \
+                    re.sub(r'\W', '', right['passport_number'] or '').upper():
+                score += 0.1
+                reasons.append(_('passport'))
+            if score >= DUPLICATE_THRESHOLD:
+                results.append((left_id, right_id, round(score, 2), ', '.join(reasons)))
+        return results
+
+    @api.model
+    def _record_pairs(self, pairs):
+        """Score the pairs and store the new likely duplicates"""
+        if not pairs:
+            return self.browse()
+        scored = self._score_pairs(pairs)
+        if not scored:
+            return self.browse()
+        self.env.cr.execute("""
+            SELECT student_id, duplicate_id FROM visa_student_duplicate
+             WHERE (student_id, duplicate_id) IN %s
+        """, [tuple((left, right) for left, right, _score, _reasons in scored)])
+        known = set(self.env.cr.fetchall())
+        return self.create([{
+            'student_id': left,
+            'duplicate_id': right,
+            'score': score,
+            'reasons': reasons,
+        } for left, right, score, reasons in scored if (left, right) not in known])
+
+    @api.model
+    def _scan_duplicates(self, chunk_size=5000):
+        """Full scan: pairs are only built inside each blocking key, oversized blocks are skipped"""
+        self.env.cr.execute("""
+            WITH blocks AS (
+                SELECT key_type, key
+                  FROM visa_student_block_key
+              GROUP BY key_type, key
+                HAVING COUNT(*) BETWEEN 2 AND %s
+            )
+            SELECT DISTINCT a.student_id, b.student_id
+              FROM blocks
+              JOIN visa_student_block_key a ON a.key_type = blocks.key_type AND a.key = blocks.key
+              JOIN visa_student_block_key b ON b.key_type = blocks.key_type AND b.key = blocks.key
+             WHERE a.student_id < b.student_id
+        """, [MAX_BLOCK_SIZE])
+        pairs = self.env.cr.fetchall()
+        found = self.browse()
+        for start in range(0, len(pairs), chunk_size):
+            found |= self._record_pairs(pairs[start:start + chunk_size])
+        return found
+
+    @api.model
+    def action_scan_duplicates(self):
+        self._scan_duplicates()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Possible Duplicates'),
+            'res_model': 'visa.student.duplicate',
+            'view_mode': 'tree,form',
+            'domain': [('state', '=', 'new')],
+        }
+
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+
+DECIDED_STATES = ('visa_approved', 'rejected')
+# (mid, high) lower bounds of the overall score per test
+ENGLISH_BAND_LIMITS = {
+    'ielts': (6.0, 7.0),
+    'toefl': (80.0, 95.0),
+    'pte': (50.0, 65.0),
+    'duolingo': (100.0, 120.0),
+}
+# Weight, in decided applications, of the broader rate a narrow rate is pulled towards
+PRIOR_WEIGHT = 5.0
+PROFILE_FIELDS = {'english_test', 'overall_score', 'percentage'}
+
+ENGLISH_BANDS = [
+    ('none', 'No Test'),
+    ('low', 'Low'),
+    ('mid', 'Medium'),
+    ('high', 'High')
+]
+PERCENTAGE_BANDS = [
+    ('unknown', 'Unknown'),
+    ('under_60', 'Under 60%'),
+    ('60_75', '60% - 75%'),
+    ('over_75', 'Over 75%')
+]
+
+
+def english_band(english_test, overall_score):
+    limits = ENGLISH_BAND_LIMITS.get(english_test)
+    if not limits or not overall_score:
+        return 'none'
+    if overall_score >= limits[1]:
+        return 'high'
+    return 'mid' if overall_score >= limits[0] else 'low'
+
+
+def percentage_band(percentage):
+    """Band of a percentage, a value up to 10 is read as a CGPA out of 10"""
+    if not percentage or percentage <= 0:
+        return 'unknown'
+    if percentage <= 10:
+        percentage *= 10
+    if percentage < 60:
+        return 'under_60'
+    return '60_75' if percentage < 75 else 'over_75'
+
+
+class VisaSuccessStats(models.Model):
+    _name = 'visa.success.stats'
+    _description = 'Application Success Statistics'
+    _order = 'university_id, course_id, english_band, percentage_band'
+    _log_access = False
+
+    university_id = fields.Many2one('visa.university', string='University', required=True, readonly=True,
+                                    ondelete='cascade', index=True)
+    course_id = fields.Many2one('visa.course', string='Course', readonly=True, ondelete='cascade', index=True)
+    country_id = fields.Many2one('res.country', related='university_id.country_id', string='Country', store=True)
+    level = fields.Selection(related='course_id.level', string='Course Level', store=True)
+    english_band = fields.Selection(ENGLISH_BANDS, string='English Band', required=True, readonly=True)
+    percentage_band = fields.Selection(PERCENTAGE_BANDS, string='Percentage Band', required=True, readonly=True)
+
+    # Maintained incrementally by visa.application and visa.student
+    decided_count = fields.Integer(string='Decided', readonly=True, group_operator='sum')
+    approved_count = fields.Integer(string='Visa Approved', readonly=True, group_operator='sum')
+    success_rate = fields.Float(string='Success Rate (%)', readonly=True, group_operator=False)
+
+    def init(self):
+        # course is optional, so the key uses COALESCE for the upsert to find the row
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS visa_success_stats_key_idx
+            ON visa_success_stats (university_id, COALESCE(course_id, 0), english_band, percentage_band)
+        """)
+        self.env.cr.execute("SELECT 1 FROM visa_success_stats LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._rebuild_counts()
+
+    @api.model
+    def read_group(self, domain, fields, groupby, offset=0, limit=None, orderby=False, lazy=True):
+        """The rate of a group is its approved count over its decided count, not the average of its rows' rates"""
+        names = [spec.split(':')[0] for spec in fields]
+        if 'success_rate' not in names:
+            return super(VisaSuccessStats, self).read_group(domain, fields, groupby, offset=offset, limit=limit,
+                                                            orderby=orderby, lazy=lazy)
+        fields = [spec for spec in fields if spec.split(':')[0] != 'success_rate']
+        fields += [name for name in ('decided_count', 'approved_count') if name not in names]
+        groups = super(VisaSuccessStats, self).read_group(domain, fields, groupby, offset=offset, limit=limit,
+                                                          orderby=orderby, lazy=lazy)
+        for group in groups:
+            decided = group.get('decided_count') or 0
+            group['success_rate'] = 100.0 * (group.get('approved_count') or 0) / decided if decided else 0.0
+        return groups
+
+    # ------------------------------------------------------------------
+    # Outcome counts
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _get_outcome_keys(self, applications):
+        """{application id: (key, approved)} of the decided applications"""
+        result = {}
+        for app in applications:
+            if app.state not in DECIDED_STATES or not app.university_id:
+                continue
+            student = app.student_id
+            key = (app.university_id.id, app.course_id.id or None,
+                   english_band(student.english_test, student.overall_score), percentage_band(student.percentage))
+            result[app.id] = (key, 1 if app.state == 'visa_approved' else 0)
+        return result
+
+    @api.model
+    def _apply_deltas(self, before, after):
+        """Apply the difference between two _get_outcome_keys snapshots to the statistics"""
+        deltas = {}
+        for sign, snapshot in ((-1, before), (1, after)):
+            for key, approved in snapshot.values():
+                counts = deltas.setdefault(key, [0, 0])
+                counts[0] += sign
+                counts[1] += sign * approved
+        rows = [key + (decided, approved) for key, (decided, approved) in deltas.items() if decided or approved]
+        if not rows:
+            return self.browse()
+        # country and level are plain copies here, the stored related fields keep them current afterwards
+        self.env.cr.execute("""
+            INSERT INTO visa_success_stats AS s
+                   (university_id, course_id, country_id, level, english_band, percentage_band, decided_count,
+                    approved_count, success_rate)
+            SELECT v.university_id, v.course_id, u.country_id, c.level, v.english_band, v.percentage_band,
+                   v.decided, v.approved, 100.0 * v.approved / NULLIF(v.decided, 0)
+              FROM unnest(%s::int[], %s::int[], %s::varchar[], %s::varchar[], %s::int[], %s::int[])
+                   AS v (university_id, course_id, english_band, percentage_band, decided, approved)
+              JOIN visa_university u ON u.id = v.university_id
+         LEFT JOIN visa_course c ON c.id = v.course_id
+            ON CONFLICT (university_id, COALESCE(course_id, 0), english_band, percentage_band) DO UPDATE
+               SET decided_count = s.decided_count + EXCLUDED.decided_count,
+                   approved_count = s.approved_count + EXCLUDED.approved_count,
+                   success_rate = 100.0 * (s.approved_count + EXCLUDED.approved_count)
+                                  / NULLIF(s.decided_count + EXCLUDED.decided_count, 0)
+            RETURNING id
+        """, [list(column) for column in zip(*rows)])
+        stats = self.browse([row[0] for row in self.env.cr.fetchall()])
+        stats.invalidate_cache(['decided_count', 'approved_count', 'success_rate'])
+        return stats
+
+    @api.model
+    def _rebuild_counts(self, batch_size=5000):
+        """Recount every decided application, the incremental updates start from here"""
+        self.env.cr.execute("DELETE FROM visa_success_stats")
+        Application = self.env['visa.application'].with_context(active_test=False)
+        application_ids = Application.search([('state', 'in', DECIDED_STATES)]).ids
+        for start in range(0, len(application_ids), batch_size):
+            applications = Application.browse(application_ids[start:start + batch_size])
+            self._apply_deltas({}, self._get_outcome_keys(applications))
+            applications.invalidate_cache()
+        self.invalidate_cache()
+
+    @api.model
+    def action_rebuild(self):
+        self._rebuild_counts()
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
+
+    # ------------------------------------------------------------------
+    # Recommendations
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _recommend(self, student, country_id=None, level=None, limit=10):
+        """Active courses, and universities with applications without a course,
+        ranked by the expected visa success of the student.
+
+        The rate of the student profile on a course is smoothed towards the
+        course rate, the course rate towards the university rate and that one
+        towards the overall rate, so courses with little history stay ranked
+        by what is known about their university. Applications without a course
+        are ranked as one more candidate of their university, left out when a
+        level is asked for. Returns a list of dicts with course_id (False for
+        those), university_id, success_rate, profile_count and course_count.
+        """
+        student.ensure_one()
+        self.flush()
+        course_where, university_where = ["c.active", "c.university_id IS NOT NULL"], ["un.active"]
+        params = {
+            'english_band': english_band(student.english_test, student.overall_score),
+            'percentage_band': percentage_band(student.percentage),
+            'weight': PRIOR_WEIGHT,
+            'limit': limit,
+        }
+        if country_id:
+            course_where.append("c.country_id = %(country_id)s")
+            university_where.append("un.country_id = %(country_id)s")
+            params['country_id'] = country_id
+        if level:
+            course_where.append("c.level = %(level)s")
+            university_where.append("FALSE")
+            params['level'] = level
+        self.env.cr.execute("""
+            WITH overall AS (
+                SELECT COALESCE(SUM(approved_count)::float / NULLIF(SUM(decided_count), 0), 0) AS rate
+                  FROM visa_success_stats
+            ), universities AS (
+                SELECT s.university_id,
+                       (SUM(s.approved_count) + %(weight)s * overall.rate) / (SUM(s.decided_count) + %(weight)s)
+                           AS rate
+                  FROM visa_success_stats s, overall
+              GROUP BY s.university_id, overall.rate
+            ), outcomes AS (
+                -- per course, and per university for the applications without a course
+                SELECT CASE WHEN s.course_id IS NULL THEN s.university_id END AS university_id, s.course_id,
+                       SUM(s.decided_count) AS decided,
+                       SUM(s.approved_count) AS approved,
+                       COALESCE(SUM(s.decided_count) FILTER (WHERE s.english_band = %(english_band)s
+                                                               AND s.percentage_band = %(percentage_band)s), 0)
+                           AS profile_decided,
+                       COALESCE(SUM(s.approved_count) FILTER (WHERE s.english_band = %(english_band)s
+                                                                AND s.percentage_band = %(percentage_band)s), 0)
+                           AS profile_approved
+                  FROM visa_success_stats s
+              GROUP BY 1, 2
+            ), candidates AS (
+                SELECT c.id AS course_id, c.university_id, o.decided, o.approved, o.profile_decided,
+                       o.profile_approved
+                  FROM visa_course c
+             LEFT JOIN outcomes o ON o.course_id = c.id
+                 WHERE {course_where}
+             UNION ALL
+                SELECT NULL, o.university_id, o.decided, o.approved, o.profile_decided, o.profile_approved
+                  FROM outcomes o
+                  JOIN visa_university un ON un.id = o.university_id
+                 WHERE o.course_id IS NULL AND {university_where}
+            ), scored AS (
+                SELECT cd.course_id, cd.university_id,
+                       COALESCE(cd.profile_decided, 0) AS profile_count,
+                       COALESCE(cd.decided, 0) AS course_count,
+                       COALESCE(cd.profile_approved, 0) AS profile_approved,
+                       (COALESCE(cd.approved, 0) + %(weight)s * COALESCE(u.rate, overall.rate))
+                           / (COALESCE(cd.decided, 0) + %(weight)s) AS course_rate
+                  FROM candidates cd
+            CROSS JOIN overall
+             LEFT JOIN universities u ON u.university_id = cd.university_id
+            )
+            SELECT course_id, university_id, profile_count, course_count,
+                   100.0 * (profile_approved + %(weight)s * course_rate) / (profile_count + %(weight)s) AS success_rate
+              FROM scored
+          ORDER BY success_rate DESC, course_count DESC, university_id, course_id NULLS FIRST
+             LIMIT %(limit)s
+        """.format(course_where=' AND '.join(course_where), university_where=' AND '.join(university_where)),
+            params)
+        rows = self.env.cr.dictfetchall()
+        for row in rows:
+            row['course_id'] = row['course_id'] or False
+        return rows
@@ -6,8 +6,10 @@ from odoo import models, fields, api, _
 class VisaUniversity(models.Model):
     _name = 'visa.university'
     _description = 'University Information'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'visa.change.stamp.mixin']
     _rec_name = 'name'
+    # the catalog facet counts are cached on the university and course stamps
+    _change_stamp_fields = ('name', 'active', 'country_id', 'is_partner')
 
     name = fields.Char(string='University Name', required=True, tracking=True)
     code = fields.Char(string='University Code')
@@ -76,7 +78,9 @@ class VisaUniversity(models.Model):
 class VisaCourse(models.Model):
     _name = 'visa.course'
     _description = 'University Course'
+    _inherit = ['visa.change.stamp.mixin']
     _rec_name = 'name'
+    _change_stamp_fields = ('name', 'active', 'university_id', 'level', 'intake', 'tuition_fee')
 
     name = fields.Char(string='Course Name', required=True)
     code = fields.Char(string='Course Code')
@@ -104,6 +108,7 @@ class VisaCourse(models.Model):
         ('november', 'November'),
         ('december', 'December')
     ], string='Main Intake')
+    capacity = fields.Integer(string='Seats per Intake', help='Leave 0 when the course has no seat limit.')
 
     # Requirements
     required_percentage = fields.Float(string='Required Percentage')
@@ -112,8 +117,34 @@ class VisaCourse(models.Model):
     # Financial
     tuition_fee = fields.Monetary(string='Tuition Fee', currency_field='currency_id')
     currency_id = fields.Many2one('res.currency', related='university_id.currency_id', string='Currency')
+    fee_band = fields.Selection([
+        ('under_10k', 'Under 10,000'),
+        ('10k_20k', '10,000 - 20,000'),
+        ('20k_35k', '20,000 - 35,000'),
+        ('over_35k', 'Over 35,000')
+    ], string='Fee Band', compute='_compute_fee_band', store=True, index=True,
+        help='Band of the tuition fee in the university currency.')
+
+    # Stored copies of the university, for catalog facets without joins
+    country_id = fields.Many2one('res.country', related='university_id.country_id', string='Country', store=True,
+                                 index=True)
+    is_partner = fields.Boolean(related='university_id.is_partner', string='Partner University', store=True)
 
     # Status
     active = fields.Boolean(string='Active', default=True)
 
-    description = fields.Text(string='Description')
\ No newline at end of file
+    description = fields.Text(string='Description')
+
+    @api.depends('tuition_fee')
+    def _compute_fee_band(self):
+        for rec in self:
+            if not rec.tuition_fee:
+                rec.fee_band = False
+            elif rec.tuition_fee < 10000:
+                rec.fee_band = 'under_10k'
+            elif rec.tuition_fee < 20000:
+                rec.fee_band = '10k_20k'
+            elif rec.tuition_fee < 35000:
+                rec.fee_band = '20k_35k'
+            else:
+                rec.fee_band = 'over_35k'
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+
+# Models whose activities show up in the queue
+QUEUE_ACTIVITY_MODELS = ['visa.student', 'visa.application', 'visa.document', 'visa.payment']
+
+
+class VisaWorkQueue(models.AbstractModel):
+    _name = 'visa.work.queue'
+    _description = 'Consultant Work Queue'
+
+    @api.model
+    def _get_consultant(self):
+        return self.env['visa.consultant'].search([('user_id', '=', self.env.uid)], limit=1)
+
+    @api.model
+    def _scoped_select(self, model_name, domain, select):
+        """SELECT over the records of model_name matching domain, record rules included"""
+        Model = self.env[model_name]
+        query = Model._where_calc(domain)
+        Model._apply_ir_rules(query, 'read')
+        from_clause, where_clause, params = query.get_sql()
+        return 'SELECT %s FROM %s WHERE %s' % (select, from_clause, where_clause or 'TRUE'), params
+
+    @api.model
+    def _get_sources(self, consultant):
+        """(sql, params) of every kind of work item, all with the same columns.
+
+        item_id is unique over the kinds and breaks priority ties, priority is
+        higher for what needs attention first.
+        """
+        today = fields.Date.context_today(self)
+        sources = []
+        if consultant:
+            sources.append(self._scoped_select('visa.document', [
+                ('state', 'in', ('pending', 'received')),
+                ('student_id.consultant_id', '=', consultant.id),
+            ], """
+                4 * "visa_document".id AS item_id, 'document' AS kind, 'visa.document' AS res_model,
+                "visa_document".id AS res_id, "visa_document".name::varchar AS name,
+                "visa_document".student_id, "visa_document".state::varchar AS status,
+                "visa_document".expiry_date AS due_date,
+                CASE WHEN "visa_document".state = 'received' THEN 45 ELSE 30 END
+                    + LEAST(CURRENT_DATE - "visa_document".create_date::date, 20) AS priority
+            """))
+            sources.append(self._scoped_select('visa.payment', [
+                ('state', '=', 'pending'),
+                ('due_date', '<', today),
+                ('student_id.consultant_id', '=', consultant.id),
+            ], """
+                4 * "visa_payment".id + 1, 'payment', 'visa.payment', "visa_payment".id,
+                "visa_payment".name::varchar, "visa_payment".student_id, "visa_payment".state::varchar,
+                "visa_payment".due_date,
+                50 + LEAST(CURRENT_DATE - "visa_payment".due_date, 50)
+            """))
+            sources.append(self._scoped_select('visa.application', [
+                ('consultant_id', '=', consultant.id),
+                '|', ('state', '=', 'draft'), ('sla_status', 'in', ('at_risk', 'breached')),
+            ], """
+                4 * "visa_application".id + 2, 'application', 'visa.application', "visa_application".id,
+                "visa_application".name::varchar, "visa_application".student_id,
+                "visa_application".state::varchar, "visa_application".deadline_at::date,
+                CASE "visa_application".sla_status
+                    WHEN 'breached' THEN 90
+                    WHEN 'at_risk' THEN 65
+                    ELSE 20 + LEAST((CURRENT_DATE - "visa_application".create_date::date) / 7, 20)
+                END
+            """))
+        sources.append(self._scoped_select('mail.activity', [
+            ('user_id', '=', self.env.uid),
+            ('res_model', 'in', QUEUE_ACTIVITY_MODELS),
+        ], """
+            4 * "mail_activity".id + 3, 'activity', "mail_activity".res_model::varchar, "mail_activity".res_id,
+            COALESCE("mail_activity".summary, "mail_activity".res_name)::varchar,
+            CASE WHEN "mail_activity".res_model = 'visa.student' THEN "mail_activity".res_id END,
+            NULL::varchar, "mail_activity".date_deadline,
+            CASE WHEN "mail_activity".date_deadline < CURRENT_DATE
+                     THEN 70 + LEAST(CURRENT_DATE - "mail_activity".date_deadline, 30)
+                 WHEN "mail_activity".date_deadline = CURRENT_DATE THEN 55
+                 ELSE 10
+            END
+        """))
+        return sources
+
+    @api.model
+    def _get_items(self, limit=20, after=None):
+        """One page of the current user's work queue, most urgent first.
+
+        All kinds of items come from a single UNION ALL query whose priority is
+        computed once; pages are read with a (priority, item_id) keyset, so
+        later pages cost the same as the first one. Pass the returned
+        next_cursor as after to read the next page, a malformed cursor reads
+        an empty page.
+        """
+        cursor = self._parse_cursor(after) if after else None
+        if after and not cursor:
+            return {'items': [], 'next_cursor': False}
+        for model_name in ('visa.document', 'visa.payment', 'visa.application', 'mail.activity'):
+            self.env[model_name].flush()
+        sources = self._get_sources(self._get_consultant())
+        params = [param for _sql, source_params in sources for param in source_params]
+        keyset = ''
+        if cursor:
+            priority, item_id = cursor
+            keyset = 'WHERE (priority, item_id) < (%s, %s)'
+            params += [priority, item_id]
+        self.env.cr.execute("""
+            WITH queue AS MATERIALIZED (%s)
+            SELECT item_id, kind, res_model, res_id, name, student_id, status, due_date, priority
+              FROM queue
+              %s
+          ORDER BY priority DESC, item_id DESC
+             LIMIT %%s
+        """ % ('\nUNION ALL\n'.join(sql for sql, _params in sources), keyset), params + [limit + 1])
+        rows = self.env.cr.dictfetchall()
+        next_cursor = False
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = '%s-%s' % (rows[-1]['priority'], rows[-1]['item_id'])
+        students = dict(self.env['visa.student'].browse(
+            list({row['student_id'] for row in rows if row['student_id']})).sudo().name_get())
+        labels = {
+            'document': _('Document'),
+            'payment': _('Overdue Payment'),
+            'application': _('Application'),
+            'activity': _('Activity'),
+        }
+        for row in rows:
+            row['kind_label'] = labels[row['kind']]
+            row['student_name'] = students.get(row['student_id'], '')
+            row['url'] = self._get_item_url(row['res_model'], row['res_id'])
+        return {'items': rows, 'next_cursor': next_cursor}
+
+    @api.model
+    def _parse_cursor(self, after):
+        """(priority, item id) of a next_cursor, None when it is not one"""
+        try:
+            priority, item_id = (int(value) for value in str(after).split('-'))
+        except ValueError:
+            return None
+        return priority, item_id
+
+    @api.model
+    def _get_item_url(self, res_model, res_id):
+        routes = {
+            'visa.student': '/my/visa/student/%s',
+            'visa.application': '/my/visa/application/%s',
+            'visa.document': '/my/visa/document/%s',
+            'visa.payment': '/my/visa/payment/%s',
+        }
+        if res_model in routes:
+            return routes[res_model] % res_id
+        return '/web#model=%s&id=%s' % (res_model, res_id)
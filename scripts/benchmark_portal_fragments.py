@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Per-page render times of the portal lists, before and after the row fragment cache.
+
+Run inside an Odoo shell on a database with the module installed:
+
+    odoo-bin shell -d <database> < scripts/benchmark_portal_fragments.py
+
+Each portal list is split in pages of 20 rows, as the portal shows them.
+'before' renders every row on its own, 'cold' fills an empty fragment cache
+and 'warm' reads the cached rows back. Times are averages in milliseconds.
+"""
+
+MODULE = 'student__visa__consultancy__management'
+PAGES = 5
+PAGE_SIZE = 20
+
+LISTS = [
+    ('Students', MODULE + '.portal_student_card', 'visa.student', [], 'create_date desc'),
+    ('Applications', MODULE + '.portal_application_row', 'visa.application', [], 'create_date desc'),
+    ('Documents', MODULE + '.portal_document_row', 'visa.document', [], 'create_date desc'),
+]
+
+Fragment = env['visa.portal.fragment']  # noqa: F821 - provided by the Odoo shell
+for title, template, model_name, domain, order in LISTS:
+    records = env[model_name].search(domain, order=order, limit=PAGES * PAGE_SIZE)  # noqa: F821
+    print('%s (%s rows)' % (title, len(records)))
+    print('  %4s  %4s  %10s  %10s  %10s  %7s' % ('page', 'rows', 'before', 'cold', 'warm', 'speedup'))
+    for row in Fragment._benchmark(template, records, page_size=PAGE_SIZE):
+        print('  %4d  %4d  %8.1fms  %8.1fms  %8.1fms  %6.1fx' % (
+            row['page'], row['rows'], row['before'], row['cold'], row['warm'],
+            row['before'] / row['warm'] if row['warm'] else 0.0))
+env.cr.rollback()  # noqa: F821
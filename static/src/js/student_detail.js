@@ -0,0 +1,43 @@
+odoo.define('student__visa__consultancy__management.student_detail', function (require) {
+'use strict';
+
+var publicWidget = require('web.public.widget');
+
+/**
+ * Heavy sections of the portal student page (document list, messages) are
+ * only fetched the first time the user opens them.
+ */
+publicWidget.registry.VisaLazySection = publicWidget.Widget.extend({
+    selector: '.o_visa_lazy_section',
+    events: {
+        'click .o_visa_lazy_toggle': '_onToggle',
+    },
+
+    //--------------------------------------------------------------------------
+    // Handlers
+    //--------------------------------------------------------------------------
+
+    /**
+     * @private
+     * @param {Event} ev
+     */
+    _onToggle: function (ev) {
+        ev.preventDefault();
+        var $body = this.$('.o_visa_lazy_body');
+        $body.toggleClass('d-none');
+        if (this._loaded || $body.hasClass('d-none')) {
+            return;
+        }
+        this._loaded = true;
+        var self = this;
+        $.get(this.$el.data('src')).then(function (html) {
+            $body.html(html);
+        }, function () {
+            self._loaded = false;
+            $body.html($('<p class="text-danger text-center mb-0"/>').text('Could not load this section.'));
+        });
+    },
+});
+
+return publicWidget.registry.VisaLazySection;
+});
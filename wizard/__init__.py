@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from . import bank_statement_import
+from . import student_merge
+from . import payment_plan_apply
+from . import success_recommend
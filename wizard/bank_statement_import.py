@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import csv
+import io
+from collections import defaultdict
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools import float_compare
+
+REFERENCE_COLUMNS = ('reference', 'transaction_id', 'cheque_number')
+
+
+class VisaBankStatementImport(models.TransientModel):
+    _name = 'visa.bank.statement.import'
+    _description = 'Bank Statement Import'
+
+    data_file = fields.Binary(string='Bank Statement (CSV)', required=True)
+    filename = fields.Char(string='File Name')
+    delimiter = fields.Selection([
+        (',', 'Comma'),
+        (';', 'Semicolon'),
+        ('\t', 'Tab')
+    ], string='Delimiter', default=',', required=True)
+
+    # Results
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done')
+    ], string='Status', default='draft')
+    line_count = fields.Integer(string='Statement Lines', readonly=True)
+    matched_count = fields.Integer(string='Matched Payments', readonly=True)
+    unmatched_references = fields.Text(string='Unmatched Lines', readonly=True)
+    payment_ids = fields.Many2many('visa.payment', string='Settled Payments', readonly=True)
+
+    def _read_lines(self):
+        """Yield (reference, amount) from the CSV, the header must have an amount
+        column and at least one of reference, transaction_id or cheque_number"""
+        content = base64.b64decode(self.data_file).decode('utf-8-sig')
+        reader = csv.DictReader(io.StringIO(content), delimiter=self.delimiter)
+        headers = {h.strip().lower(): h for h in reader.fieldnames or []}
+        ref_headers = [headers[c] for c in REFERENCE_COLUMNS if c in headers]
+        if 'amount' not in headers or not ref_headers:
+            raise UserError(_('The statement needs an "amount" column and a "reference", '
+                              '"transaction_id" or "cheque_number" column.'))
+        for row in reader:
+            reference = next((row[h].strip() for h in ref_headers if (row.get(h) or '').strip()), '')
+            try:
+                amount = float((row[headers['amount']] or '0').replace(',', ''))
+            except ValueError:
+                amount = 0.0
+            yield reference, amount
+
+    @api.model
+    def _build_payment_index(self):
+        """Hash index of the open payments by normalized transaction id and cheque number"""
+        index = defaultdict(list)
+        payments = self.env['visa.payment'].search_read(
+            [('state', 'in', ['draft', 'pending']),
+             '|', ('transaction_id', '!=', False), ('cheque_number', '!=', False)],
+            ['transaction_id', 'cheque_number', 'amount'])
+        for payment in payments:
+            for reference in (payment['transaction_id'], payment['cheque_number']):
+                if reference:
+                    index[reference.strip().upper()].append(payment)
+        return index
+
+    def action_import(self):
+        self.ensure_one()
+        index = self._build_payment_index()
+        matched_ids = set()
+        unmatched = []
+        line_count = 0
+        for reference, amount in self._read_lines():
+            line_count += 1
+            candidates = index.get(reference.upper(), [])
+            payment = next((p for p in candidates
+                            if p['id'] not in matched_ids
+                            and float_compare(p['amount'], amount, precision_digits=2) == 0), None)
+            if payment:
+                matched_ids.add(payment['id'])
+            else:
+                unmatched.append('%s;%s' % (reference, amount))
+
+        payments = self.env['visa.payment'].browse(sorted(matched_ids))
+        payments._settle()
+        self.write({
+            'state': 'done',
+            'line_count': line_count,
+            'matched_count': len(payments),
+            'unmatched_references': '\n'.join(unmatched),
+            'payment_ids': [(6, 0, payments.ids)],
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+
+
+class VisaPaymentPlanApply(models.TransientModel):
+    _name = 'visa.payment.plan.apply'
+    _description = 'Apply Payment Plan'
+
+    plan_id = fields.Many2one('visa.payment.plan', string='Payment Plan', required=True)
+    application_ids = fields.Many2many('visa.application', string='Applications')
+    start_date = fields.Date(string='First Due Date', required=True, default=fields.Date.today)
+    payment_method = fields.Selection(
+        selection=lambda self: self.env['visa.payment']._fields['payment_method'].selection,
+        string='Payment Method', required=True, default='bank_transfer')
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super(VisaPaymentPlanApply, self).default_get(fields_list)
+        if self.env.context.get('active_model') == 'visa.application' and self.env.context.get('active_ids'):
+            res.setdefault('application_ids', [(6, 0, self.env.context['active_ids'])])
+        return res
+
+    def action_apply(self):
+        self.ensure_one()
+        payments = self.plan_id._generate_installments(self.application_ids, self.start_date, self.payment_method)
+        return {
+            'name': _('Installments'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'visa.payment',
+            'view_mode': 'tree,form',
+            'domain': [('id', 'in', payments.ids)],
+        }
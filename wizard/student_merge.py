@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+# Records that describe the students themselves, they stay with the archived duplicates
+MERGE_SKIPPED_MODELS = ['visa.student.duplicate', 'visa.student.block.key']
+
+
+class VisaStudentMerge(models.TransientModel):
+    _name = 'visa.student.merge'
+    _description = 'Merge Duplicate Students'
+
+    student_ids = fields.Many2many('visa.student', string='Students')
+    master_id = fields.Many2one('visa.student', string='Student to Keep', required=True,
+                                domain="[('id', 'in', student_ids)]")
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super(VisaStudentMerge, self).default_get(fields_list)
+        if self.env.context.get('active_model') == 'visa.student' and self.env.context.get('active_ids'):
+            student_ids = self.env.context['active_ids']
+            res.setdefault('student_ids', [(6, 0, student_ids)])
+            res.setdefault('master_id', student_ids[0])
+        return res
+
+    def action_merge(self):
+        self.ensure_one()
+        duplicates = self.student_ids - self.master_id
+        if not duplicates:
+            raise UserError(_('Select at least two students to merge.'))
+        master = self.master_id
+
+        for model_name, field_name in self._get_student_references():
+            records = self.env[model_name].sudo().with_context(active_test=False).search(
+                [(field_name, 'in', duplicates.ids)])
+            records.write({field_name: master.id})
+        self.env['mail.message'].sudo().search([
+            ('model', '=', 'visa.student'), ('res_id', 'in', duplicates.ids)
+        ]).write({'res_id': master.id})
+        self.env['mail.activity'].sudo().search([
+            ('res_model', '=', 'visa.student'), ('res_id', 'in', duplicates.ids)
+        ]).write({'res_id': master.id})
+        followers = self.env['mail.followers'].sudo().search([
+            ('res_model', '=', 'visa.student'), ('res_id', 'in', duplicates.ids)
+        ])
+        master.message_subscribe(partner_ids=followers.partner_id.ids)
+        followers.unlink()
+
+        # complete the kept student with what only the duplicates know
+        vals = {}
+        for field_name in ('mobile', 'date_of_birth', 'passport_number', 'consultant_id', 'country_id'):
+            if not master[field_name]:
+                value = next((d[field_name] for d in duplicates if d[field_name]), False)
+                if value:
+                    vals[field_name] = value.id if isinstance(value, models.BaseModel) else value
+
+        # the duplicates are archived rather than deleted, so the reviewed pairs stay on record
+        self.env['visa.student.duplicate'].search([
+            '|', ('student_id', 'in', duplicates.ids), ('duplicate_id', 'in', duplicates.ids)
+        ]).write({'state': 'merged'})
+        self.env['visa.student.block.key'].sudo().search([('student_id', 'in', duplicates.ids)]).unlink()
+        master.message_post(body=_('Merged with: %s') % ', '.join(duplicates.mapped('name')))
+        if vals.get('passport_number'):
+            # the passport number is unique, it moves to the kept student
+            duplicates.filtered(lambda d: d.passport_number == vals['passport_number']).passport_number = False
+        duplicates.write({'active': False})
+        if vals:
+            master.write(vals)
+
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'visa.student',
+            'res_id': master.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
+    @api.model
+    def _get_student_references(self):
+        """(model, field) of every stored many2one to visa.student, so records added by
+        other models follow the merge too"""
+        references = []
+        for model_name in self.env.registry:
+            Model = self.env[model_name]
+            if Model._abstract or Model._transient or not Model._auto or model_name in MERGE_SKIPPED_MODELS:
+                continue
+            for field in Model._fields.values():
+                if field.type == 'many2one' and field.comodel_name == 'visa.student' and field.store:
+                    references.append((model_name, field.name))
+        return references
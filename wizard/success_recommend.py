@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+
+from ..models.success_stats import english_band, percentage_band
+
+
+class VisaSuccessRecommend(models.TransientModel):
+    _name = 'visa.success.recommend'
+    _description = 'University Recommendation'
+
+    student_id = fields.Many2one('visa.student', string='Student', required=True)
+    country_id = fields.Many2one('res.country', string='Destination Country')
+    level = fields.Selection(selection=lambda self: self.env['visa.course']._fields['level'].selection,
+                             string='Course Level')
+    limit = fields.Integer(string='Results', default=10)
+    english_band = fields.Char(string='English Band', compute='_compute_bands')
+    percentage_band = fields.Char(string='Percentage Band', compute='_compute_bands')
+    line_ids = fields.One2many('visa.success.recommend.line', 'wizard_id', string='Recommendations')
+
+    @api.depends('student_id.english_test', 'student_id.overall_score', 'student_id.percentage')
+    def _compute_bands(self):
+        Stats = self.env['visa.success.stats']
+        english_bands = dict(Stats._fields['english_band'].selection)
+        percentage_bands = dict(Stats._fields['percentage_band'].selection)
+        for rec in self:
+            student = rec.student_id
+            rec.english_band = english_bands[english_band(student.english_test, student.overall_score)]
+            rec.percentage_band = percentage_bands[percentage_band(student.percentage)]
+
+    def action_recommend(self):
+        self.ensure_one()
+        results = self.env['visa.success.stats']._recommend(self.student_id, country_id=self.country_id.id,
+                                                            level=self.level, limit=self.limit or 10)
+        self.line_ids = [(5, 0, 0)] + [(0, 0, {
+            'rank': rank,
+            'university_id': row['university_id'],
+            'course_id': row['course_id'],
+            'success_rate': row['success_rate'],
+            'profile_count': row['profile_count'],
+            'course_count': row['course_count'],
+        }) for rank, row in enumerate(results, 1)]
+        return {
+            'name': _('Recommended Universities'),
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+
+class VisaSuccessRecommendLine(models.TransientModel):
+    _name = 'visa.success.recommend.line'
+    _description = 'University Recommendation Line'
+    _order = 'rank'
+
+    wizard_id = fields.Many2one('visa.success.recommend', string='Recommendation', required=True,
+                                ondelete='cascade')
+    rank = fields.Integer(string='Rank')
+    university_id = fields.Many2one('visa.university', string='University')
+    course_id = fields.Many2one('visa.course', string='Course')
+    success_rate = fields.Float(string='Expected Success (%)', digits=(5, 1))
+    profile_count = fields.Integer(string='Similar Profiles',
+                                   help='Decided applications on this course with the same English and '
+                                        'percentage bands.')
+    course_count = fields.Integer(string='Course History', help='Decided applications on this course.')